@@ -0,0 +1,169 @@
+"""Admission control in front of the upstream APIs
+
+Two layers of token buckets keep the Gemini and Hugging Face quotas from
+being exhausted:
+
+* per-session buckets (keyed by ``session['chat_id']``) reject a client that
+  sends too many requests with a 429 and a ``Retry-After``,
+* per-upstream buckets pace the calls ``upstream.post`` makes to each host.
+  A request that cannot get a token right away is queued by reserving a
+  future slot, up to a maximum wait that depends on its priority;
+  interactive traffic may queue for longer than batch traffic, so under load
+  batch requests back off first and chat latency stays bounded. Requests
+  that would wait longer are rejected with ``Overloaded`` instead of piling
+  up.
+
+A 429 from an upstream blocks its bucket for the ``Retry-After`` the server
+asked for, so the following requests wait (or are turned away) locally
+instead of hitting the quota again.
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+INTERACTIVE = 0
+BATCH = 1
+
+MAX_WAIT = {
+    INTERACTIVE: float(os.environ.get('ADMISSION_MAX_WAIT', 10)),
+    BATCH: float(os.environ.get('ADMISSION_BATCH_MAX_WAIT', 1)),
+}
+
+current_priority = contextvars.ContextVar('admission_priority', default=INTERACTIVE)
+
+_upstream_limiters = {}
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted within its maximum wait"""
+
+    def __init__(self, retry_after, message='Too many requests'):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket that can hand out future slots (going into debt) up to a wait limit"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, max_wait=0.0):
+        """Take a token and return how long to wait before using it
+
+        Raises ``Overloaded`` (without taking a token) if the wait would be
+        longer than ``max_wait``.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0)
+            if wait > max_wait:
+                self.rejected += 1
+                raise Overloaded(wait)
+            self.tokens -= 1
+            self.admitted += 1
+            return wait
+
+    def penalize(self, seconds):
+        """Stop admitting for ``seconds`` (e.g. an upstream Retry-After)"""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = min(self.tokens, 0.0)
+
+    def stats(self):
+        with self.lock:
+            self.refill(time.monotonic())
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(self.tokens, 2),
+                'blocked_for': round(max(0.0, self.blocked_until - time.monotonic()), 1),
+                'admitted': self.admitted,
+                'rejected': self.rejected
+            }
+
+
+class KeyedLimiter:
+    """One token bucket per key (e.g. per session), keeping the most recently used keys"""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check(self, key):
+        """Admit one request for ``key``; returns 0, or the seconds to wait before retrying"""
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+                while len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            self.buckets.move_to_end(key)
+        try:
+            bucket.reserve(0.0)
+            return 0.0
+        except Overloaded as e:
+            return e.retry_after
+
+
+def host_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def configure_upstream(url, rate, burst):
+    """Pace requests to ``url``'s host at ``rate`` per second (0 leaves it unlimited)"""
+    host = host_of(url)
+    if rate > 0 and host not in _upstream_limiters:
+        _upstream_limiters[host] = TokenBucket(rate, burst)
+
+
+def reserve(url):
+    """Admit a request to ``url`` at the current priority; returns the delay before sending it"""
+    bucket = _upstream_limiters.get(host_of(url))
+    if bucket is None:
+        return 0.0
+    return bucket.reserve(MAX_WAIT[current_priority.get()])
+
+
+def penalize(url, seconds):
+    bucket = _upstream_limiters.get(host_of(url))
+    if bucket is not None:
+        bucket.penalize(seconds)
+
+
+@contextlib.contextmanager
+def priority(level):
+    """Run the enclosed upstream calls at ``level`` (INTERACTIVE or BATCH)"""
+    token = current_priority.set(level)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def stats():
+    return {host: bucket.stats() for host, bucket in _upstream_limiters.items()}
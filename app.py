@@ -1,34 +1,82 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Blueprint, render_template, request, jsonify, session, Response, stream_with_context, send_from_directory, abort, g
 import requests
 from datetime import datetime
 import os
 import uuid
 import base64
+import re
 from werkzeug.utils import secure_filename
 import json
+import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import upstream
+import admission
+import model_health
+import response_cache
+import image_store
+import image_variants
+import image_normalization
+import image_jobs
+import conversation_store
+import session_store
+import traffic_capture
+import file_store
+import text_extraction
+import retrieval_index
+import markdown_render
+import batch
+import single_flight
+import metrics
+import log_config
+import config
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# Routes are registered on a blueprint; create_app() builds the Flask app around it
+bp = Blueprint('chatbot', __name__)
 
-# Configuration
-UPLOAD_FOLDER = 'static/uploads'
-GENERATED_IMAGES_FOLDER = 'static/generated_images'
+log_config.configure_logging()
+logger = logging.getLogger(__name__)
+
+# Configuration (deployment settings come from the environment, see config.py)
+UPLOAD_FOLDER = config.UPLOAD_FOLDER
+GENERATED_IMAGES_FOLDER = config.GENERATED_IMAGES_FOLDER
+# Server-side state (SQLite indexes and stores) lives outside the public static folder
+INSTANCE_FOLDER = config.INSTANCE_FOLDER
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'txt', 'docx'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['GENERATED_IMAGES_FOLDER'] = GENERATED_IMAGES_FOLDER
 
 # API configuration
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-GEMINI_API_KEY = "YOUR API KEY"
+GEMINI_API_BASE = config.GEMINI_API_BASE
+HF_API_BASE = config.HF_API_BASE
+GEMINI_API_URL = f"{GEMINI_API_BASE}/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_STREAM_URL = f"{GEMINI_API_BASE}/v1beta/models/gemini-2.0-flash:streamGenerateContent?alt=sse"
+GEMINI_API_KEY = config.GEMINI_API_KEY
 
 # Updated Hugging Face API for latest free image generation models
-HUGGING_FACE_API_KEY = "YOUR API KEY"
+HUGGING_FACE_API_KEY = config.HUGGING_FACE_API_KEY
+
+# Headers are built once and shared by every upstream call
+GEMINI_HEADERS = {
+    "Content-Type": "application/json",
+    "X-goog-api-key": GEMINI_API_KEY
+}
+
+HF_PUBLIC_HEADERS = {
+    "Content-Type": "application/json"
+}
+HF_AUTH_HEADERS = {
+    **HF_PUBLIC_HEADERS,
+    "Authorization": f"Bearer {HUGGING_FACE_API_KEY}"
+}
+
+# 503 from Hugging Face means "model loading" and is handled by the fallback
+# chain, so it is not retried in place
+HF_RETRY_STATUSES = upstream.RETRY_STATUSES - {503}
 
 # Latest free models (updated to current best free options)
 LATEST_FREE_MODELS = [
     {
-        "url": "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-schnell",
+        "url": f"{HF_API_BASE}/models/black-forest-labs/FLUX.1-schnell",
         "name": "FLUX.1 Schnell",
         "requires_auth": True,
         "params": {
@@ -39,7 +87,7 @@ LATEST_FREE_MODELS = [
         }
     },
     {
-        "url": "https://api-inference.huggingface.co/models/stabilityai/stable-diffusion-xl-base-1.0",
+        "url": f"{HF_API_BASE}/models/stabilityai/stable-diffusion-xl-base-1.0",
         "name": "SDXL 1.0",
         "requires_auth": True,
         "params": {
@@ -50,7 +98,7 @@ LATEST_FREE_MODELS = [
         }
     },
     {
-        "url": "https://api-inference.huggingface.co/models/runwayml/stable-diffusion-v1-5",
+        "url": f"{HF_API_BASE}/models/runwayml/stable-diffusion-v1-5",
         "name": "Stable Diffusion 1.5",
         "requires_auth": True,
         "params": {
@@ -61,7 +109,7 @@ LATEST_FREE_MODELS = [
         }
     },
     {
-        "url": "https://api-inference.huggingface.co/models/wavymulder/Analog-Diffusion",
+        "url": f"{HF_API_BASE}/models/wavymulder/Analog-Diffusion",
         "name": "Analog Diffusion",
         "requires_auth": True,
         "params": {
@@ -76,7 +124,7 @@ LATEST_FREE_MODELS = [
 # Free models that don't require API key (community models)
 FREE_COMMUNITY_MODELS = [
     {
-        "url": "https://api-inference.huggingface.co/models/ogkalu/Comic-Diffusion",
+        "url": f"{HF_API_BASE}/models/ogkalu/Comic-Diffusion",
         "name": "Comic Diffusion",
         "requires_auth": False,
         "params": {
@@ -87,7 +135,7 @@ FREE_COMMUNITY_MODELS = [
         }
     },
     {
-        "url": "https://api-inference.huggingface.co/models/prompthero/openjourney",
+        "url": f"{HF_API_BASE}/models/prompthero/openjourney",
         "name": "OpenJourney",
         "requires_auth": False,
         "params": {
@@ -99,18 +147,626 @@ FREE_COMMUNITY_MODELS = [
     }
 ]
 
+# Rate limits: each session may send SESSION_CHAT_RATE_PER_MIN chat messages and
+# SESSION_IMAGE_RATE_PER_MIN image requests per minute (with short bursts), and
+# calls to each upstream are paced at *_RATE_LIMIT requests per second
+SESSION_CHAT_RATE = float(os.environ.get('SESSION_CHAT_RATE_PER_MIN', 30)) / 60
+SESSION_CHAT_BURST = int(os.environ.get('SESSION_CHAT_BURST', 10))
+SESSION_IMAGE_RATE = float(os.environ.get('SESSION_IMAGE_RATE_PER_MIN', 6)) / 60
+SESSION_IMAGE_BURST = int(os.environ.get('SESSION_IMAGE_BURST', 3))
+GEMINI_RATE_LIMIT = float(os.environ.get('GEMINI_RATE_LIMIT', 5))
+GEMINI_RATE_BURST = int(os.environ.get('GEMINI_RATE_BURST', 10))
+HF_RATE_LIMIT = float(os.environ.get('HF_RATE_LIMIT', 2))
+HF_RATE_BURST = int(os.environ.get('HF_RATE_BURST', 4))
+
+session_limits = {
+    'chat': admission.KeyedLimiter(SESSION_CHAT_RATE, SESSION_CHAT_BURST),
+    'image': admission.KeyedLimiter(SESSION_IMAGE_RATE, SESSION_IMAGE_BURST)
+}
+admission.configure_upstream(GEMINI_API_URL, GEMINI_RATE_LIMIT, GEMINI_RATE_BURST)
+for _model in LATEST_FREE_MODELS + FREE_COMMUNITY_MODELS:
+    admission.configure_upstream(_model['url'], HF_RATE_LIMIT, HF_RATE_BURST)
+
+# Identical concurrent Gemini / image requests share one upstream call
+gemini_flights = single_flight.SingleFlight()
+image_flights = single_flight.SingleFlight()
+
+# Hedged image generation: start the top model, then race the next candidate
+# whenever IMAGE_HEDGE_DELAY seconds pass without a result or a model reports
+# it is loading. At most IMAGE_HEDGE_MAX_PARALLEL models run at once.
+IMAGE_HEDGING = os.environ.get('IMAGE_HEDGING', '1') != '0'
+IMAGE_HEDGE_DELAY = float(os.environ.get('IMAGE_HEDGE_DELAY', 10))
+IMAGE_HEDGE_MAX_PARALLEL = int(os.environ.get('IMAGE_HEDGE_MAX_PARALLEL', 3))
+
+# Background warm-up probes for the preferred image models (0 disables)
+MODEL_WARMUP_INTERVAL = float(os.environ.get('MODEL_WARMUP_INTERVAL', 0))
+MODEL_WARMUP_TOP_N = int(os.environ.get('MODEL_WARMUP_TOP_N', 2))
+
+# Image jobs: /image_jobs queues a prompt and returns a job ID at once; at most
+# IMAGE_JOB_WORKERS generations run at a time (IMAGE_JOB_MAX_QUEUED may wait),
+# and queued jobs survive restarts
+IMAGE_JOB_DB = os.environ.get('IMAGE_JOB_DB', os.path.join(INSTANCE_FOLDER, 'image_jobs.sqlite3'))
+IMAGE_JOB_HEARTBEAT = 15
+_image_jobs = None
+_image_jobs_lock = threading.Lock()
+
+# Generated images are returned by content-hashed URL ("url") or, for older
+# clients, additionally inlined as base64 in the JSON ("inline")
+IMAGE_RESPONSE_MODE = os.environ.get('IMAGE_RESPONSE_MODE', 'url')
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+IMAGE_FILENAME_PATTERN = re.compile(r'^(?P<stem>[0-9a-f]{64})(?P<variant>-(\d+|full))?\.(png|jpg|webp|gif|avif)$')
+IMAGE_MIME_TYPES = {
+    'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp', 'gif': 'image/gif', 'avif': 'image/avif'
+}
+
+# Disk quota for the generated image store; least recently used images are evicted
+IMAGE_STORE_QUOTA_BYTES = int(float(os.environ.get('IMAGE_STORE_QUOTA_MB', 1024)) * 1024 * 1024)
+_image_store = None
+_image_store_lock = threading.Lock()
+
+# Generated images are transcoded in the background (with Pillow installed)
+# into WebP/AVIF at IMAGE_VARIANT_WIDTHS; replies point at the
+# IMAGE_DISPLAY_WIDTH variant, with the full-size original linked alongside
+IMAGE_DISPLAY_WIDTH = int(os.environ.get('IMAGE_DISPLAY_WIDTH', max(image_variants.VARIANT_WIDTHS)))
+_image_variants = None
+_image_variants_lock = threading.Lock()
+
+# Server-side conversation history: the most recent turns that fit in
+# CONTEXT_TOKEN_BUDGET are sent with each message; with CONVERSATION_SUMMARIES=1
+# older turns are folded into a rolling summary instead of being dropped
+CONVERSATION_DB = os.environ.get('CONVERSATION_DB', os.path.join(INSTANCE_FOLDER, 'conversations.sqlite3'))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 6000))
+CONVERSATION_SUMMARIES = os.environ.get('CONVERSATION_SUMMARIES', '0') == '1'
+_conversation_store = None
+_conversation_store_lock = threading.Lock()
+
+# Sessions are kept server-side (SESSION_BACKEND, see session_store.py) so
+# every worker and host sees them; the cookie only carries a signed session ID.
+# SESSION_BACKEND=cookie keeps Flask's signed-cookie sessions. Without a
+# SECRET_KEY, a signing key is generated once and kept in SECRET_KEY_FILE
+SESSION_DB = os.environ.get('SESSION_DB', os.path.join(INSTANCE_FOLDER, 'sessions.sqlite3'))
+SECRET_KEY_FILE = os.path.join(INSTANCE_FOLDER, 'secret_key')
+_session_store = None
+_session_store_lock = threading.Lock()
+
+# Opt-in capture of sanitized request shapes (TRAFFIC_CAPTURE_PATH, see
+# traffic_capture.py) for replay with benchmarks/replay_traffic.py
+_traffic_recorder = None
+_traffic_recorder_lock = threading.Lock()
+
+# Attachments are uploaded once, deduplicated by SHA-256 and referenced by
+# file ID in later messages; they are kept out of the public static folder
+FILE_STORE_FOLDER = os.path.join(INSTANCE_FOLDER, 'uploads')
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 20)) * 1024 * 1024)
+MAX_CONTENT_LENGTH = MAX_UPLOAD_BYTES + 64 * 1024
+_file_store = None
+_file_store_lock = threading.Lock()
+
+# Text of PDF/DOCX/TXT attachments is extracted once per file (cached by
+# content hash). Documents up to ATTACHMENT_TEXT_MAX_CHARS are sent whole;
+# larger ones, and documents attached earlier in the conversation, are
+# represented by the passages that best match the message
+EXTRACTED_TEXT_FOLDER = os.path.join(INSTANCE_FOLDER, 'extracted')
+ATTACHMENT_TEXT_MAX_CHARS = int(os.environ.get('ATTACHMENT_TEXT_MAX_CHARS', 16000))
+RETRIEVAL_DB = os.path.join(INSTANCE_FOLDER, 'retrieval.sqlite3')
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get('RETRIEVAL_TOKEN_BUDGET', 3000))
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', 8))
+_retrieval_index = None
+_retrieval_index_lock = threading.Lock()
+_text_extractor = None
+_text_extractor_lock = threading.Lock()
+extraction_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='extract')
+
+# Image attachments are downscaled to INLINE_IMAGE_MAX_SIDE, reduced to their
+# first frame and re-encoded (with Pillow installed) before they are inlined
+# into Gemini requests; results are cached by content hash
+NORMALIZED_IMAGE_FOLDER = os.path.join(INSTANCE_FOLDER, 'normalized_images')
+_image_normalizer = None
+_image_normalizer_lock = threading.Lock()
+
+# Slash commands: prefixes, prompt template, system prompt and generation settings
+SLASH_COMMANDS = {
+    'quick': {
+        'prefixes': ['/quick ', '/q '],
+        'template': "{prompt}",
+        'system_prompt': "Provide a very concise and direct answer. Maximum 2-3 sentences. Get straight to the point without introductions or conclusions.",
+        'temperature': 0.3,
+        'max_tokens': 150,
+        'flag': 'quick_answer'
+    },
+    'summary': {
+        'prefixes': ['/summary ', '/summarize '],
+        'template': "Summarize this: {prompt}",
+        'system_prompt': "Provide a concise summary of the given text. Focus on key points and main ideas. Keep it brief and to the point.",
+        'temperature': 0.2,
+        'max_tokens': 200,
+        'flag': 'summary'
+    },
+    'bullet': {
+        'prefixes': ['/bullet ', '/points '],
+        'template': "{prompt}",
+        'system_prompt': "Provide the information as clear, concise bullet points. Use • for bullets. Maximum 5-6 points. No long explanations.",
+        'temperature': 0.2,
+        'max_tokens': 250,
+        'flag': 'bullet_points'
+    },
+    'define': {
+        'prefixes': ['/define ', '/whatis '],
+        'template': "What is {prompt}?",
+        'system_prompt': "Provide a clear, concise definition. Explain what it is in simple terms. Include key characteristics if relevant.",
+        'temperature': 0.1,
+        'max_tokens': 150,
+        'flag': 'definition'
+    }
+}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-@app.route('/')
+@bp.before_app_request
+def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.monotonic()
+    metrics.http_in_flight.inc((g.metrics_route,))
+
+@bp.after_app_request
+def note_response_metrics(response):
+    g.metrics_status = response.status_code
+    g.metrics_response_size = None if response.is_streamed else response.content_length
+    return response
+
+@bp.teardown_app_request
+def finish_request_metrics(error=None):
+    """Record the request once its context ends, which for streamed replies is when the stream closes"""
+    if 'metrics_started' not in g:
+        return
+    metrics.http_in_flight.dec((g.metrics_route,))
+    metrics.observe_request(
+        g.metrics_route,
+        request.method,
+        g.get('metrics_status', 500),
+        time.monotonic() - g.metrics_started,
+        request.content_length,
+        g.get('metrics_response_size')
+    )
+
+def get_traffic_recorder():
+    """The traffic recorder, or None unless TRAFFIC_CAPTURE_PATH is set"""
+    global _traffic_recorder
+    if _traffic_recorder is None and traffic_capture.CAPTURE_PATH:
+        with _traffic_recorder_lock:
+            if _traffic_recorder is None:
+                _traffic_recorder = traffic_capture.TrafficRecorder(traffic_capture.CAPTURE_PATH, secret_key())
+    return _traffic_recorder
+
+def attachment_size(file_data):
+    """Size in bytes of an attachment sent inline or by file ID, or None if unknown"""
+    if file_data.get('data'):
+        return len(str(file_data['data'])) * 3 // 4
+    file_id = file_data.get('file_id')
+    record = get_file_store().get(file_id) if isinstance(file_id, str) else None
+    return record['size'] if record else None
+
+def describe_captured_request(recorder, route, body, session_id, request_bytes):
+    """Sanitized capture record of a request, or None if its session is not sampled"""
+    if not recorder.sampled(session_id):
+        return None
+    if not isinstance(body, dict):
+        body = {}
+    command, _ = match_command(str(body.get('message') or ''))
+    return recorder.describe(
+        route, body, session_id, request_bytes,
+        command=SLASH_COMMANDS[command]['prefixes'][0].strip() if command else None,
+        attachment_size=attachment_size
+    )
+
+@bp.before_app_request
+def start_traffic_capture():
+    recorder = get_traffic_recorder()
+    if recorder is None or request.method != 'POST' or g.metrics_route not in traffic_capture.ROUTES:
+        return
+    try:
+        g.traffic_record = describe_captured_request(
+            recorder, g.metrics_route, request.get_json(silent=True), session_rate_key(), request.content_length
+        )
+    except Exception as e:
+        logger.warning("Could not describe request for traffic capture: %s", e)
+
+@bp.teardown_app_request
+def finish_traffic_capture(error=None):
+    record = g.pop('traffic_record', None)
+    if record is not None:
+        get_traffic_recorder().finish(
+            record, g.get('metrics_status', 500), time.monotonic() - g.metrics_started, g.get('metrics_response_size')
+        )
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.registry.render(), mimetype=metrics.CONTENT_TYPE)
+
+@bp.route('/')
 def index():
     if 'chat_id' not in session:
         session['chat_id'] = str(uuid.uuid4())
         session['conversation_name'] = "New Conversation"
     return render_template('index.html')
 
-@app.route('/send_message', methods=['POST'])
+def match_command(user_message):
+    """Return (command name, prompt) if the message starts with a slash command"""
+    for name, command in SLASH_COMMANDS.items():
+        if any(user_message.startswith(prefix) for prefix in command['prefixes']):
+            prompt = user_message
+            for prefix in command['prefixes']:
+                prompt = prompt.replace(prefix, '')
+            return name, prompt
+    return None, None
+
+def build_chat_payload(user_message, files, system_prompt, temperature, history=(), summary=None, passages=()):
+    """Build the Gemini payload for a regular chat message
+
+    ``history`` is a list of ``(id, role, text)`` turns from the conversation
+    store that precede this message, ``summary`` an optional rolling
+    summary of the turns before those, and ``passages`` document passages
+    retrieved for this message.
+    """
+    parts = []
+    payload = {
+        "contents": [
+            {"role": role, "parts": [{"text": text}]} for _, role, text in history
+        ] + [{
+            "role": "user",
+            "parts": parts
+        }],
+        "generationConfig": {
+            "temperature": temperature,
+            "topP": 0.95,
+            "maxOutputTokens": 2048
+        }
+    }
+    
+    # Add system instruction if provided
+    system_parts = []
+    if system_prompt:
+        system_parts.append({"text": system_prompt})
+    if summary:
+        system_parts.append({"text": f"Summary of the earlier part of this conversation: {summary}"})
+    if system_parts:
+        payload["systemInstruction"] = {
+            "parts": system_parts
+        }
+    
+    # Add user message
+    if user_message:
+        parts.append({"text": user_message})
+    
+    # Add files if any
+    for file_data in files:
+        if file_data.get('type', '').startswith('image/'):
+            # For image files, include as inline data, resolving uploaded file IDs
+            mime_type, data = attachment_image(file_data)
+            if not data:
+                raise ValueError(f"Unknown file: {file_data.get('name', 'file')}")
+            parts.append({
+                "inline_data": {
+                    "mime_type": mime_type,
+                    "data": data
+                }
+            })
+        else:
+            # For documents, include the extracted text (or just a reference if there is none)
+            reference = f"[Attached file: {file_data.get('name', 'file')}]"
+            text = attachment_text(file_data)
+            parts.append({
+                "text": f"{reference}\n{text}" if text else reference
+            })
+    
+    # Add passages retrieved from the conversation's documents
+    if passages:
+        excerpts = [f"[{passage['name']}, part {passage['seq'] + 1}]\n{passage['text']}" for passage in passages]
+        parts.append({
+            "text": "Relevant passages from attached documents:\n\n" + "\n\n".join(excerpts)
+        })
+    
+    return payload
+
+def get_file_store():
+    """The store for uploaded attachments, opened on first use"""
+    global _file_store
+    if _file_store is None:
+        with _file_store_lock:
+            if _file_store is None:
+                _file_store = file_store.FileStore(
+                    FILE_STORE_FOLDER,
+                    os.path.join(INSTANCE_FOLDER, 'file_index.sqlite3'),
+                    MAX_UPLOAD_BYTES
+                )
+    return _file_store
+
+def load_attachment_base64(file_id):
+    """Base64 content of an uploaded file, or None if the ID is unknown"""
+    if not file_id:
+        return None
+    return get_file_store().read_base64(file_id)
+
+def get_image_normalizer():
+    """The attachment image normalizer, created on first use"""
+    global _image_normalizer
+    if _image_normalizer is None:
+        with _image_normalizer_lock:
+            if _image_normalizer is None:
+                _image_normalizer = image_normalization.ImageNormalizer(NORMALIZED_IMAGE_FOLDER)
+    return _image_normalizer
+
+def attachment_image(file_data):
+    """``(mime_type, base64 data)`` of an image attachment as it is sent to Gemini
+
+    Uploaded images are normalized (downscaled, first frame only, re-encoded)
+    when possible and otherwise sent as uploaded. Returns ``(type, None)``
+    for unknown file IDs.
+    """
+    mime_type = file_data.get('type')
+    normalizer = get_image_normalizer()
+    if file_data.get('data'):
+        # Older clients send images inline
+        try:
+            content = base64.b64decode(file_data['data'])
+        except ValueError:
+            return mime_type, file_data['data']
+        normalized_type, normalized = normalizer.normalize_bytes(content, mime_type)
+    else:
+        record = get_file_store().get(file_data.get('file_id'))
+        if record is None:
+            return mime_type, None
+        normalized_type, normalized = normalizer.normalize(record['id'], record['path'], mime_type, record['size'])
+    if normalized is None:
+        return mime_type, file_data.get('data') or load_attachment_base64(file_data.get('file_id'))
+    return normalized_type, base64.b64encode(normalized).decode('utf-8')
+
+def prepare_attachment(file_id):
+    """Get an upload ready ahead of the message that uses it: normalize images, extract documents"""
+    record = get_file_store().get(file_id)
+    if record is not None and record['mime_type'].startswith('image/'):
+        return attachment_image({'file_id': file_id, 'type': record['mime_type']})[1] is not None
+    return prepare_attachment_text(file_id)
+
+def get_text_extractor():
+    """The attachment text extractor, created on first use"""
+    global _text_extractor
+    if _text_extractor is None:
+        with _text_extractor_lock:
+            if _text_extractor is None:
+                _text_extractor = text_extraction.TextExtractor(EXTRACTED_TEXT_FOLDER)
+    return _text_extractor
+
+def attachment_document(file_id):
+    """``(record, kind)`` for an uploaded document, or ``(record, None)`` if it has no text"""
+    record = get_file_store().get(file_id)
+    if record is None:
+        return None, None
+    return record, text_extraction.document_kind(record['name'], record['mime_type'])
+
+def attachment_text(file_data):
+    """Full text of a non-image attachment, or None if it has none or is too long to send whole"""
+    if not file_data.get('file_id'):
+        # Older clients send text files inline
+        content = file_data.get('content')
+        return content[:ATTACHMENT_TEXT_MAX_CHARS] if content else None
+    
+    record, kind = attachment_document(file_data['file_id'])
+    if kind is None:
+        return None
+    try:
+        text, truncated = get_text_extractor().read(record['id'], record['path'], kind, ATTACHMENT_TEXT_MAX_CHARS)
+    except Exception as e:
+        logger.warning("Could not extract text from %s: %s", record['name'], e, extra={'file_id': record['id']})
+        return None
+    # Long documents reach the model through retrieved passages instead
+    return None if truncated else text
+
+def prepare_attachment_text(file_id):
+    """Extract and index an uploaded document ahead of the message that uses it"""
+    record, kind = attachment_document(file_id)
+    if kind is None:
+        return False
+    try:
+        text_path = get_text_extractor().extract(record['id'], record['path'], kind)
+        get_retrieval_index().index_file(record['id'], record['name'], text_path)
+        return True
+    except Exception as e:
+        logger.warning("Could not extract text from %s: %s", record['name'], e, extra={'file_id': record['id']})
+        return False
+
+def get_retrieval_index():
+    """The document passage index, opened on first use"""
+    global _retrieval_index
+    if _retrieval_index is None:
+        with _retrieval_index_lock:
+            if _retrieval_index is None:
+                _retrieval_index = retrieval_index.RetrievalIndex(RETRIEVAL_DB)
+    return _retrieval_index
+
+def retrieve_passages(conversation_id, user_message, files):
+    """Passages from the conversation's documents that best match the message
+
+    Documents attached to this message are indexed (if they are not already)
+    and linked to the conversation, so later messages can draw on them too.
+    Documents sent whole with this message are left out of the search.
+    """
+    index = get_retrieval_index()
+    attached = []
+    sent_whole = set()
+    for file_data in files:
+        file_id = file_data.get('file_id')
+        if not file_id or file_data.get('type', '').startswith('image/'):
+            continue
+        if not prepare_attachment_text(file_id):
+            continue
+        attached.append(file_id)
+        if conversation_id:
+            index.add_to_conversation(conversation_id, file_id)
+        if attachment_text(file_data) is not None:
+            sent_whole.add(file_id)
+    
+    scope = index.conversation_files(conversation_id) if conversation_id else attached
+    scope = [file_id for file_id in scope if file_id not in sent_whole]
+    if not scope:
+        return []
+    
+    passages = index.search(user_message, scope, RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_TOP_K)
+    if not passages:
+        # Nothing to match on (e.g. "summarize this"): fall back to the start of the new documents
+        passages = index.leading([file_id for file_id in attached if file_id not in sent_whole],
+                                 RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_TOP_K)
+    return passages
+
+def forget_conversation_documents(conversation_ids):
+    """Unlink documents from deleted conversations (the shared index itself is kept)"""
+    index = get_retrieval_index()
+    for conversation_id in conversation_ids:
+        index.remove_conversation(conversation_id)
+
+def get_conversation_store():
+    """The server-side conversation store, opened on first use"""
+    global _conversation_store
+    if _conversation_store is None:
+        with _conversation_store_lock:
+            if _conversation_store is None:
+                _conversation_store = conversation_store.ConversationStore(CONVERSATION_DB)
+    return _conversation_store
+
+def secret_key():
+    """Signing key shared by every worker: SECRET_KEY, or one kept in the instance folder"""
+    return config.SECRET_KEY or session_store.persistent_secret_key(SECRET_KEY_FILE)
+
+def get_session_store():
+    """The server-side session store (None with SESSION_BACKEND=cookie)"""
+    global _session_store
+    if _session_store is None and session_store.SESSION_BACKEND != 'cookie':
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = session_store.SessionStore(
+                    session_store.load_backend(session_store.SESSION_BACKEND, SESSION_DB)
+                )
+    return _session_store
+
+def load_conversation_context(data, owner):
+    """Return ``(conversation_id, history, summary)`` for a chat request
+
+    The conversation is the one named by ``conversation_id`` in the request,
+    falling back to the session's chat id. Only the turns that fit in the
+    token budget (after the new message) are loaded. Requests sent with
+    ``"history": false`` are one-off and neither read nor extend a conversation.
+    """
+    conversation_id = data.get('conversation_id') or owner
+    if not conversation_id or data.get('history') is False:
+        return None, [], None
+    
+    store = get_conversation_store()
+    if not store.ensure(conversation_id, owner):
+        return None, [], None
+    
+    budget = CONTEXT_TOKEN_BUDGET - conversation_store.estimate_tokens(data.get('message', ''))
+    history, summary, _ = store.context_window(conversation_id, max(budget, 0))
+    return conversation_id, history, summary
+
+def record_exchange(conversation_id, user_message, files, ai_response):
+    """Append a user/model exchange to the conversation store"""
+    if not conversation_id:
+        return
+    
+    user_text = user_message
+    attached = [file_data.get('name', 'file') for file_data in files]
+    if attached:
+        user_text = f"{user_text}\n[Attached: {', '.join(attached)}]".strip()
+    
+    get_conversation_store().append_turns(conversation_id, [('user', user_text), ('model', ai_response)])
+    
+    if CONVERSATION_SUMMARIES:
+        threading.Thread(target=refresh_conversation_summary, args=(conversation_id,), daemon=True).start()
+
+def refresh_conversation_summary(conversation_id):
+    """Fold turns that no longer fit in the context window into the rolling summary"""
+    try:
+        store = get_conversation_store()
+        _, _, first_id = store.context_window(conversation_id, CONTEXT_TOKEN_BUDGET)
+        if first_id is None:
+            return
+        
+        summary, summary_upto = store.summary_state(conversation_id)
+        dropped = store.turns_before(conversation_id, first_id, summary_upto)
+        if not dropped:
+            return
+        
+        transcript = '\n'.join(f"{role}: {text}" for _, role, text in dropped)
+        if summary:
+            transcript = f"Earlier summary: {summary}\n{transcript}"
+        
+        with admission.priority(admission.BATCH):
+            response_data = gemini_generate(build_command_payload('summary', transcript), operation='summary')
+        store.set_summary(conversation_id, extract_response_text(response_data), dropped[-1][0])
+    except Exception as e:
+        logger.warning("Could not summarize conversation %s: %s", conversation_id, e)
+
+def extract_response_text(response_data):
+    """Safely pull the text of the first candidate out of a Gemini response"""
+    if 'candidates' in response_data and len(response_data['candidates']) > 0:
+        candidate = response_data['candidates'][0]
+        if 'content' in candidate and 'parts' in candidate['content'] and len(candidate['content']['parts']) > 0:
+            return candidate['content']['parts'][0].get('text', 'No response generated')
+        return "No content in response"
+    return "No candidates in response"
+
+def extract_stream_delta(response_data):
+    """Join the text parts of a single streamed Gemini chunk"""
+    candidates = response_data.get('candidates') or []
+    if not candidates:
+        return ''
+    parts = candidates[0].get('content', {}).get('parts', [])
+    return ''.join(part.get('text', '') for part in parts)
+
+def describe_request_error(e):
+    """Turn a requests exception into the most useful message available"""
+    error_msg = str(e)
+    if hasattr(e, 'response') and e.response is not None:
+        try:
+            error_details = e.response.json()
+            error_msg = error_details.get('error', {}).get('message', error_msg)
+        except:
+            pass
+    return error_msg
+
+def session_rate_key():
+    """Key for per-session rate limits (the client address for cookie-less callers)"""
+    return session.get('chat_id') or request.remote_addr
+
+def check_session_rate(kind):
+    """Seconds the current session must wait before another ``kind`` request, or 0"""
+    return session_limits[kind].check(session_rate_key())
+
+def rate_limited_response(retry_after, field='response'):
+    """429 response with a Retry-After header"""
+    seconds = max(1, int(retry_after + 0.999))
+    response = jsonify({
+        'status': 'error',
+        field: f"Too many requests, please try again in {seconds} seconds.",
+        'retry_after': seconds,
+        'timestamp': datetime.now().isoformat()
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+def sse_event(data):
+    """Encode a dict as a single Server-Sent Events message"""
+    return f"data: {json.dumps(data)}\n\n"
+
+@bp.route('/send_message', methods=['POST'])
 def send_message():
+    retry_after = check_session_rate('chat')
+    if retry_after:
+        return rate_limited_response(retry_after)
+    
     try:
         data = request.json
         user_message = data.get('message', '')
@@ -119,79 +775,22 @@ def send_message():
         temperature = float(data.get('temperature', 0.7))
         
         # Check for quick answer commands
-        if user_message.startswith('/quick ') or user_message.startswith('/q '):
-            prompt = user_message.replace('/quick ', '').replace('/q ', '')
-            return generate_quick_answer(prompt)
-        elif user_message.startswith('/summary ') or user_message.startswith('/summarize '):
-            prompt = user_message.replace('/summary ', '').replace('/summarize ', '')
-            return generate_summary(prompt)
-        elif user_message.startswith('/bullet ') or user_message.startswith('/points '):
-            prompt = user_message.replace('/bullet ', '').replace('/points ', '')
-            return generate_bullet_points(prompt)
-        elif user_message.startswith('/define ') or user_message.startswith('/whatis '):
-            prompt = user_message.replace('/define ', '').replace('/whatis ', '')
-            return generate_definition(prompt)
-        
-        # Create conversation payload
-        payload = {
-            "contents": [{
-                "parts": []
-            }],
-            "generationConfig": {
-                "temperature": temperature,
-                "topP": 0.95,
-                "maxOutputTokens": 2048
-            }
-        }
-        
-        # Add system instruction if provided
-        if system_prompt:
-            payload["systemInstruction"] = {
-                "parts": [{"text": system_prompt}]
-            }
+        command, prompt = match_command(user_message)
+        if command:
+            return jsonify(run_command(command, prompt))
         
-        # Add user message
-        if user_message:
-            payload["contents"][0]["parts"].append({"text": user_message})
-        
-        # Add files if any
-        for file_data in files:
-            if file_data.get('type', '').startswith('image/'):
-                # For image files, include as inline data
-                payload["contents"][0]["parts"].append({
-                    "inline_data": {
-                        "mime_type": file_data.get("type"),
-                        "data": file_data.get("data")
-                    }
-                })
-            else:
-                # For non-image files, include as text reference
-                payload["contents"][0]["parts"].append({
-                    "text": f"[Attached file: {file_data.get('name', 'file')}]"
-                })
+        # Create conversation payload with the recent history of this conversation
+        conversation_id, history, summary = load_conversation_context(data, session.get('chat_id'))
+        passages = retrieve_passages(conversation_id, user_message, files)
+        payload = build_chat_payload(user_message, files, system_prompt, temperature, history, summary, passages)
         
         # Make API request
-        headers = {
-            "Content-Type": "application/json",
-            "X-goog-api-key": GEMINI_API_KEY
-        }
-        
-        print(f"Sending request to Gemini API...")
-        response = requests.post(GEMINI_API_URL, json=payload, headers=headers, timeout=60)
-        response.raise_for_status()
-        
-        # Process response
-        response_data = response.json()
+        logger.debug("Sending request to Gemini API")
+        response_data = gemini_generate(payload, timeout=config.GEMINI_TIMEOUT)
         
         # Extract the response text safely
-        if 'candidates' in response_data and len(response_data['candidates']) > 0:
-            candidate = response_data['candidates'][0]
-            if 'content' in candidate and 'parts' in candidate['content'] and len(candidate['content']['parts']) > 0:
-                ai_response = candidate['content']['parts'][0].get('text', 'No response generated')
-            else:
-                ai_response = "No content in response"
-        else:
-            ai_response = "No candidates in response"
+        ai_response = extract_response_text(response_data)
+        record_exchange(conversation_id, user_message, files, ai_response)
         
         # Format response with markdown support
         formatted_response = format_response(ai_response)
@@ -202,175 +801,282 @@ def send_message():
             'timestamp': datetime.now().isoformat()
         })
         
+    except admission.Overloaded as e:
+        return rate_limited_response(e.retry_after)
     except requests.exceptions.RequestException as e:
-        error_msg = str(e)
-        if hasattr(e, 'response') and e.response:
-            try:
-                error_details = e.response.json()
-                error_msg = error_details.get('error', {}).get('message', error_msg)
-            except:
-                pass
-        print(f"API Error: {error_msg}")
+        error_msg = describe_request_error(e)
+        logger.warning("API error: %s", error_msg)
         return jsonify({
             'status': 'error',
             'response': f"Sorry, I encountered an error: {error_msg}",
             'timestamp': datetime.now().isoformat()
         }), 500
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error: %s", e)
         return jsonify({
             'status': 'error',
             'response': f"Unexpected error: {str(e)}",
             'timestamp': datetime.now().isoformat()
         }), 500
 
-def generate_quick_answer(prompt):
-    """Generate a quick, concise answer"""
-    quick_system_prompt = "Provide a very concise and direct answer. Maximum 2-3 sentences. Get straight to the point without introductions or conclusions."
-    
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }],
-        "generationConfig": {
-            "temperature": 0.3,
-            "topP": 0.8,
-            "maxOutputTokens": 150
-        },
-        "systemInstruction": {
-            "parts": [{"text": quick_system_prompt}]
-        }
-    }
-    
-    headers = {
-        "Content-Type": "application/json",
-        "X-goog-api-key": GEMINI_API_KEY
-    }
+@bp.route('/stream_message', methods=['POST'])
+def stream_message():
+    """Stream the reply token-by-token as Server-Sent Events
+
+    Emits ``delta`` events carrying raw text as Gemini produces it, followed by
+    a single ``done`` event whose payload matches the ``/send_message`` JSON.
+    Slash commands are not streamed; their result is sent as one ``done`` event.
+    """
+    retry_after = check_session_rate('chat')
+    if retry_after:
+        return rate_limited_response(retry_after)
     
-    response = requests.post(GEMINI_API_URL, json=payload, headers=headers, timeout=30)
-    response.raise_for_status()
+    try:
+        data = request.json
+        user_message = data.get('message', '')
+        files = data.get('files', [])
+        system_prompt = data.get('system_prompt', '')
+        temperature = float(data.get('temperature', 0.7))
+        
+        command, prompt = match_command(user_message)
+        if command:
+            result = run_command(command, prompt)
+            result['type'] = 'done'
+            return Response(sse_event(result), mimetype='text/event-stream')
+        
+        conversation_id, history, summary = load_conversation_context(data, session.get('chat_id'))
+        passages = retrieve_passages(conversation_id, user_message, files)
+        payload = build_chat_payload(user_message, files, system_prompt, temperature, history, summary, passages)
+        
+        logger.debug("Streaming request to Gemini API")
+        # Open the upstream stream before committing to a 200 so that auth and
+        # quota errors still come back as a regular JSON error response
+        with metrics.UpstreamCall('gemini', 'chat_stream'):
+            upstream_response = upstream.post(GEMINI_STREAM_URL, json=payload, headers=GEMINI_HEADERS, stream=True, timeout=config.GEMINI_TIMEOUT)
+            upstream_response.raise_for_status()
+        
+    except admission.Overloaded as e:
+        return rate_limited_response(e.retry_after)
+    except requests.exceptions.RequestException as e:
+        error_msg = describe_request_error(e)
+        logger.warning("API error: %s", error_msg)
+        return jsonify({
+            'status': 'error',
+            'response': f"Sorry, I encountered an error: {error_msg}",
+            'timestamp': datetime.now().isoformat()
+        }), 500
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'response': f"Unexpected error: {str(e)}",
+            'timestamp': datetime.now().isoformat()
+        }), 500
     
-    response_data = response.json()
-    ai_response = response_data['candidates'][0]['content']['parts'][0]['text']
+    def generate():
+        chunks = []
+        renderer = markdown_render.MarkdownRenderer()
+        try:
+            # text/event-stream is UTF-8, but without a charset requests would decode it as ISO-8859-1
+            upstream_response.encoding = 'utf-8'
+            for line in upstream_response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                delta = extract_stream_delta(json.loads(line[5:]))
+                if delta:
+                    chunks.append(delta)
+                    yield sse_event(stream_delta_event(renderer, delta))
+            
+            ai_response = ''.join(chunks) or "No content in response"
+            record_exchange(conversation_id, user_message, files, ai_response)
+            renderer.finish()
+            yield sse_event({
+                'type': 'done',
+                'status': 'success',
+                'response': renderer.html if chunks else format_response(ai_response),
+                'timestamp': datetime.now().isoformat()
+            })
+        except Exception as e:
+            logger.warning("Streaming error: %s", e)
+            yield sse_event({
+                'type': 'done',
+                'status': 'error',
+                'response': f"Sorry, I encountered an error: {str(e)}",
+                'timestamp': datetime.now().isoformat()
+            })
+        finally:
+            upstream_response.close()
     
-    return jsonify({
-        'status': 'success',
-        'response': format_response(ai_response),
-        'timestamp': datetime.now().isoformat(),
-        'quick_answer': True
-    })
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-def generate_summary(prompt):
-    """Generate a summary"""
-    summary_system_prompt = "Provide a concise summary of the given text. Focus on key points and main ideas. Keep it brief and to the point."
-    
-    payload = {
+def gemini_generate(payload, timeout=config.GEMINI_COMMAND_TIMEOUT, operation='chat'):
+    """Send a generateContent request through the shared upstream client
+
+    Concurrent calls with the same payload (at the same admission priority)
+    share one upstream request and all receive its response, or its error.
+    ``operation`` (``chat`` or the slash command name) labels the call's
+    metrics.
+    """
+    key = single_flight.payload_key(GEMINI_API_URL, payload, admission.current_priority.get())
+    return gemini_flights.do(key, lambda cancel: request_gemini(payload, timeout, operation))
+
+def request_gemini(payload, timeout, operation):
+    with metrics.UpstreamCall('gemini', operation) as call:
+        response = upstream.post(GEMINI_API_URL, json=payload, headers=GEMINI_HEADERS, timeout=timeout)
+        response.raise_for_status()
+        call.size = len(response.content)
+        return response.json()
+
+def build_command_payload(name, prompt):
+    """Build the Gemini payload for a slash command"""
+    command = SLASH_COMMANDS[name]
+    return {
         "contents": [{
-            "parts": [{"text": f"Summarize this: {prompt}"}]
+            "parts": [{"text": command['template'].format(prompt=prompt)}]
         }],
         "generationConfig": {
-            "temperature": 0.2,
+            "temperature": command['temperature'],
             "topP": 0.8,
-            "maxOutputTokens": 200
+            "maxOutputTokens": command['max_tokens']
         },
         "systemInstruction": {
-            "parts": [{"text": summary_system_prompt}]
+            "parts": [{"text": command['system_prompt']}]
         }
     }
-    
-    headers = {
-        "Content-Type": "application/json",
-        "X-goog-api-key": GEMINI_API_KEY
-    }
-    
-    response = requests.post(GEMINI_API_URL, json=payload, headers=headers, timeout=30)
-    response.raise_for_status()
-    
-    response_data = response.json()
-    ai_response = response_data['candidates'][0]['content']['parts'][0]['text']
-    
-    return jsonify({
+
+def command_result(name, ai_response, cached=False):
+    """Shape a slash command reply into the JSON returned for it"""
+    result = {
         'status': 'success',
         'response': format_response(ai_response),
         'timestamp': datetime.now().isoformat(),
-        'summary': True
-    })
-
-def generate_bullet_points(prompt):
-    """Generate bullet points"""
-    bullet_system_prompt = "Provide the information as clear, concise bullet points. Use • for bullets. Maximum 5-6 points. No long explanations."
-    
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }],
-        "generationConfig": {
-            "temperature": 0.2,
-            "topP": 0.8,
-            "maxOutputTokens": 250
-        },
-        "systemInstruction": {
-            "parts": [{"text": bullet_system_prompt}]
-        }
+        SLASH_COMMANDS[name]['flag']: True
     }
+    if cached:
+        result['cached'] = True
+    return result
+
+def command_cache_key(name, prompt):
+    """Response cache key for a slash command run"""
+    return response_cache.make_key(name, SLASH_COMMANDS[name], prompt)
+
+def run_command(name, prompt):
+    """Run a slash command against Gemini and return the response dict
+
+    Replies are served from the response cache when the same command and
+    (normalized) prompt were answered recently.
+    """
+    key = command_cache_key(name, prompt)
+    ai_response = response_cache.command_cache.get(key)
+    if ai_response is not None:
+        return command_result(name, ai_response, cached=True)
     
-    headers = {
-        "Content-Type": "application/json",
-        "X-goog-api-key": GEMINI_API_KEY
-    }
-    
-    response = requests.post(GEMINI_API_URL, json=payload, headers=headers, timeout=30)
-    response.raise_for_status()
-    
-    response_data = response.json()
+    payload = build_command_payload(name, prompt)
+    response_data = gemini_generate(payload, operation=name)
     ai_response = response_data['candidates'][0]['content']['parts'][0]['text']
-    
-    return jsonify({
-        'status': 'success',
-        'response': format_response(ai_response),
-        'timestamp': datetime.now().isoformat(),
-        'bullet_points': True
-    })
+    response_cache.command_cache.set(key, ai_response)
+    return command_result(name, ai_response)
 
-def generate_definition(prompt):
-    """Generate a definition"""
-    definition_system_prompt = "Provide a clear, concise definition. Explain what it is in simple terms. Include key characteristics if relevant."
-    
-    payload = {
-        "contents": [{
-            "parts": [{"text": f"What is {prompt}?"}]
-        }],
-        "generationConfig": {
-            "temperature": 0.1,
-            "topP": 0.8,
-            "maxOutputTokens": 150
-        },
-        "systemInstruction": {
-            "parts": [{"text": definition_system_prompt}]
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 16))
+
+BATCH_ADMISSION_MAX_WAIT = float(os.environ.get('BATCH_ADMISSION_MAX_WAIT', 300))
+
+def answer_batch_item(item):
+    """Answer one batch request at batch priority, waiting while upstreams are saturated
+
+    Batch calls give way to interactive traffic: when the upstream limiter
+    turns one away it sleeps for the suggested time and tries again, for up
+    to BATCH_ADMISSION_MAX_WAIT seconds.
+    """
+    deadline = time.monotonic() + BATCH_ADMISSION_MAX_WAIT
+    with admission.priority(admission.BATCH):
+        while True:
+            try:
+                return answer_chat_item(item)
+            except admission.Overloaded as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    return {
+                        'status': 'error',
+                        'response': 'Upstream rate limit: gave up waiting for capacity',
+                        'timestamp': datetime.now().isoformat()
+                    }
+                time.sleep(e.retry_after)
+
+def answer_chat_item(item):
+    """Answer one request the way /send_message would, without conversation history"""
+    user_message = item.get('message', '')
+    command, prompt = match_command(user_message)
+    try:
+        if command:
+            return run_command(command, prompt)
+        
+        files = item.get('files', [])
+        passages = retrieve_passages(None, user_message, files) if files else []
+        payload = build_chat_payload(
+            user_message, files, item.get('system_prompt', ''), float(item.get('temperature', 0.7)), passages=passages
+        )
+        ai_response = extract_response_text(gemini_generate(payload, timeout=config.GEMINI_TIMEOUT))
+        return {
+            'status': 'success',
+            'response': format_response(ai_response),
+            'timestamp': datetime.now().isoformat()
         }
-    }
-    
-    headers = {
-        "Content-Type": "application/json",
-        "X-goog-api-key": GEMINI_API_KEY
-    }
+    except requests.exceptions.RequestException as e:
+        return {
+            'status': 'error',
+            'response': f"Sorry, I encountered an error: {describe_request_error(e)}",
+            'timestamp': datetime.now().isoformat()
+        }
+
+def read_batch_options(args):
+    """``(concurrency, rate)`` for a /batch request, capped by BATCH_MAX_CONCURRENCY"""
+    concurrency = min(max(1, args.get('concurrency', batch.BATCH_CONCURRENCY, type=int)), BATCH_MAX_CONCURRENCY)
+    rate = max(0.0, args.get('rate', batch.BATCH_RATE, type=float))
+    return concurrency, rate
+
+def read_batch_lines(body, content_type):
+    """Input lines of a /batch body: JSONL, or JSON ``{"requests": [...]}``"""
+    if content_type.startswith('application/json'):
+        return [json.dumps(item) for item in json.loads(body).get('requests', [])]
+    return body.splitlines()
+
+@bp.route('/batch', methods=['POST'])
+def run_batch_request():
+    """Run a batch of chat requests and stream the results back as JSONL
+
+    The body is JSONL (one /send_message-style object per line) or JSON with a
+    ``requests`` list. Results are streamed as they finish, tagged with the
+    input ``line`` (and ``id`` if given), so a client can resubmit just the
+    missing lines after a dropped connection. ``?concurrency=`` and ``?rate=``
+    (requests per second) control the fan-out.
+    """
+    retry_after = check_session_rate('chat')
+    if retry_after:
+        return rate_limited_response(retry_after, 'message')
     
-    response = requests.post(GEMINI_API_URL, json=payload, headers=headers, timeout=30)
-    response.raise_for_status()
+    concurrency, rate = read_batch_options(request.args)
+    try:
+        lines = read_batch_lines(request.get_data(as_text=True), request.content_type or '')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f"Invalid batch body: {str(e)}"}), 400
     
-    response_data = response.json()
-    ai_response = response_data['candidates'][0]['content']['parts'][0]['text']
+    def generate():
+        for result in batch.run_batch(batch.parse_lines(lines), answer_batch_item, concurrency, rate):
+            yield json.dumps(result) + '\n'
     
-    return jsonify({
-        'status': 'success',
-        'response': format_response(ai_response),
-        'timestamp': datetime.now().isoformat(),
-        'definition': True
-    })
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
-@app.route('/generate_image', methods=['POST'])
+@bp.route('/generate_image', methods=['POST'])
 def generate_image():
     """Generate image using latest free Hugging Face models with fallback system"""
+    retry_after = check_session_rate('image')
+    if retry_after:
+        return rate_limited_response(retry_after, 'message')
+    
     try:
         data = request.json
         prompt = data.get('prompt', '')
@@ -381,29 +1087,21 @@ def generate_image():
                 'message': 'No prompt provided'
             }), 400
         
-        print(f"Generating image with prompt: {prompt}")
+        logger.debug("Generating image with prompt: %s", prompt)
         
-        # Try premium models first (with API key)
-        for model in LATEST_FREE_MODELS:
-            print(f"Trying model: {model['name']}")
-            result = try_model_generation(model, prompt)
-            
-            if result['status'] == 'success':
-                return result['response']
-            elif result['status'] == 'loading':
-                # Skip loading models for now, try next one
-                continue
+        result = find_stored_image(prompt)
+        if result:
+            return result['response']
         
-        # If premium models fail, try free community models
-        print("Trying free community models...")
-        for model in FREE_COMMUNITY_MODELS:
-            print(f"Trying free model: {model['name']}")
-            result = try_model_generation(model, prompt)
-            
-            if result['status'] == 'success':
-                return result['response']
-            elif result['status'] == 'loading':
-                continue
+        if IMAGE_HEDGING:
+            result = generate_image_hedged(prompt)
+        else:
+            result = generate_image_sequential(prompt)
+        
+        if result and result['status'] == 'throttled':
+            return rate_limited_response(result['retry_after'], 'message')
+        if result:
+            return result['response']
         
         # If all models fail
         return jsonify({
@@ -412,123 +1110,501 @@ def generate_image():
         }), 503
             
     except Exception as e:
-        print(f"Unexpected error in image generation: {str(e)}")
+        logger.exception("Unexpected error in image generation: %s", e)
         return jsonify({
             'status': 'error',
             'message': f"Image generation error: {str(e)}"
         }), 500
 
-def try_model_generation(model, prompt):
-    """Try to generate image with a specific model"""
+def get_image_jobs():
+    """The image job queue, opened on first use (which also resumes unfinished jobs)"""
+    global _image_jobs
+    if _image_jobs is None:
+        with _image_jobs_lock:
+            if _image_jobs is None:
+                _image_jobs = image_jobs.JobQueue(IMAGE_JOB_DB, run_image_job)
+    return _image_jobs
+
+def run_image_job(prompt, progress):
+    """Generate the image for a queued job, reporting each model attempt to ``progress``"""
+    result = find_stored_image(prompt)
+    if not result:
+        if IMAGE_HEDGING:
+            result = generate_image_hedged(prompt, progress)
+        else:
+            result = generate_image_sequential(prompt, progress)
+    
+    if result and result['status'] == 'throttled':
+        seconds = max(1, int(result['retry_after'] + 0.999))
+        raise image_jobs.JobFailed(f"Too many requests, please try again in {seconds} seconds.", seconds)
+    if not result:
+        raise image_jobs.JobFailed(
+            'All image generation services are currently unavailable. Please try again in a few moments.'
+        )
+    return result['response']
+
+def image_job_response(job):
+    """Public JSON for a job, with the URLs to follow it"""
+    return {
+        **job,
+        'status_url': f"/image_jobs/{job['job_id']}",
+        'events_url': f"/image_jobs/{job['job_id']}/events"
+    }
+
+@bp.route('/image_jobs', methods=['POST'])
+def submit_image_job():
+    """Queue an image generation and return its job ID without waiting for it"""
+    retry_after = check_session_rate('image')
+    if retry_after:
+        return rate_limited_response(retry_after, 'message')
+    
+    data = request.json or {}
+    prompt = data.get('prompt', '')
+    if not prompt:
+        return jsonify({'status': 'error', 'message': 'No prompt provided'}), 400
+    
     try:
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        # Add authorization if required
-        if model.get('requires_auth', True):
-            headers["Authorization"] = f"Bearer {HUGGING_FACE_API_KEY}"
+        job = get_image_jobs().submit(session_rate_key(), prompt)
+    except image_jobs.QueueFull:
+        response = jsonify({'status': 'error', 'message': 'Too many images are being generated right now. Please try again shortly.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '10'
+        return response
+    return jsonify(image_job_response(job)), 202
+
+@bp.route('/image_jobs/<job_id>', methods=['GET'])
+def get_image_job(job_id):
+    """Current state of an image job: status, latest progress, and the result once finished"""
+    job = get_image_jobs().get(job_id, session_rate_key())
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify(image_job_response(job))
+
+@bp.route('/image_jobs/<job_id>/events', methods=['GET'])
+def image_job_events(job_id):
+    """Server-Sent Events with an image job's progress, ending with its final state"""
+    jobs = get_image_jobs()
+    if jobs.get(job_id, session_rate_key()) is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    
+    def generate():
+        index = 0
+        while True:
+            events, finished = jobs.wait_events(job_id, index, IMAGE_JOB_HEARTBEAT)
+            for event in events:
+                yield sse_event(event)
+            index += len(events)
+            if finished and not events:
+                return
+            if not events:
+                # Keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def candidate_models():
+    """Image models in the order they should be tried, according to their health"""
+    return model_health.registry.order(LATEST_FREE_MODELS + FREE_COMMUNITY_MODELS)
+
+def generate_image_sequential(prompt, progress=None):
+    """Walk the model fallback chain one model at a time
+
+    Returns the first success, a ``throttled`` result if the upstream rate
+    limit turned the request away, or None if every model failed. Each
+    attempt and its outcome are reported to ``progress``, if given.
+    """
+    for model in candidate_models():
+        logger.info("Trying model: %s", model['name'], extra={'model': model['name']})
+        report_image_progress(progress, model)
+        result = try_model_generation(model, prompt)
         
-        # Enhanced prompt for better results
-        enhanced_prompt = enhance_prompt(prompt, model['name'])
+        # All models share the Hugging Face quota, so stop once it is exhausted
+        if result['status'] in ('success', 'throttled'):
+            return result
+        report_image_progress(progress, model, result)
+    
+    return None
+
+def report_image_progress(progress, model, result=None):
+    """Tell a job's ``progress`` callback that ``model`` is being tried, or how its attempt ended"""
+    if progress is None:
+        return
+    if result is None:
+        progress({'type': 'trying', 'model': model['name']})
+    else:
+        progress({'type': 'model_status', 'model': model['name'], 'status': result['status'],
+                  'message': result.get('message')})
+
+def generate_image_hedged(prompt, progress=None):
+    """Race the model fallback chain, returning the first successful result
+
+    The top-priority model starts immediately. The next candidate is started
+    as soon as a running model fails or reports it is loading, or when
+    IMAGE_HEDGE_DELAY passes with no result. Once a model succeeds the others
+    are cancelled: queued attempts never start and running ones stop reading
+    their response and discard it. Attempts are reported to ``progress`` as
+    in :func:`generate_image_sequential`.
+    """
+    candidates = candidate_models()
+    cancel_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=IMAGE_HEDGE_MAX_PARALLEL)
+    pending = {}
+    next_index = 0
+    
+    def launch_next():
+        nonlocal next_index
+        model = candidates[next_index]
+        next_index += 1
+        logger.info("Trying model: %s", model['name'], extra={'model': model['name']})
+        report_image_progress(progress, model)
+        future = executor.submit(try_model_generation, model, prompt, cancel_event)
+        pending[future] = model
+    
+    try:
+        launch_next()
+        while pending:
+            can_hedge = next_index < len(candidates) and len(pending) < IMAGE_HEDGE_MAX_PARALLEL
+            done, _ = wait(pending, timeout=IMAGE_HEDGE_DELAY if can_hedge else None, return_when=FIRST_COMPLETED)
+            
+            if not done:
+                # Hedge delay elapsed with nothing back yet
+                logger.info("No image after %ss, hedging with next model", IMAGE_HEDGE_DELAY)
+                launch_next()
+                continue
+            
+            for future in done:
+                model = pending.pop(future)
+                result = future.result()
+                if result['status'] in ('success', 'throttled'):
+                    return result
+                logger.info(
+                    "%s returned %s, trying next model", model['name'], result['status'],
+                    extra={'model': model['name'], 'outcome': result['status']}
+                )
+                report_image_progress(progress, model, result)
+            
+            # Replace every failed or loading attempt with the next candidate
+            for _ in done:
+                if next_index < len(candidates) and len(pending) < IMAGE_HEDGE_MAX_PARALLEL:
+                    launch_next()
         
-        # Prepare payload with model-specific parameters
-        payload = {
-            "inputs": enhanced_prompt,
-            "parameters": {
-                "num_inference_steps": model['params']['num_inference_steps'],
-                "guidance_scale": model['params']['guidance_scale'],
-                "width": model['params']['width'],
-                "height": model['params']['height'],
-                "negative_prompt": get_negative_prompt(model['name'])
-            },
-            "options": {
-                "wait_for_model": True,
-                "use_cache": True
+        return None
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def read_image_body(response, cancel_event):
+    """Read the response body, giving up early if the request was cancelled"""
+    if cancel_event is None:
+        return response.content
+    
+    chunks = []
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        if cancel_event.is_set():
+            response.close()
+            return None
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+def build_image_payload(model, prompt):
+    """Build the Hugging Face inference payload for a model"""
+    # Enhanced prompt for better results
+    enhanced_prompt = enhance_prompt(prompt, model['name'])
+    
+    # Prepare payload with model-specific parameters
+    payload = {
+        "inputs": enhanced_prompt,
+        "parameters": {
+            "num_inference_steps": model['params']['num_inference_steps'],
+            "guidance_scale": model['params']['guidance_scale'],
+            "width": model['params']['width'],
+            "height": model['params']['height'],
+            "negative_prompt": get_negative_prompt(model['name'])
+        },
+        "options": {
+            "wait_for_model": True,
+            "use_cache": True
+        }
+    }
+    
+    # Add model-specific parameters
+    if model['name'] == "FLUX.1 Schnell":
+        payload["parameters"]["guidance_scale"] = 3.5
+    
+    return payload
+
+def image_model_headers(model):
+    """Pick the shared Hugging Face headers for a model"""
+    return HF_AUTH_HEADERS if model.get('requires_auth', True) else HF_PUBLIC_HEADERS
+
+def classify_image_response(model, status_code):
+    """Map Hugging Face statuses that need no body to a result, or None to keep going"""
+    if status_code == 503:
+        return {
+            'status': 'loading', 
+            'message': f"{model['name']} is loading, please wait..."
+        }
+    elif status_code == 422:
+        return {
+            'status': 'error',
+            'outcome': 'validation_error',
+            'message': f"{model['name']} validation error"
+        }
+    return None
+
+def throttled_image_result(model, retry_after):
+    """Result for an attempt the upstream rate limiter did not admit
+
+    Recorded as ``cancelled`` so it does not count against the model's health.
+    """
+    return {
+        'status': 'throttled',
+        'outcome': 'cancelled',
+        'retry_after': retry_after,
+        'message': f"{model['name']} was not tried: upstream rate limit reached"
+    }
+
+def describe_image_error(model, error_details, default):
+    """Pull the error message out of a Hugging Face error body"""
+    if isinstance(error_details, dict):
+        if 'error' in error_details:
+            return error_details['error']
+        elif 'message' in error_details:
+            return error_details['message']
+    return default
+
+def image_success_result(model, prompt, content):
+    """Save a generated image and build the success result for it"""
+    # Check if response is valid image data
+    if len(content) < 1000:  # Too small to be a valid image
+        error_text = content.decode('utf-8', errors='replace')
+        return {
+            'status': 'error',
+            'message': f"Invalid response from {model['name']}: {error_text}"
+        }
+    
+    image_filename = save_generated_image(content, model, prompt)
+    
+    response = {
+        'status': 'success',
+        **image_urls(image_filename),
+        'prompt': prompt,
+        'model_used': model['name'],
+        'timestamp': datetime.now().isoformat()
+    }
+    
+    if IMAGE_RESPONSE_MODE == 'inline':
+        # Convert image to base64 for immediate display
+        image_base64 = base64.b64encode(content).decode('utf-8')
+        mime_type = IMAGE_MIME_TYPES[image_filename.rsplit('.', 1)[1]]
+        response['image_base64'] = f"data:{mime_type};base64,{image_base64}"
+    
+    return {
+        'status': 'success',
+        'response': response
+    }
+
+def get_image_store():
+    """The content-addressed store behind GENERATED_IMAGES_FOLDER, opened on first use"""
+    global _image_store
+    if _image_store is None:
+        with _image_store_lock:
+            if _image_store is None:
+                _image_store = image_store.ImageStore(
+                    GENERATED_IMAGES_FOLDER,
+                    os.path.join(INSTANCE_FOLDER, 'image_index.sqlite3'),
+                    IMAGE_STORE_QUOTA_BYTES
+                )
+    return _image_store
+
+def image_request_key(model, prompt):
+    """Store key for a model + enhanced prompt + parameters combination"""
+    payload = build_image_payload(model, prompt)
+    return image_store.request_key(model['name'], payload['inputs'], payload['parameters'])
+
+def save_generated_image(content, model=None, prompt=None):
+    """Save image bytes in the image store and return the file name
+
+    Identical images share one file named by their SHA-256, which doubles as a
+    strong ETag. When ``model`` and ``prompt`` are given the request is indexed
+    so a repeat can be served without regenerating.
+    """
+    key = image_request_key(model, prompt) if model else None
+    return get_image_store().put(content, key, model['name'] if model else '')
+
+def find_stored_image(prompt):
+    """Return a success result for an image already generated for this prompt, or None"""
+    store = get_image_store()
+    for model in candidate_models():
+        image_filename = store.lookup(image_request_key(model, prompt))
+        if image_filename:
+            logger.info("Serving stored image from %s", model['name'], extra={'model': model['name']})
+            return {
+                'status': 'success',
+                'response': {
+                    'status': 'success',
+                    **image_urls(image_filename),
+                    'prompt': prompt,
+                    'model_used': model['name'],
+                    'cached': True,
+                    'timestamp': datetime.now().isoformat()
+                }
             }
+    return None
+
+def url_for_image(image_filename):
+    """Public URL of a generated image"""
+    return f"/images/{image_filename}"
+
+def get_image_variants():
+    """Background variant renderer for the image store, created on first use"""
+    global _image_variants
+    if _image_variants is None:
+        with _image_variants_lock:
+            if _image_variants is None:
+                _image_variants = image_variants.VariantRenderer(get_image_store())
+    return _image_variants
+
+def image_urls(image_filename):
+    """Reply fields pointing at a stored image and its variants
+
+    ``image_url`` is the display-size variant and ``full_url`` the full-size
+    one; both serve the original until the variant is rendered, and are the
+    original when the render could not be scheduled.
+    ``original_url`` is the image exactly as the model returned it and
+    ``image_sources`` lists ``<picture>`` sources, best format first.
+    Without Pillow all three URLs are the original.
+    """
+    original_url = url_for_image(image_filename)
+    urls = {'image_url': original_url, 'full_url': original_url, 'original_url': original_url, 'image_sources': []}
+    renderer = get_image_variants()
+    if renderer.schedule(image_filename):
+        fmt = 'webp' if 'webp' in image_variants.available_formats() else image_variants.available_formats()[0]
+        urls['image_url'] = url_for_image(image_variants.variant_name(image_filename, IMAGE_DISPLAY_WIDTH, fmt))
+        urls['full_url'] = url_for_image(image_variants.variant_name(image_filename, image_variants.FULL, fmt))
+        urls['image_sources'] = renderer.sources(image_filename, url_for_image)
+    return urls
+
+def resolve_image_file(filename):
+    """``(file, etag, immutable)`` to serve for an /images/ name, or None if unknown
+
+    A variant that has not been rendered yet is answered with its original,
+    marked for revalidation, so the variant replaces it once it exists.
+    """
+    match = IMAGE_FILENAME_PATTERN.match(filename)
+    if not match:
+        return None
+    etag = filename.rsplit('.', 1)[0]
+    if not match.group('variant'):
+        return filename, etag, True
+    
+    store = get_image_store()
+    file = store.variant_file(filename)
+    if file is not None:
+        return file, etag, True
+    original = store.original_for(match.group('stem'))
+    if original is None:
+        return None
+    get_image_variants().schedule(original)
+    return original, match.group('stem'), False
+
+def try_model_generation(model, prompt, cancel_event=None):
+    """Try to generate image with a specific model, recording the outcome
+
+    Models whose circuit is open in the health registry are skipped without
+    making a request. Concurrent requests for the same model and prompt share
+    one attempt; it is only cancelled once every request waiting on it is.
+    """
+    if not model_health.registry.allow(model['name']):
+        return {
+            'status': 'skipped',
+            'message': f"{model['name']} is temporarily skipped after repeated failures"
         }
-        
-        # Add model-specific parameters
-        if model['name'] == "FLUX.1 Schnell":
-            payload["parameters"]["guidance_scale"] = 3.5
-        
-        response = requests.post(
+    
+    return image_flights.do(
+        image_flight_key(model, prompt),
+        lambda cancel: attempt_model_generation(model, prompt, cancel),
+        cancel_event
+    )
+
+def image_flight_key(model, prompt):
+    """Single-flight key covering everything sent upstream for an image attempt"""
+    return single_flight.payload_key(model['url'], build_image_payload(model, prompt))
+
+def attempt_model_generation(model, prompt, cancel_event=None):
+    """Make one image request and record its outcome in the health registry and metrics"""
+    started = time.monotonic()
+    with metrics.UpstreamCall('huggingface', model['name']) as call:
+        result = request_model_image(model, prompt, cancel_event)
+        call.outcome = result.get('outcome', result['status'])
+    model_health.registry.record(
+        model['name'],
+        result.get('outcome', result['status']),
+        time.monotonic() - started,
+        result.get('message')
+    )
+    return result
+
+def request_model_image(model, prompt, cancel_event=None):
+    """Request an image from a specific model
+
+    When ``cancel_event`` is given (hedged mode) the body is streamed so the
+    attempt can be abandoned as soon as another model has won. The response
+    is always closed, so losers and errors hand their connection back to the
+    pool straight away.
+    """
+    response = None
+    try:
+        response = upstream.post(
             model['url'],
-            headers=headers,
-            json=payload,
-            timeout=120
+            headers=image_model_headers(model),
+            json=build_image_payload(model, prompt),
+            timeout=config.IMAGE_TIMEOUT,
+            stream=cancel_event is not None,
+            retry_statuses=HF_RETRY_STATUSES
         )
         
-        if response.status_code == 503:
-            return {
-                'status': 'loading', 
-                'message': f"{model['name']} is loading, please wait..."
-            }
-        elif response.status_code == 422:
-            return {
-                'status': 'error',
-                'message': f"{model['name']} validation error"
-            }
+        result = classify_image_response(model, response.status_code)
+        if result:
+            return result
             
         response.raise_for_status()
         
-        # Check if response is valid image data
-        if len(response.content) < 1000:  # Too small to be a valid image
-            error_text = response.text
+        content = read_image_body(response, cancel_event)
+        if content is None or (cancel_event is not None and cancel_event.is_set()):
             return {
-                'status': 'error',
-                'message': f"Invalid response from {model['name']}: {error_text}"
+                'status': 'cancelled',
+                'message': f"{model['name']} was cancelled"
             }
         
-        # Save the generated image
-        if not os.path.exists(app.config['GENERATED_IMAGES_FOLDER']):
-            os.makedirs(app.config['GENERATED_IMAGES_FOLDER'])
-        
-        image_filename = f"generated_{uuid.uuid4().hex[:8]}.png"
-        image_path = os.path.join(app.config['GENERATED_IMAGES_FOLDER'], image_filename)
-        
-        with open(image_path, 'wb') as f:
-            f.write(response.content)
-        
-        # Convert image to base64 for immediate display
-        image_base64 = base64.b64encode(response.content).decode('utf-8')
-        
-        return {
-            'status': 'success',
-            'response': jsonify({
-                'status': 'success',
-                'image_url': f"/{image_path}",
-                'image_base64': f"data:image/png;base64,{image_base64}",
-                'prompt': prompt,
-                'model_used': model['name'],
-                'timestamp': datetime.now().isoformat()
-            }).get_json()
-        }
-        
+        return image_success_result(model, prompt, content)
+    
+    except admission.Overloaded as e:
+        return throttled_image_result(model, e.retry_after)
     except requests.exceptions.RequestException as e:
         error_msg = str(e)
-        if hasattr(e, 'response') and e.response:
+        if hasattr(e, 'response') and e.response is not None:
             try:
-                error_details = e.response.json()
-                if 'error' in error_details:
-                    error_msg = error_details['error']
-                elif 'message' in error_details:
-                    error_msg = error_details['message']
+                error_msg = describe_image_error(model, e.response.json(), error_msg)
             except:
                 pass
         
-        print(f"Model {model['name']} Error: {error_msg}")
+        logger.warning("Model %s error: %s", model['name'], error_msg, extra={'model': model['name']})
         return {
             'status': 'error', 
+            'outcome': 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'error',
             'message': f"{model['name']}: {error_msg}"
         }
         
     except Exception as e:
-        print(f"Unexpected error with {model['name']}: {str(e)}")
+        logger.exception("Unexpected error with %s: %s", model['name'], e, extra={'model': model['name']})
         return {
             'status': 'error', 
             'message': f"{model['name']}: {str(e)}"
         }
+    finally:
+        if response is not None:
+            response.close()
 
 def enhance_prompt(prompt, model_name):
     """Enhance the prompt based on the model being used"""
@@ -563,31 +1639,83 @@ def get_negative_prompt(model_name):
         return f"{base_negative}, {additional_negative}"
     return base_negative
 
-@app.route('/update_conversation_name', methods=['POST'])
+@bp.route('/update_conversation_name', methods=['POST'])
 def update_conversation_name():
     data = request.json
     session['conversation_name'] = data.get('name', 'New Conversation')
+    conversation_id = data.get('conversation_id') or session.get('chat_id')
+    if conversation_id:
+        get_conversation_store().rename(conversation_id, session.get('chat_id'), session['conversation_name'])
+    return jsonify({'status': 'success'})
+
+@bp.route('/conversations', methods=['GET'])
+def list_conversations():
+    """Paginated list of this session's conversations, most recent first"""
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    conversations, next_offset = get_conversation_store().list_conversations(session.get('chat_id'), offset, limit)
+    return jsonify({
+        'status': 'success',
+        'conversations': conversations,
+        'next_offset': next_offset
+    })
+
+@bp.route('/conversations', methods=['DELETE'])
+def delete_all_conversations():
+    forget_conversation_documents(get_conversation_store().delete_all(session.get('chat_id')))
+    return jsonify({'status': 'success'})
+
+@bp.route('/conversations/<conversation_id>/messages', methods=['GET'])
+def list_conversation_messages(conversation_id):
+    """Paginated turns of a conversation, newest first; pass ``before`` to page back"""
+    store = get_conversation_store()
+    conversation = store.get(conversation_id, session.get('chat_id'))
+    if conversation is None:
+        return jsonify({'status': 'error', 'message': 'Conversation not found'}), 404
+    
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    turns, next_before = store.list_turns(conversation_id, before, limit)
+    return jsonify({
+        'status': 'success',
+        'conversation': {'id': conversation['id'], 'name': conversation['name'], 'turn_count': conversation['turn_count']},
+        'messages': turns,
+        'next_before': next_before
+    })
+
+@bp.route('/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    if not get_conversation_store().delete(conversation_id, session.get('chat_id')):
+        return jsonify({'status': 'error', 'message': 'Conversation not found'}), 404
+    forget_conversation_documents([conversation_id])
     return jsonify({'status': 'success'})
 
 def format_response(text):
     """Format the AI response with markdown support"""
-    # Convert markdown to HTML
-    formatted = text.replace('**', '<strong>').replace('**', '</strong>')
-    formatted = formatted.replace('*', '<em>').replace('*', '</em>')
-    formatted = formatted.replace('`', '<code>').replace('`', '</code>')
-    
-    # Handle paragraphs and lists
-    paragraphs = formatted.split('\n\n')
-    formatted = '<p>' + '</p><p>'.join(paragraphs) + '</p>'
-    
-    formatted = formatted.replace('\n- ', '<br>- ')
-    formatted = formatted.replace('\n* ', '<br>* ')
-    
-    return formatted
+    return markdown_render.render_markdown(text)
+
+def stream_delta_event(renderer, delta):
+    """SSE delta event with the raw text plus the HTML of any markdown blocks it completed
 
-@app.route('/upload_file', methods=['POST'])
+    ``pending_from`` is the offset in the reply (in UTF-16 code units, as
+    JavaScript indexes strings) where the not yet rendered text starts, so
+    the client only has to render that tail itself.
+    """
+    event = {'type': 'delta', 'text': delta}
+    html = renderer.feed(delta)
+    if html:
+        event['html'] = html
+    event['pending_from'] = renderer.pending_from
+    return event
+
+@bp.route('/upload_file', methods=['POST'])
 def upload_file():
-    """Handle file uploads separately if needed"""
+    """Upload an attachment once and get back a file ID to reference it by
+
+    The body is streamed to disk in chunks while it is hashed, so memory use
+    does not depend on the file size; uploading the same content again
+    returns the existing file ID without storing a second copy.
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'status': 'error', 'message': 'No file provided'}), 400
@@ -598,41 +1726,179 @@ def upload_file():
         
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
+            record, deduplicated = get_file_store().ingest(
+                file.stream, filename, file.mimetype or 'application/octet-stream'
+            )
+            extraction_executor.submit(prepare_attachment, record['id'])
             
             # Return file info
-            return jsonify({
-                'status': 'success',
-                'filename': filename,
-                'file_path': file_path
-            })
+            return jsonify(upload_result(record, filename, deduplicated))
         else:
             return jsonify({'status': 'error', 'message': 'File type not allowed'}), 400
-            
+    
+    except file_store.FileTooLarge as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 413
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/get_available_models', methods=['GET'])
+def upload_result(record, filename, deduplicated):
+    return {
+        'status': 'success',
+        'file_id': record['id'],
+        'filename': filename,
+        'mime_type': record['mime_type'],
+        'size': record['size'],
+        'deduplicated': deduplicated
+    }
+
+@bp.route('/get_available_models', methods=['GET'])
 def get_available_models():
     """Endpoint to get available image generation models"""
+    return jsonify(available_models_info())
+
+def available_models_info():
+    """Describe the configured image generation models"""
     models_info = []
     
     for model in LATEST_FREE_MODELS + FREE_COMMUNITY_MODELS:
         models_info.append({
             'name': model['name'],
             'requires_auth': model.get('requires_auth', True),
-            'resolution': f"{model['params']['width']}x{model['params']['height']}"
+            'resolution': f"{model['params']['width']}x{model['params']['height']}",
+            'health': model_health.registry.snapshot(model['name'])
         })
     
+    return {
+        'status': 'success',
+        'models': models_info,
+        'try_order': [model['name'] for model in candidate_models()]
+    }
+
+@bp.route('/images/<filename>', methods=['GET'])
+def serve_generated_image(filename):
+    """Serve a generated image with long-lived caching
+
+    File names are content hashes, so the content behind a URL never changes:
+    the hash is used as a strong ETag and the response is marked immutable.
+    The one exception is a variant served by its original while it is being
+    rendered, which must be revalidated. Range requests are supported through
+    ``conditional``.
+    """
+    resolved = resolve_image_file(filename)
+    if resolved is None:
+        abort(404)
+    
+    file, etag, immutable = resolved
+    response = send_from_directory(
+        os.path.abspath(GENERATED_IMAGES_FOLDER),
+        file,
+        mimetype=IMAGE_MIME_TYPES[file.rsplit('.', 1)[1]],
+        etag=etag,
+        max_age=IMAGE_CACHE_MAX_AGE if immutable else 0,
+        conditional=True
+    )
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@bp.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters for the slash-command response cache"""
     return jsonify({
         'status': 'success',
-        'models': models_info
+        'command_cache': response_cache.command_cache.stats(),
+        'image_store': get_image_store().stats(),
+        'image_variants': get_image_variants().stats(),
+        'inline_images': get_image_normalizer().stats(),
+        'image_jobs': get_image_jobs().stats(),
+        'sessions': get_session_store().stats() if get_session_store() else None,
+        'traffic_capture': get_traffic_recorder().stats() if get_traffic_recorder() else None,
+        'single_flight': {'gemini': gemini_flights.stats(), 'image': image_flights.stats()}
     })
 
+def warmup_probe(model):
+    """Send a minimal generation request to keep a model loaded"""
+    payload = build_image_payload(model, "warm-up")
+    payload["parameters"].update({"num_inference_steps": 1, "width": 256, "height": 256})
+    
+    # Probes must never take capacity from real requests
+    with admission.priority(admission.BATCH):
+        response = upstream.post(model['url'], headers=image_model_headers(model), json=payload, timeout=config.IMAGE_TIMEOUT, retry_statuses=())
+    result = classify_image_response(model, response.status_code)
+    outcome = result.get('outcome', result['status']) if result else ('success' if response.ok else 'error')
+    # Probe latency says nothing about a full-size generation, so only the outcome is kept
+    model_health.registry.record(model['name'], outcome, None, f"warm-up HTTP {response.status_code}")
+    response.close()
+
+def start_model_warmup():
+    """Start background warm-up probes if MODEL_WARMUP_INTERVAL is set"""
+    model_health.registry.start_warmup(
+        warmup_probe,
+        LATEST_FREE_MODELS + FREE_COMMUNITY_MODELS,
+        MODEL_WARMUP_INTERVAL,
+        MODEL_WARMUP_TOP_N
+    )
+
+def create_app():
+    """Build the Flask app from ``config`` and create its folders
+
+    Folders and other settings are read from the environment when this module
+    is imported (see config.py), so set them there rather than on the app.
+
+    Only pure-Python state is set up here, so it is safe to call in a
+    pre-fork master. SQLite stores and upstream connections are opened per
+    process, on first use or by :func:`warm_up`.
+    """
+    flask_app = Flask(__name__)
+    flask_app.secret_key = secret_key()
+    if get_session_store() is not None:
+        flask_app.session_interface = session_store.ServerSideSessionInterface(get_session_store())
+    flask_app.config.update(
+        UPLOAD_FOLDER=UPLOAD_FOLDER,
+        GENERATED_IMAGES_FOLDER=GENERATED_IMAGES_FOLDER,
+        MAX_CONTENT_LENGTH=MAX_CONTENT_LENGTH
+    )
+    flask_app.register_blueprint(bp)
+
+    for folder in (UPLOAD_FOLDER, GENERATED_IMAGES_FOLDER, INSTANCE_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+    # Compiled templates are inherited by forked workers
+    flask_app.jinja_env.get_template('index.html')
+    return flask_app
+
+def warm_up(upstream_pools=True):
+    """Get this process ready for traffic before it accepts any
+
+    Opens the SQLite stores (which also resumes queued image jobs) and fills
+    the command cache's memory tier from disk. With ``upstream_pools`` it
+    also pre-connects WARM_UP_CONNECTIONS pooled connections to each upstream
+    host. Runs in each worker after it is forked, since connections must not
+    be shared across processes.
+    """
+    started = time.monotonic()
+    get_conversation_store()
+    get_file_store()
+    get_image_store()
+    get_retrieval_index()
+    get_image_jobs()
+    cached = response_cache.command_cache.warm()
+    connections = 0
+    if upstream_pools:
+        urls = [GEMINI_API_URL] + [model['url'] for model in LATEST_FREE_MODELS + FREE_COMMUNITY_MODELS]
+        connections = upstream.warm(urls, config.WARM_UP_CONNECTIONS, config.WARM_UP_TIMEOUT)
+    logger.info(
+        "Warmed up in %.0fms (%d cached responses, %d upstream connections)",
+        (time.monotonic() - started) * 1000, cached, connections
+    )
+
+# Default instance, for `python app.py`, `flask --app app run`, the ASGI mode and benchmarks
+app = create_app()
+
 if __name__ == '__main__':
-    if not os.path.exists(UPLOAD_FOLDER):
-        os.makedirs(UPLOAD_FOLDER)
-    if not os.path.exists(GENERATED_IMAGES_FOLDER):
-        os.makedirs(GENERATED_IMAGES_FOLDER)
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    if config.WARM_UP:
+        warm_up()
+    start_model_warmup()
+    app.run(host=config.HOST, port=config.PORT, debug=config.DEBUG)
\ No newline at end of file
@@ -0,0 +1,853 @@
+"""Asyncio (ASGI) serving mode for the chatbot
+
+Serves the same routes and JSON contracts as ``app.py`` but awaits upstream
+Gemini / Hugging Face calls on a shared ``httpx.AsyncClient`` instead of
+holding a worker thread for each in-flight request, so a single process can
+keep hundreds of slow upstream calls open at once.
+
+Payload building and response shaping are shared with ``app.py``; only the
+I/O differs. Requires ``quart`` and ``httpx``. Run with any ASGI server, e.g.
+
+    hypercorn asgi:app
+    uvicorn asgi:app
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+from quart import Quart, render_template, request, jsonify, session, Response, send_from_directory, abort, g
+from quart.sessions import SessionInterface
+from werkzeug.utils import secure_filename
+
+import admission
+import app as chatbot
+import batch
+import config
+import file_store
+import image_jobs
+import markdown_render
+import metrics
+import model_health
+import response_cache
+import session_store
+import traffic_capture
+import single_flight
+import upstream
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Quart wrapper of the Flask app's server-side sessions, so both modes share them"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+
+    # Loading and saving may query the SQLite backend, so both run off the event loop
+    async def open_session(self, app, request):
+        return await asyncio.to_thread(self.sessions.load_session, app, request.cookies.get(self.get_cookie_name(app)))
+
+    async def save_session(self, app, session, response):
+        if response is not None:
+            await asyncio.to_thread(self.sessions.store_session, app, session, response)
+
+
+app = Quart(__name__)
+app.secret_key = chatbot.app.secret_key
+app.config['UPLOAD_FOLDER'] = chatbot.UPLOAD_FOLDER
+app.config['GENERATED_IMAGES_FOLDER'] = chatbot.GENERATED_IMAGES_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = chatbot.MAX_CONTENT_LENGTH
+
+if isinstance(chatbot.app.session_interface, session_store.ServerSideSessionInterface):
+    app.session_interface = ServerSideSessionInterface(chatbot.app.session_interface)
+
+gemini_flights = single_flight.AsyncSingleFlight()
+image_flights = single_flight.AsyncSingleFlight()
+
+logger = logging.getLogger(__name__)
+
+
+@app.before_serving
+async def startup():
+    for folder in (chatbot.UPLOAD_FOLDER, chatbot.GENERATED_IMAGES_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+    upstream.get_async_client()
+    if config.WARM_UP:
+        # Upstream calls go through the async client here, so the requests pools are left cold
+        await asyncio.to_thread(chatbot.warm_up, False)
+    chatbot.start_model_warmup()
+
+
+@app.after_serving
+async def shutdown():
+    await upstream.close_async_client()
+
+
+@app.before_request
+async def start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.monotonic()
+    metrics.http_in_flight.inc((g.metrics_route,))
+
+
+@app.after_request
+async def note_response_metrics(response):
+    g.metrics_status = response.status_code
+    g.metrics_response_size = response.content_length
+    return response
+
+
+@app.teardown_request
+async def finish_request_metrics(error=None):
+    """Record the request; Quart ends the request context before a streamed body is sent"""
+    if 'metrics_started' not in g:
+        return
+    metrics.http_in_flight.dec((g.metrics_route,))
+    metrics.observe_request(
+        g.metrics_route,
+        request.method,
+        g.get('metrics_status', 500),
+        time.monotonic() - g.metrics_started,
+        request.content_length,
+        g.get('metrics_response_size')
+    )
+
+
+@app.before_request
+async def start_traffic_capture():
+    recorder = chatbot.get_traffic_recorder()
+    if recorder is None or request.method != 'POST' or g.metrics_route not in traffic_capture.ROUTES:
+        return
+    try:
+        body = await request.get_json(silent=True)
+        # Attachment sizes are looked up in the file store, so describe the request off the event loop
+        g.traffic_record = await asyncio.to_thread(
+            chatbot.describe_captured_request, recorder, g.metrics_route, body, session_rate_key(), request.content_length
+        )
+    except Exception as e:
+        logger.warning("Could not describe request for traffic capture: %s", e)
+
+
+@app.teardown_request
+async def finish_traffic_capture(error=None):
+    """Record the captured request; as with the metrics, streamed bodies are not included in the duration"""
+    record = g.pop('traffic_record', None)
+    if record is not None:
+        await asyncio.to_thread(
+            chatbot.get_traffic_recorder().finish,
+            record, g.get('metrics_status', 500), time.monotonic() - g.metrics_started, g.get('metrics_response_size')
+        )
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.registry.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+def describe_async_error(e):
+    """Turn an httpx exception into the most useful message available"""
+    error_msg = str(e)
+    if isinstance(e, httpx.HTTPStatusError):
+        try:
+            error_details = e.response.json()
+            error_msg = error_details.get('error', {}).get('message', error_msg)
+        except Exception:
+            pass
+    return error_msg
+
+
+def rate_limited_response(retry_after, field='response'):
+    """Async-mode counterpart of ``app.rate_limited_response``"""
+    seconds = max(1, int(retry_after + 0.999))
+    response = jsonify({
+        'status': 'error',
+        field: f"Too many requests, please try again in {seconds} seconds.",
+        'retry_after': seconds,
+        'timestamp': datetime.now().isoformat()
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+
+def session_rate_key():
+    return session.get('chat_id') or request.remote_addr
+
+
+def check_session_rate(kind):
+    return chatbot.session_limits[kind].check(session_rate_key())
+
+
+async def gemini_generate(payload, timeout=config.GEMINI_COMMAND_TIMEOUT, operation='chat'):
+    """Async counterpart of ``app.gemini_generate``"""
+    key = single_flight.payload_key(chatbot.GEMINI_API_URL, payload, admission.current_priority.get())
+    return await gemini_flights.do(key, lambda: request_gemini(payload, timeout, operation))
+
+
+async def request_gemini(payload, timeout, operation):
+    with metrics.UpstreamCall('gemini', operation) as call:
+        response = await upstream.async_post(chatbot.GEMINI_API_URL, json=payload, headers=chatbot.GEMINI_HEADERS, timeout=timeout)
+        response.raise_for_status()
+        call.size = len(response.content)
+        return response.json()
+
+
+async def run_command(name, prompt):
+    """Async counterpart of ``app.run_command``"""
+    key = chatbot.command_cache_key(name, prompt)
+    # The cache's second tier is SQLite, so it is read and written off the event loop
+    ai_response = await asyncio.to_thread(response_cache.command_cache.get, key)
+    if ai_response is not None:
+        return chatbot.command_result(name, ai_response, cached=True)
+
+    payload = chatbot.build_command_payload(name, prompt)
+    response_data = await gemini_generate(payload, operation=name)
+    ai_response = response_data['candidates'][0]['content']['parts'][0]['text']
+    await asyncio.to_thread(response_cache.command_cache.set, key, ai_response)
+    return chatbot.command_result(name, ai_response)
+
+
+async def answer_batch_item(item):
+    """Async counterpart of ``app.answer_batch_item``"""
+    deadline = time.monotonic() + chatbot.BATCH_ADMISSION_MAX_WAIT
+    with admission.priority(admission.BATCH):
+        while True:
+            try:
+                return await answer_chat_item(item)
+            except admission.Overloaded as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    return {
+                        'status': 'error',
+                        'response': 'Upstream rate limit: gave up waiting for capacity',
+                        'timestamp': datetime.now().isoformat()
+                    }
+                await asyncio.sleep(e.retry_after)
+
+
+async def answer_chat_item(item):
+    """Async counterpart of ``app.answer_chat_item``"""
+    user_message = item.get('message', '')
+    command, prompt = chatbot.match_command(user_message)
+    try:
+        if command:
+            return await run_command(command, prompt)
+
+        files = item.get('files', [])
+        passages = await asyncio.to_thread(chatbot.retrieve_passages, None, user_message, files) if files else []
+        payload = await asyncio.to_thread(
+            chatbot.build_chat_payload, user_message, files, item.get('system_prompt', ''),
+            float(item.get('temperature', 0.7)), (), None, passages
+        )
+        ai_response = chatbot.extract_response_text(await gemini_generate(payload, timeout=config.GEMINI_TIMEOUT))
+        return {
+            'status': 'success',
+            'response': chatbot.format_response(ai_response),
+            'timestamp': datetime.now().isoformat()
+        }
+    except httpx.HTTPError as e:
+        return {
+            'status': 'error',
+            'response': f"Sorry, I encountered an error: {describe_async_error(e)}",
+            'timestamp': datetime.now().isoformat()
+        }
+
+
+def read_chat_request(data):
+    """Pull the chat fields out of a /send_message or /stream_message body"""
+    return (
+        data.get('message', ''),
+        data.get('files', []),
+        data.get('system_prompt', ''),
+        float(data.get('temperature', 0.7))
+    )
+
+
+@app.route('/')
+async def index():
+    if 'chat_id' not in session:
+        session['chat_id'] = str(uuid.uuid4())
+        session['conversation_name'] = "New Conversation"
+    return await render_template('index.html')
+
+
+@app.route('/send_message', methods=['POST'])
+async def send_message():
+    retry_after = check_session_rate('chat')
+    if retry_after:
+        return rate_limited_response(retry_after)
+
+    try:
+        data = await request.get_json()
+        user_message, files, system_prompt, temperature = read_chat_request(data)
+
+        command, prompt = chatbot.match_command(user_message)
+        if command:
+            return jsonify(await run_command(command, prompt))
+
+        conversation_id, history, summary = await asyncio.to_thread(
+            chatbot.load_conversation_context, data, session.get('chat_id')
+        )
+        # Attachments are resolved, extracted and searched on disk, so do that off the event loop
+        passages = await asyncio.to_thread(chatbot.retrieve_passages, conversation_id, user_message, files)
+        payload = await asyncio.to_thread(
+            chatbot.build_chat_payload, user_message, files, system_prompt, temperature, history, summary, passages
+        )
+
+        logger.debug("Sending request to Gemini API")
+        response_data = await gemini_generate(payload, timeout=config.GEMINI_TIMEOUT)
+        ai_response = chatbot.extract_response_text(response_data)
+        await asyncio.to_thread(chatbot.record_exchange, conversation_id, user_message, files, ai_response)
+
+        return jsonify({
+            'status': 'success',
+            'response': chatbot.format_response(ai_response),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except admission.Overloaded as e:
+        return rate_limited_response(e.retry_after)
+    except httpx.HTTPError as e:
+        error_msg = describe_async_error(e)
+        logger.warning("API error: %s", error_msg)
+        return jsonify({
+            'status': 'error',
+            'response': f"Sorry, I encountered an error: {error_msg}",
+            'timestamp': datetime.now().isoformat()
+        }), 500
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'response': f"Unexpected error: {str(e)}",
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+
+@app.route('/stream_message', methods=['POST'])
+async def stream_message():
+    """Async counterpart of ``app.stream_message``"""
+    retry_after = check_session_rate('chat')
+    if retry_after:
+        return rate_limited_response(retry_after)
+
+    try:
+        data = await request.get_json()
+        user_message, files, system_prompt, temperature = read_chat_request(data)
+
+        command, prompt = chatbot.match_command(user_message)
+        if command:
+            result = await run_command(command, prompt)
+            result['type'] = 'done'
+            return Response(chatbot.sse_event(result), mimetype='text/event-stream')
+
+        conversation_id, history, summary = await asyncio.to_thread(
+            chatbot.load_conversation_context, data, session.get('chat_id')
+        )
+        # Attachments are resolved, extracted and searched on disk, so do that off the event loop
+        passages = await asyncio.to_thread(chatbot.retrieve_passages, conversation_id, user_message, files)
+        payload = await asyncio.to_thread(
+            chatbot.build_chat_payload, user_message, files, system_prompt, temperature, history, summary, passages
+        )
+
+        logger.debug("Streaming request to Gemini API")
+        with metrics.UpstreamCall('gemini', 'chat_stream'):
+            upstream_response = await upstream.async_post(chatbot.GEMINI_STREAM_URL, json=payload, headers=chatbot.GEMINI_HEADERS, stream=True, timeout=config.GEMINI_TIMEOUT)
+            if upstream_response.is_error:
+                await upstream_response.aread()
+                await upstream_response.aclose()
+            upstream_response.raise_for_status()
+
+    except admission.Overloaded as e:
+        return rate_limited_response(e.retry_after)
+    except httpx.HTTPError as e:
+        error_msg = describe_async_error(e)
+        logger.warning("API error: %s", error_msg)
+        return jsonify({
+            'status': 'error',
+            'response': f"Sorry, I encountered an error: {error_msg}",
+            'timestamp': datetime.now().isoformat()
+        }), 500
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        return jsonify({
+            'status': 'error',
+            'response': f"Unexpected error: {str(e)}",
+            'timestamp': datetime.now().isoformat()
+        }), 500
+
+    async def generate():
+        chunks = []
+        renderer = markdown_render.MarkdownRenderer()
+        try:
+            async for line in upstream_response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                delta = chatbot.extract_stream_delta(json.loads(line[5:]))
+                if delta:
+                    chunks.append(delta)
+                    yield chatbot.sse_event(chatbot.stream_delta_event(renderer, delta))
+
+            ai_response = ''.join(chunks) or "No content in response"
+            await asyncio.to_thread(chatbot.record_exchange, conversation_id, user_message, files, ai_response)
+            renderer.finish()
+            yield chatbot.sse_event({
+                'type': 'done',
+                'status': 'success',
+                'response': renderer.html if chunks else chatbot.format_response(ai_response),
+                'timestamp': datetime.now().isoformat()
+            })
+        except Exception as e:
+            logger.warning("Streaming error: %s", e)
+            yield chatbot.sse_event({
+                'type': 'done',
+                'status': 'error',
+                'response': f"Sorry, I encountered an error: {str(e)}",
+                'timestamp': datetime.now().isoformat()
+            })
+        finally:
+            await upstream_response.aclose()
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def try_model_generation(model, prompt):
+    """Async counterpart of ``app.try_model_generation``"""
+    if not model_health.registry.allow(model['name']):
+        return {
+            'status': 'skipped',
+            'message': f"{model['name']} is temporarily skipped after repeated failures"
+        }
+
+    return await image_flights.do(
+        chatbot.image_flight_key(model, prompt),
+        lambda: attempt_model_generation(model, prompt)
+    )
+
+
+async def attempt_model_generation(model, prompt):
+    """Async counterpart of ``app.attempt_model_generation``
+
+    Runs as the shared single-flight task, so it is only cancelled (and
+    recorded as such) once every request waiting on it has been cancelled.
+    """
+    started = time.monotonic()
+    try:
+        with metrics.UpstreamCall('huggingface', model['name']) as call:
+            result = await request_model_image(model, prompt)
+            call.outcome = result.get('outcome', result['status'])
+    except asyncio.CancelledError:
+        model_health.registry.record(model['name'], 'cancelled', time.monotonic() - started)
+        raise
+    model_health.registry.record(
+        model['name'],
+        result.get('outcome', result['status']),
+        time.monotonic() - started,
+        result.get('message')
+    )
+    return result
+
+
+async def request_model_image(model, prompt):
+    """Async counterpart of ``app.request_model_image``"""
+    try:
+        response = await upstream.async_post(
+            model['url'],
+            headers=chatbot.image_model_headers(model),
+            json=chatbot.build_image_payload(model, prompt),
+            timeout=config.IMAGE_TIMEOUT,
+            retry_statuses=chatbot.HF_RETRY_STATUSES
+        )
+
+        result = chatbot.classify_image_response(model, response.status_code)
+        if result:
+            return result
+
+        response.raise_for_status()
+
+        # Writing the file and base64-encoding it are blocking, keep them off the loop
+        return await asyncio.to_thread(chatbot.image_success_result, model, prompt, response.content)
+
+    except admission.Overloaded as e:
+        return chatbot.throttled_image_result(model, e.retry_after)
+    except httpx.HTTPError as e:
+        error_msg = str(e)
+        if isinstance(e, httpx.HTTPStatusError):
+            try:
+                error_msg = chatbot.describe_image_error(model, e.response.json(), error_msg)
+            except Exception:
+                pass
+
+        logger.warning("Model %s error: %s", model['name'], error_msg, extra={'model': model['name']})
+        return {
+            'status': 'error',
+            'outcome': 'timeout' if isinstance(e, httpx.TimeoutException) else 'error',
+            'message': f"{model['name']}: {error_msg}"
+        }
+
+    except Exception as e:
+        logger.exception("Unexpected error with %s: %s", model['name'], e, extra={'model': model['name']})
+        return {
+            'status': 'error',
+            'message': f"{model['name']}: {str(e)}"
+        }
+
+
+async def generate_image_sequential(prompt):
+    """Walk the model fallback chain one model at a time"""
+    for model in chatbot.candidate_models():
+        logger.info("Trying model: %s", model['name'], extra={'model': model['name']})
+        result = await try_model_generation(model, prompt)
+
+        if result['status'] in ('success', 'throttled'):
+            return result
+    return None
+
+
+async def generate_image_hedged(prompt):
+    """Async counterpart of ``app.generate_image_hedged``
+
+    Losing attempts are real asyncio tasks, so cancelling them aborts the
+    upstream request and releases its connection immediately.
+    """
+    candidates = chatbot.candidate_models()
+    pending = {}
+    next_index = 0
+
+    def launch_next():
+        nonlocal next_index
+        model = candidates[next_index]
+        next_index += 1
+        logger.info("Trying model: %s", model['name'], extra={'model': model['name']})
+        pending[asyncio.ensure_future(try_model_generation(model, prompt))] = model
+
+    try:
+        launch_next()
+        while pending:
+            can_hedge = next_index < len(candidates) and len(pending) < chatbot.IMAGE_HEDGE_MAX_PARALLEL
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=chatbot.IMAGE_HEDGE_DELAY if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not done:
+                logger.info("No image after %ss, hedging with next model", chatbot.IMAGE_HEDGE_DELAY)
+                launch_next()
+                continue
+
+            for task in done:
+                model = pending.pop(task)
+                result = task.result()
+                if result['status'] in ('success', 'throttled'):
+                    return result
+                logger.info(
+                    "%s returned %s, trying next model", model['name'], result['status'],
+                    extra={'model': model['name'], 'outcome': result['status']}
+                )
+
+            for _ in done:
+                if next_index < len(candidates) and len(pending) < chatbot.IMAGE_HEDGE_MAX_PARALLEL:
+                    launch_next()
+
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+@app.route('/generate_image', methods=['POST'])
+async def generate_image():
+    """Generate image using latest free Hugging Face models with fallback system"""
+    retry_after = check_session_rate('image')
+    if retry_after:
+        return rate_limited_response(retry_after, 'message')
+
+    try:
+        data = await request.get_json()
+        prompt = data.get('prompt', '')
+
+        if not prompt:
+            return jsonify({
+                'status': 'error',
+                'message': 'No prompt provided'
+            }), 400
+
+        logger.debug("Generating image with prompt: %s", prompt)
+
+        result = await asyncio.to_thread(chatbot.find_stored_image, prompt)
+        if result:
+            return jsonify(result['response'])
+
+        if chatbot.IMAGE_HEDGING:
+            result = await generate_image_hedged(prompt)
+        else:
+            result = await generate_image_sequential(prompt)
+
+        if result and result['status'] == 'throttled':
+            return rate_limited_response(result['retry_after'], 'message')
+        if result:
+            return jsonify(result['response'])
+
+        return jsonify({
+            'status': 'error',
+            'message': 'All image generation services are currently unavailable. Please try again in a few moments.'
+        }), 503
+
+    except Exception as e:
+        logger.exception("Unexpected error in image generation: %s", e)
+        return jsonify({
+            'status': 'error',
+            'message': f"Image generation error: {str(e)}"
+        }), 500
+
+
+@app.route('/image_jobs', methods=['POST'])
+async def submit_image_job():
+    """Queue an image generation and return its job ID without waiting for it
+
+    Jobs run on ``app``'s bounded worker pool in both serving modes.
+    """
+    retry_after = check_session_rate('image')
+    if retry_after:
+        return rate_limited_response(retry_after, 'message')
+
+    data = await request.get_json() or {}
+    prompt = data.get('prompt', '')
+    if not prompt:
+        return jsonify({'status': 'error', 'message': 'No prompt provided'}), 400
+
+    try:
+        job = await asyncio.to_thread(chatbot.get_image_jobs().submit, session_rate_key(), prompt)
+    except image_jobs.QueueFull:
+        response = jsonify({'status': 'error', 'message': 'Too many images are being generated right now. Please try again shortly.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '10'
+        return response
+    return jsonify(chatbot.image_job_response(job)), 202
+
+
+@app.route('/image_jobs/<job_id>', methods=['GET'])
+async def get_image_job(job_id):
+    """Current state of an image job: status, latest progress, and the result once finished"""
+    job = await asyncio.to_thread(chatbot.get_image_jobs().get, job_id, session_rate_key())
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+    return jsonify(chatbot.image_job_response(job))
+
+
+@app.route('/image_jobs/<job_id>/events', methods=['GET'])
+async def image_job_events(job_id):
+    """Async counterpart of ``app.image_job_events``; waiting holds no thread"""
+    jobs = chatbot.get_image_jobs()
+    if await asyncio.to_thread(jobs.get, job_id, session_rate_key()) is None:
+        return jsonify({'status': 'error', 'message': 'Unknown job'}), 404
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+
+    def notify():
+        loop.call_soon_threadsafe(ready.set)
+
+    async def generate():
+        jobs.subscribe(job_id, notify)
+        try:
+            index = 0
+            last_sent = time.monotonic()
+            while True:
+                ready.clear()
+                events, finished = await asyncio.to_thread(jobs.events_after, job_id, index)
+                for event in events:
+                    yield chatbot.sse_event(event)
+                    last_sent = time.monotonic()
+                index += len(events)
+                if finished and not events:
+                    return
+                if not events:
+                    # A job run by another worker process is not announced here, so it is polled
+                    timeout = chatbot.IMAGE_JOB_HEARTBEAT if jobs.is_local(job_id) else image_jobs.REMOTE_POLL_INTERVAL
+                    try:
+                        await asyncio.wait_for(ready.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        if time.monotonic() - last_sent >= chatbot.IMAGE_JOB_HEARTBEAT:
+                            yield ": keep-alive\n\n"
+                            last_sent = time.monotonic()
+        finally:
+            jobs.unsubscribe(job_id, notify)
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/update_conversation_name', methods=['POST'])
+async def update_conversation_name():
+    data = await request.get_json()
+    session['conversation_name'] = data.get('name', 'New Conversation')
+    conversation_id = data.get('conversation_id') or session.get('chat_id')
+    if conversation_id:
+        await asyncio.to_thread(
+            chatbot.get_conversation_store().rename, conversation_id, session.get('chat_id'), session['conversation_name']
+        )
+    return jsonify({'status': 'success'})
+
+
+@app.route('/conversations', methods=['GET'])
+async def list_conversations():
+    """Paginated list of this session's conversations, most recent first"""
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    conversations, next_offset = await asyncio.to_thread(
+        chatbot.get_conversation_store().list_conversations, session.get('chat_id'), offset, limit
+    )
+    return jsonify({
+        'status': 'success',
+        'conversations': conversations,
+        'next_offset': next_offset
+    })
+
+
+@app.route('/conversations', methods=['DELETE'])
+async def delete_all_conversations():
+    deleted = await asyncio.to_thread(chatbot.get_conversation_store().delete_all, session.get('chat_id'))
+    await asyncio.to_thread(chatbot.forget_conversation_documents, deleted)
+    return jsonify({'status': 'success'})
+
+
+@app.route('/conversations/<conversation_id>/messages', methods=['GET'])
+async def list_conversation_messages(conversation_id):
+    """Paginated turns of a conversation, newest first; pass ``before`` to page back"""
+    store = chatbot.get_conversation_store()
+    conversation = await asyncio.to_thread(store.get, conversation_id, session.get('chat_id'))
+    if conversation is None:
+        return jsonify({'status': 'error', 'message': 'Conversation not found'}), 404
+
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    turns, next_before = await asyncio.to_thread(store.list_turns, conversation_id, before, limit)
+    return jsonify({
+        'status': 'success',
+        'conversation': {'id': conversation['id'], 'name': conversation['name'], 'turn_count': conversation['turn_count']},
+        'messages': turns,
+        'next_before': next_before
+    })
+
+
+@app.route('/conversations/<conversation_id>', methods=['DELETE'])
+async def delete_conversation(conversation_id):
+    if not await asyncio.to_thread(chatbot.get_conversation_store().delete, conversation_id, session.get('chat_id')):
+        return jsonify({'status': 'error', 'message': 'Conversation not found'}), 404
+    await asyncio.to_thread(chatbot.forget_conversation_documents, [conversation_id])
+    return jsonify({'status': 'success'})
+
+
+@app.route('/batch', methods=['POST'])
+async def run_batch_request():
+    """Async counterpart of ``app.run_batch_request``"""
+    retry_after = check_session_rate('chat')
+    if retry_after:
+        return rate_limited_response(retry_after, 'message')
+
+    concurrency, rate = chatbot.read_batch_options(request.args)
+    try:
+        lines = chatbot.read_batch_lines(await request.get_data(as_text=True), request.content_type or '')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': f"Invalid batch body: {str(e)}"}), 400
+
+    async def generate():
+        async for result in batch.run_batch_async(batch.parse_lines(lines), answer_batch_item, concurrency, rate):
+            yield json.dumps(result) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/upload_file', methods=['POST'])
+async def upload_file():
+    """Async counterpart of ``app.upload_file``"""
+    try:
+        files = await request.files
+        if 'file' not in files:
+            return jsonify({'status': 'error', 'message': 'No file provided'}), 400
+
+        file = files['file']
+        if file.filename == '':
+            return jsonify({'status': 'error', 'message': 'No file selected'}), 400
+
+        if file and chatbot.allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            record, deduplicated = await asyncio.to_thread(
+                chatbot.get_file_store().ingest,
+                file.stream, filename, file.mimetype or 'application/octet-stream'
+            )
+            chatbot.extraction_executor.submit(chatbot.prepare_attachment, record['id'])
+            return jsonify(chatbot.upload_result(record, filename, deduplicated))
+        else:
+            return jsonify({'status': 'error', 'message': 'File type not allowed'}), 400
+
+    except file_store.FileTooLarge as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 413
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/images/<filename>', methods=['GET'])
+async def serve_generated_image(filename):
+    """Serve a generated image with long-lived caching (see ``app.serve_generated_image``)"""
+    resolved = await asyncio.to_thread(chatbot.resolve_image_file, filename)
+    if resolved is None:
+        abort(404)
+
+    file, etag, immutable = resolved
+    # Quart's send_from_directory has no etag argument, so the content-hash
+    # ETag is set here and the conditional/range handling done afterwards
+    response = await send_from_directory(
+        os.path.abspath(app.config['GENERATED_IMAGES_FOLDER']),
+        file,
+        mimetype=chatbot.IMAGE_MIME_TYPES[file.rsplit('.', 1)[1]],
+        add_etags=False,
+        cache_timeout=chatbot.IMAGE_CACHE_MAX_AGE if immutable else 0,
+        conditional=False
+    )
+    response.set_etag(etag)
+    await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/cache_stats', methods=['GET'])
+async def cache_stats():
+    """Hit/miss counters for the slash-command response cache"""
+    return jsonify({
+        'status': 'success',
+        'command_cache': response_cache.command_cache.stats(),
+        'image_store': chatbot.get_image_store().stats(),
+        'image_variants': chatbot.get_image_variants().stats(),
+        'inline_images': chatbot.get_image_normalizer().stats(),
+        'image_jobs': chatbot.get_image_jobs().stats(),
+        'sessions': chatbot.get_session_store().stats() if chatbot.get_session_store() else None,
+        'traffic_capture': chatbot.get_traffic_recorder().stats() if chatbot.get_traffic_recorder() else None,
+        'single_flight': {'gemini': gemini_flights.stats(), 'image': image_flights.stats()}
+    })
+
+
+@app.route('/get_available_models', methods=['GET'])
+async def get_available_models():
+    """Endpoint to get available image generation models"""
+    return jsonify(chatbot.available_models_info())
+
+
+if __name__ == '__main__':
+    app.run(port=5000)
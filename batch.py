@@ -0,0 +1,218 @@
+"""Offline batch runner for JSONL prompt files
+
+Each input line is a JSON object shaped like a ``/send_message`` body
+(``message``, optional ``system_prompt``, ``temperature``, ``files``, and an
+``id`` echoed back in the result); slash commands work as in the chat. Items
+are fanned out over a bounded pool with an optional requests-per-second
+limit, and every result is appended to the output JSONL as soon as it
+finishes, tagged with its input line number.
+
+The output file doubles as the checkpoint: re-running the same command skips
+the lines that already have a result, so an interrupted run resumes where it
+stopped.
+
+    python batch.py prompts.jsonl -o results.jsonl --concurrency 8 --rate 5
+
+The same runner backs the ``/batch`` endpoint.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 8))
+BATCH_RATE = float(os.environ.get('BATCH_RATE', 0))
+
+
+class RateLimiter:
+    """Spaces out starts to at most ``rate`` per second (0 disables the limit)"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_start = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Claim the next start slot and return how long to wait for it"""
+        if not self.interval:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+            return start - now
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_lines(lines, skip=()):
+    """Yield ``(line_number, item)`` for non-blank JSONL lines not in ``skip``
+
+    Malformed lines are yielded with an ``error`` item so they show up in the
+    output instead of aborting the run.
+    """
+    for number, line in enumerate(lines, 1):
+        if number in skip or not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError('expected a JSON object')
+        except ValueError as e:
+            item = {'error': f"Invalid JSON: {str(e)}"}
+        yield number, item
+
+
+def completed_lines(output_path, retry_errors=False):
+    """Input line numbers that already have a result in ``output_path``"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if result.get('status') == 'success' or not retry_errors:
+                done.add(result.get('line'))
+            else:
+                done.discard(result.get('line'))
+    return done
+
+
+def item_result(number, item, result):
+    result = dict(result)
+    result['line'] = number
+    if 'id' in item:
+        result['id'] = item['id']
+    return result
+
+
+def error_result(number, item, message):
+    return item_result(number, item, {'status': 'error', 'response': message})
+
+
+def run_batch(items, handler, concurrency=BATCH_CONCURRENCY, rate=BATCH_RATE):
+    """Run ``handler(item)`` over ``(line, item)`` pairs, yielding results as they finish
+
+    At most ``concurrency`` items are in flight, so the input is consumed
+    lazily and memory does not grow with the size of the batch.
+    """
+    limiter = RateLimiter(rate)
+    items = iter(items)
+
+    def run(number, item):
+        if 'error' in item:
+            return error_result(number, item, item['error'])
+        try:
+            return item_result(number, item, handler(item))
+        except Exception as e:
+            return error_result(number, item, f"Unexpected error: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch') as executor:
+        pending = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max(1, concurrency):
+                next_item = next(items, None)
+                if next_item is None:
+                    exhausted = True
+                    break
+                limiter.acquire()
+                pending.add(executor.submit(run, *next_item))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+async def run_batch_async(items, handler, concurrency=BATCH_CONCURRENCY, rate=BATCH_RATE):
+    """Asyncio counterpart of ``run_batch`` for an ``async`` handler"""
+    # Imported here so the threaded (Flask) mode does not load asyncio
+    import asyncio
+
+    limiter = RateLimiter(rate)
+    items = iter(items)
+
+    async def run(number, item):
+        if 'error' in item:
+            return error_result(number, item, item['error'])
+        try:
+            return item_result(number, item, await handler(item))
+        except Exception as e:
+            return error_result(number, item, f"Unexpected error: {str(e)}")
+
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max(1, concurrency):
+                next_item = next(items, None)
+                if next_item is None:
+                    exhausted = True
+                    break
+                await asyncio.sleep(limiter.reserve())
+                pending.add(asyncio.ensure_future(run(*next_item)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a JSONL file of chat requests through the chatbot')
+    parser.add_argument('input', help='JSONL file with one request object per line')
+    parser.add_argument('-o', '--output', help='results JSONL (default: <input>.results.jsonl); also the resume checkpoint')
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help='requests in flight at once')
+    parser.add_argument('--rate', type=float, default=BATCH_RATE, help='max requests started per second (0 = unlimited)')
+    parser.add_argument('--retry-errors', action='store_true', help='re-run lines whose previous result was an error')
+    args = parser.parse_args(argv)
+
+    output_path = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    skip = completed_lines(output_path, args.retry_errors)
+    if skip:
+        print(f"Resuming: {len(skip)} lines already done", file=sys.stderr)
+
+    # Imported here so the module can be used by app.py without a cycle
+    import app as chatbot
+
+    counts = {'success': 0, 'error': 0}
+    started = time.monotonic()
+    with open(args.input, 'r', encoding='utf-8') as source, open(output_path, 'a+', encoding='utf-8') as out:
+        # Terminate a line cut short by an interrupted run so new results start cleanly
+        if out.tell() > 0:
+            out.seek(out.tell() - 1)
+            if out.read(1) != '\n':
+                out.write('\n')
+        items = parse_lines(source, skip)
+        for result in run_batch(items, chatbot.answer_batch_item, args.concurrency, args.rate):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            counts['success' if result['status'] == 'success' else 'error'] += 1
+            done = counts['success'] + counts['error']
+            if done % 50 == 0:
+                print(f"{done} done ({done / (time.monotonic() - started):.1f}/s)", file=sys.stderr)
+
+    print(
+        f"Finished: {counts['success']} succeeded, {counts['error']} failed "
+        f"in {time.monotonic() - started:.1f}s -> {output_path}",
+        file=sys.stderr
+    )
+    return 1 if counts['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""Offline load test: the app in front of local stub upstreams
+
+Starts ``stub_upstreams.py`` and the app (Flask, or the ASGI mode under
+hypercorn) as subprocesses on local ports, with the app's base URLs pointed
+at the stubs and its rate limits turned off. It then drives each scenario at
+a fixed concurrency and reports throughput, p50/p95/p99 latency, errors and
+the app's peak RSS. Nothing leaves the machine, and the app runs in a
+temporary working directory, so the repo's own instance/ and static/ are left
+alone.
+
+    python benchmarks/bench_load.py --concurrency 16 --requests 200
+    python benchmarks/bench_load.py --server asgi --scenarios chat,image --hf-latency fixed:2
+
+Scenarios: ``chat`` (/send_message), ``stream`` (/stream_message),
+``command`` (slash commands through /send_message), ``image``
+(/generate_image) and ``upload`` (/upload_file). Prompts and uploads are
+unique per request, so caches and deduplication do not flatter the numbers.
+Streamed replies are also checked against the stub's text, which includes
+non-ASCII characters; a reply that differs counts as a ``garbled`` error.
+
+To gate regressions, save a run with ``--json baseline.json`` and compare
+later runs with ``--baseline baseline.json``. The exit status is 1 when a
+scenario's throughput drops or its p95 grows by more than ``--tolerance``.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_upstreams import add_stub_arguments, reply_text, stub_argv  # noqa: E402
+
+SCENARIOS = ('chat', 'stream', 'command', 'image', 'upload')
+COMMANDS = ('/quick', '/define', '/summary', '/bullet')
+WORDS = 'lighthouse harbor quantum river garden violin glacier lantern compass meadow orbit canyon'.split()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"process exited with status {process.returncode} during startup")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing listening on port {port} after {timeout}s")
+
+
+def start_stubs(args):
+    gemini_port, hf_port = free_port(), free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'stub_upstreams.py'),
+         '--gemini-port', str(gemini_port), '--hf-port', str(hf_port)] + stub_argv(args),
+        stderr=subprocess.DEVNULL
+    )
+    wait_for_port(gemini_port, process)
+    wait_for_port(hf_port, process)
+    return process, f"http://127.0.0.1:{gemini_port}", f"http://127.0.0.1:{hf_port}"
+
+
+def app_environment(gemini_base, hf_base, keep_rate_limits):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': REPO_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+        'GEMINI_API_BASE': gemini_base,
+        'HF_API_BASE': hf_base,
+        'LOG_LEVEL': 'WARNING'
+    })
+    if not keep_rate_limits:
+        for name in ('SESSION_CHAT_RATE_PER_MIN', 'SESSION_IMAGE_RATE_PER_MIN', 'GEMINI_RATE_LIMIT', 'HF_RATE_LIMIT'):
+            env[name] = '0'
+    return env
+
+
+def start_app(args, env, workdir):
+    port = free_port()
+    if args.server == 'asgi':
+        command = [sys.executable, '-m', 'hypercorn', 'asgi:app', '--bind', f"127.0.0.1:{port}"]
+    else:
+        command = [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    output = None if args.verbose else subprocess.DEVNULL
+    process = subprocess.Popen(command, env=env, cwd=workdir, stdout=output, stderr=output)
+    wait_for_port(port, process)
+    return process, f"http://127.0.0.1:{port}"
+
+
+def peak_rss_mb(process):
+    """Peak resident set size of a process: VmHWM while it runs, else the children's rusage"""
+    try:
+        with open(f"/proc/{process.pid}/status") as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def children_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def unique_words(rng, count=4):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def make_request(scenario, index, rng, upload_kb):
+    """``(path, kwargs)`` for one request of a scenario"""
+    tag = f"{index}-{rng.getrandbits(32):08x}"
+    if scenario == 'chat':
+        return '/send_message', {'json': {'message': f"Tell me about {unique_words(rng)} ({tag})"}}
+    if scenario == 'stream':
+        return '/stream_message', {'json': {'message': f"Tell me about {unique_words(rng)} ({tag})"}, 'stream': True}
+    if scenario == 'command':
+        return '/send_message', {'json': {'message': f"{COMMANDS[index % len(COMMANDS)]} {unique_words(rng)} {tag}"}}
+    if scenario == 'image':
+        return '/generate_image', {'json': {'prompt': f"a {unique_words(rng)} at dusk, {tag}"}}
+    body = (f"{tag} " + ' '.join(rng.choice(WORDS) for _ in range(upload_kb * 128))).encode('utf-8')
+    return '/upload_file', {'files': {'file': (f"notes-{tag}.txt", body, 'text/plain')}}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def streamed_text(response):
+    """Concatenated ``delta`` text of a /stream_message reply"""
+    chunks = []
+    for line in response.iter_lines():
+        if line.startswith(b'data:'):
+            event = json.loads(line[5:])
+            if event.get('type') == 'delta':
+                chunks.append(event['text'])
+    return ''.join(chunks)
+
+
+def run_scenario(base_url, scenario, total, concurrency, upload_kb, timeout, expected_reply=None):
+    """Send ``total`` requests with ``concurrency`` workers; each worker keeps its own session
+
+    ``expected_reply`` is the upstream's reply text, which streamed replies must reproduce.
+    """
+    latencies = []
+    errors = {}
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = requests.Session()
+        # Load the page first so the session gets a chat id, like a browser would
+        client.get(base_url + '/', timeout=timeout)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            path, kwargs = make_request(scenario, index, rng, upload_kb)
+            started = time.perf_counter()
+            try:
+                response = client.post(base_url + path, timeout=timeout, **kwargs)
+                status = response.status_code
+                if scenario == 'stream' and status == 200 and streamed_text(response) != expected_reply:
+                    status = 'garbled'
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if status != 200:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker, seed) for seed in range(concurrency)]:
+            future.result()
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': round(sum(errors.values()) / len(latencies), 4) if latencies else None,
+        'duration': round(duration, 3),
+        'throughput': round(len(latencies) / duration, 2),
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99)
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of ``results`` against a baseline run, as readable lines"""
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        if current['throughput'] < previous['throughput'] * (1 - tolerance):
+            regressions.append(f"{scenario}: throughput {current['throughput']}/s vs {previous['throughput']}/s")
+        if previous['p95'] and current['p95'] > previous['p95'] * (1 + tolerance):
+            regressions.append(f"{scenario}: p95 {current['p95'] * 1000:.0f}ms vs {previous['p95'] * 1000:.0f}ms")
+    return regressions
+
+
+def print_report(results):
+    print(f"\nserver={results['server']} concurrency={results['concurrency']}")
+    print(f"{'scenario':<10} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for scenario, r in results['scenarios'].items():
+        print(
+            f"{scenario:<10} {r['requests']:>8} {sum(r['errors'].values()):>7} {r['throughput']:>8.1f} "
+            f"{r['p50'] * 1000:>7.0f}ms {r['p95'] * 1000:>7.0f}ms {r['p99'] * 1000:>7.0f}ms"
+        )
+        if r['errors']:
+            print(f"{'':<10} errors by status: {r['errors']}")
+    if results['peak_rss_mb'] is not None:
+        print(f"app peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline load test of the chatbot against stub upstreams')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset of %(default)s')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--upload-kb', type=int, default=64, help='size of uploaded text files')
+    parser.add_argument('--timeout', type=float, default=180)
+    parser.add_argument('--keep-rate-limits', action='store_true', help="leave the app's session/upstream limits on")
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression vs the baseline (fraction)')
+    parser.add_argument('--verbose', action='store_true', help="show the app's log output")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stubs, gemini_base, hf_base = start_stubs(args)
+    workdir = tempfile.mkdtemp(prefix='chatbot-bench-')
+    app_process = None
+    results = {'server': args.server, 'concurrency': args.concurrency, 'scenarios': {}, 'peak_rss_mb': None}
+    try:
+        app_process, base_url = start_app(args, app_environment(gemini_base, hf_base, args.keep_rate_limits), workdir)
+        for scenario in scenarios:
+            print(f"running {scenario} ({args.requests} requests, concurrency {args.concurrency})...", file=sys.stderr)
+            results['scenarios'][scenario] = run_scenario(
+                base_url, scenario, args.requests, args.concurrency, args.upload_kb, args.timeout,
+                expected_reply=reply_text(args.reply_chars)
+            )
+        results['peak_rss_mb'] = peak_rss_mb(app_process)
+    finally:
+        for process in (app_process, stubs):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if results['peak_rss_mb'] is None:
+        results['peak_rss_mb'] = children_peak_rss_mb()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
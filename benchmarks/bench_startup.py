@@ -0,0 +1,178 @@
+"""Startup benchmark: import time, time to first response and worker restarts
+
+Measures how long a new process takes before it is useful:
+
+- ``import``: importing ``app`` (which builds the Flask app) in a fresh
+  interpreter;
+- ``first_response``: launching the server until ``GET /`` answers 200, for
+  the development server (``python app.py``) and for the pre-fork launcher
+  (``serve.py``);
+- ``worker_restart``: killing the only ``serve.py`` worker until a freshly
+  forked one answers 200 again.
+
+Like ``bench_load.py`` it runs against ``stub_upstreams.py`` in a temporary
+working directory, so warm-up connects to the stubs and nothing leaves the
+machine. The ``serve.py`` measurements need gunicorn and are skipped without
+it.
+
+    python benchmarks/bench_startup.py --repeat 5
+    python benchmarks/bench_startup.py --json startup.json
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import app_environment, free_port, start_stubs, wait_for_port  # noqa: E402
+from stub_upstreams import add_stub_arguments  # noqa: E402
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import app; "
+    "print((time.perf_counter() - start) * 1000)"
+)
+
+
+def gunicorn_available():
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def wait_for_ok(url, process, timeout=30):
+    """Poll ``url`` until it answers 200; returns the time that took in ms"""
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"process exited with status {process.returncode} during startup")
+        try:
+            if requests.get(url, timeout=5).status_code == 200:
+                return (time.perf_counter() - start) * 1000
+        except requests.RequestException:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer 200 within {timeout}s")
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def server_command(server, port):
+    if server == 'prefork':
+        return [sys.executable, os.path.join(REPO_DIR, 'serve.py'), '--bind', f"127.0.0.1:{port}", '--workers', '2']
+    return [sys.executable, os.path.join(REPO_DIR, 'app.py')]
+
+
+def measure_import(env, workdir):
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SNIPPET], env=env, cwd=workdir, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_first_response(server, env, workdir, verbose):
+    port = free_port()
+    env = dict(env, HOST='127.0.0.1', PORT=str(port), FLASK_DEBUG='0')
+    output = None if verbose else subprocess.DEVNULL
+    start = time.perf_counter()
+    process = subprocess.Popen(server_command(server, port), env=env, cwd=workdir, stdout=output, stderr=output)
+    try:
+        wait_for_ok(f"http://127.0.0.1:{port}/", process)
+        return (time.perf_counter() - start) * 1000
+    finally:
+        stop(process)
+
+
+def worker_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def measure_worker_restart(env, workdir, verbose):
+    port = free_port()
+    output = None if verbose else subprocess.DEVNULL
+    command = [sys.executable, os.path.join(REPO_DIR, 'serve.py'), '--bind', f"127.0.0.1:{port}", '--workers', '1']
+    process = subprocess.Popen(command, env=env, cwd=workdir, stdout=output, stderr=output)
+    url = f"http://127.0.0.1:{port}/"
+    try:
+        wait_for_port(port, process)
+        wait_for_ok(url, process)
+        workers = worker_pids(process.pid)
+        if len(workers) != 1:
+            raise RuntimeError(f"expected one worker, found {len(workers)}")
+        os.kill(workers[0], signal.SIGKILL)
+        return wait_for_ok(url, process)
+    finally:
+        stop(process)
+
+
+def summarize(samples):
+    return {
+        'median_ms': round(statistics.median(samples), 1),
+        'min_ms': round(min(samples), 1),
+        'max_ms': round(max(samples), 1),
+        'runs': len(samples)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Startup benchmark of the chatbot against stub upstreams')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement (the median is reported)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help="show the servers' log output")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    prefork = gunicorn_available() and sys.platform.startswith('linux')
+    if not prefork:
+        print("gunicorn is not installed (or /proc is missing): skipping serve.py", file=sys.stderr)
+
+    stubs, gemini_base, hf_base = start_stubs(args)
+    workdir = tempfile.mkdtemp(prefix='chatbot-bench-')
+    env = app_environment(gemini_base, hf_base, keep_rate_limits=False)
+    results = {}
+    try:
+        measurements = [('import', lambda: measure_import(env, workdir)),
+                        ('first_response_flask', lambda: measure_first_response('flask', env, workdir, args.verbose))]
+        if prefork:
+            measurements += [
+                ('first_response_prefork', lambda: measure_first_response('prefork', env, workdir, args.verbose)),
+                ('worker_restart', lambda: measure_worker_restart(env, workdir, args.verbose))
+            ]
+        for name, measure in measurements:
+            print(f"measuring {name} ({args.repeat} runs)...", file=sys.stderr)
+            results[name] = summarize([measure() for _ in range(args.repeat)])
+    finally:
+        stop(stubs)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'measurement':<24} {'median':>9} {'min':>9} {'max':>9}")
+    for name, summary in results.items():
+        print(f"{name:<24} {summary['median_ms']:>7.1f}ms {summary['min_ms']:>7.1f}ms {summary['max_ms']:>7.1f}ms")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
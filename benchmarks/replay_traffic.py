@@ -0,0 +1,460 @@
+"""Replay captured traffic against a local instance with its original timing
+
+Reads a capture written by the app with ``TRAFFIC_CAPTURE_PATH`` set (see
+traffic_capture.py) and re-issues each request at its recorded offset from
+the first one, divided by ``--speed``. Bursts, idle gaps and per-session
+ordering are kept, unlike the fixed concurrency of ``bench_load.py``.
+Captures contain no content, so messages and prompts are filler text of the
+recorded length, and each session is replayed by its own cookie jar.
+Attachments are synthetic files of the recorded type and size, uploaded
+before the replay starts. They are valid files, so the app extracts and
+normalizes them as it would real ones: noise images (made with Pillow; without
+it images are random bytes and are not normalized), PDFs of filler text with
+about 4KB per page, and DOCX files of filler paragraphs.
+
+By default the app and ``stub_upstreams.py`` are started on local ports in a
+temporary working directory, as in ``bench_load.py``. ``--url`` replays
+against an instance that is already running instead.
+
+    python benchmarks/replay_traffic.py capture.jsonl
+    python benchmarks/replay_traffic.py capture.jsonl --speed 10 --server asgi --json replay.json
+
+The report gives, per kind of request, the error rate and p50/p95/p99
+latency, next to the p50/p95 recorded in the capture. It also gives the
+schedule lag (how late requests were sent), which shows when the replayer
+itself could not keep up.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import WORDS, app_environment, peak_rss_mb, percentile, start_app, start_stubs  # noqa: E402
+from stub_upstreams import add_stub_arguments  # noqa: E402
+
+# Request statuses that count as success
+OK_STATUSES = (200, 202)
+# Upload extension per attachment type (the app only takes these extensions)
+EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/gif': 'gif',
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx'
+}
+DEFAULT_ATTACHMENT_BYTES = 64 * 1024
+IMAGE_FORMATS = {'image/png': 'PNG', 'image/jpeg': 'JPEG', 'image/gif': 'GIF'}
+PDF_LINES_PER_PAGE = 50
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+DOCX_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def load_capture(path, limit=None):
+    """Records of a capture sorted by arrival time, and the number of unreadable lines"""
+    records = []
+    skipped = 0
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                float(record['ts'])
+                record['route']
+            except (ValueError, KeyError, TypeError):
+                skipped += 1
+                continue
+            records.append(record)
+    records.sort(key=lambda r: r['ts'])
+    return records[:limit] if limit else records, skipped
+
+
+def filler(rng, chars, tag=''):
+    """Text of about ``chars`` characters ending with ``tag``"""
+    text = tag
+    while len(text) < chars:
+        text = f"{rng.choice(WORDS)} {text}"
+    return text.strip()
+
+
+def synthetic_image(rng, size, mime_type):
+    """Noise image in ``mime_type`` of ``size`` bytes, or random bytes without Pillow"""
+    try:
+        from PIL import Image
+    except ImportError:
+        print(f"Pillow is not installed: the {mime_type} attachment is random bytes and will not be normalized",
+              file=sys.stderr)
+        return rng.randbytes(size)
+    side = max(16, int(math.sqrt(size / 3)))
+    while True:
+        image = Image.frombytes('RGB', (side, side), rng.randbytes(side * side * 3))
+        buffer = io.BytesIO()
+        image.save(buffer, IMAGE_FORMATS[mime_type])
+        body = buffer.getvalue()
+        if len(body) <= size or side == 16:
+            break
+        side = max(16, int(side * math.sqrt(size / len(body)) * 0.95))
+    # Decoders stop at the end of the image, so trailing padding is ignored
+    return body + bytes(max(0, size - len(body)))
+
+
+def pdf_document(pages):
+    """PDF with one page per content stream in ``pages`` (bytes), in Helvetica"""
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        ('<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            ' '.join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)
+        )).encode('ascii'),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+    ]
+    for i, content in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {5 + 2 * i} 0 R >>".encode('ascii')
+        )
+        objects.append(b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream')
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def pdf_pages(lines):
+    """Page content streams of ``PDF_LINES_PER_PAGE`` text lines each"""
+    return [
+        b'BT /F1 10 Tf 12 TL 40 760 Td\n' + b''.join(lines[i:i + PDF_LINES_PER_PAGE]) + b'ET'
+        for i in range(0, len(lines), PDF_LINES_PER_PAGE)
+    ]
+
+
+def synthetic_pdf(rng, size):
+    """PDF of filler text lines, about 4KB per page, of ``size`` bytes"""
+    lines = []
+    total = 0
+    while total < size:
+        line = f"({filler(rng, 75)}) Tj T*\n".encode('ascii')
+        lines.append(line)
+        total += len(line)
+    while True:
+        document = pdf_document(pdf_pages(lines))
+        excess = len(document) - size
+        if excess <= 0 or len(lines) == 1:
+            break
+        # Page objects and the xref add to the text, so drop enough lines to cover them
+        del lines[max(1, len(lines) - excess // len(lines[-1]) - 1):]
+    if len(document) < size:
+        lines[-1] += b' ' * (size - len(document))
+        document = pdf_document(pdf_pages(lines))
+    return document
+
+
+def docx_document(paragraphs):
+    body = ''.join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', DOCX_RELS)
+        archive.writestr(
+            'word/document.xml',
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<w:document xmlns:w="{DOCX_NS}"><w:body>{body}</w:body></w:document>'
+        )
+    return buffer.getvalue()
+
+
+def synthetic_docx(rng, size):
+    """DOCX of filler paragraphs, compressed like Word's, of about ``size`` bytes"""
+    overhead = len(docx_document([]))
+    paragraphs = [filler(rng, 200) for _ in range(8)]
+    document = docx_document(paragraphs)
+    # Filler compresses at a steady ratio, so rescaling converges in a few rounds
+    for _ in range(4):
+        if size * 0.98 <= len(document) <= size:
+            break
+        count = max(1, int(len(paragraphs) * (size - overhead) / max(1, len(document) - overhead)))
+        paragraphs = paragraphs[:count] + [filler(rng, 200) for _ in range(count - len(paragraphs))]
+        document = docx_document(paragraphs)
+    while len(paragraphs) > 1 and len(document) > size:
+        paragraphs.pop()
+        document = docx_document(paragraphs)
+    # The zip comment takes the rest (up to its 64KB limit)
+    padding = min(max(0, size - len(document)), 65535)
+    if padding:
+        buffer = io.BytesIO(document)
+        with zipfile.ZipFile(buffer, 'a') as archive:
+            archive.comment = b' ' * padding
+        document = buffer.getvalue()
+    return document
+
+
+def synthetic_file(rng, mime_type, size):
+    """``(extension, body)`` of a valid file of ``mime_type`` and about ``size`` bytes"""
+    extension = EXTENSIONS.get(mime_type, 'txt')
+    if mime_type in IMAGE_FORMATS:
+        return extension, synthetic_image(rng, size, mime_type)
+    if extension == 'pdf':
+        return extension, synthetic_pdf(rng, size)
+    if extension == 'docx':
+        return extension, synthetic_docx(rng, size)
+    return extension, filler(rng, size, f"{size}").encode('utf-8')
+
+
+def attachment_key(attachment):
+    return attachment.get('type') or 'text/plain', attachment.get('bytes') or DEFAULT_ATTACHMENT_BYTES
+
+
+def upload_attachments(base_url, records, rng, timeout):
+    """Upload one synthetic file per distinct attachment type and size; returns ``{key: file entry}``"""
+    keys = {attachment_key(a) for r in records for a in r.get('attachments') or ()}
+    uploaded = {}
+    client = requests.Session()
+    for mime_type, size in sorted(keys):
+        extension, body = synthetic_file(rng, mime_type, size)
+        response = client.post(
+            base_url + '/upload_file', timeout=timeout,
+            files={'file': (f"replay-{len(uploaded)}.{extension}", body, mime_type)}
+        )
+        response.raise_for_status()
+        result = response.json()
+        uploaded[(mime_type, size)] = {'file_id': result.get('file_id'), 'type': mime_type, 'name': f"replay.{extension}"}
+    return uploaded
+
+
+def rebuild_request(record, index, rng, uploads):
+    """``(path, json body)`` re-creating a captured request with filler content"""
+    tag = f"{index}-{rng.getrandbits(32):08x}"
+    if record['route'] in ('/generate_image', '/image_jobs'):
+        return record['route'], {'prompt': filler(rng, record.get('prompt_chars') or 40, tag)}
+    command = record.get('command')
+    chars = record.get('message_chars') or 40
+    if command:
+        message = f"{command} {filler(rng, max(chars - len(command) - 1, 1), tag)}"
+    else:
+        message = filler(rng, chars, tag)
+    body = {
+        'message': message,
+        'files': [uploads[attachment_key(a)] for a in record.get('attachments') or ()]
+    }
+    if record.get('system_prompt_chars'):
+        body['system_prompt'] = filler(rng, record['system_prompt_chars'])
+    if record.get('temperature') is not None:
+        body['temperature'] = record['temperature']
+    if record.get('history') is False:
+        body['history'] = False
+    return record['route'], body
+
+
+class Sessions:
+    """One cookie jar per captured session, opened like a browser would (``GET /`` first)"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.clients.get(key) if key else None
+            if entry is None:
+                entry = (requests.Session(), threading.Lock(), [False])
+                if key:
+                    self.clients[key] = entry
+        client, lock, opened = entry
+        with lock:
+            if not opened[0]:
+                client.get(self.base_url + '/', timeout=self.timeout)
+                opened[0] = True
+        return client
+
+
+def replay(base_url, records, speed, max_in_flight, timeout, seed=0):
+    """Send the records on their schedule; returns one result dict per record"""
+    rng = random.Random(seed)
+    uploads = upload_attachments(base_url, records, rng, timeout)
+    prepared = [rebuild_request(record, index, rng, uploads) for index, record in enumerate(records)]
+    sessions = Sessions(base_url, timeout)
+    results = [None] * len(records)
+
+    def send(index, due):
+        record = records[index]
+        path, body = prepared[index]
+        lag = time.perf_counter() - due
+        started = None
+        try:
+            client = sessions.get(record.get('session'))
+            started = time.perf_counter()
+            response = client.post(base_url + path, json=body, timeout=timeout, stream=True)
+            # Streamed replies count until their last event
+            for _ in response.iter_content(chunk_size=65536):
+                pass
+            status = response.status_code
+        except requests.RequestException as e:
+            started = started or time.perf_counter()
+            status = type(e).__name__
+        results[index] = {
+            'kind': record.get('kind') or record['route'],
+            'status': status,
+            'latency': time.perf_counter() - started,
+            'lag': lag,
+            'captured_ms': record.get('duration_ms')
+        }
+
+    first_ts = records[0]['ts']
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for index, record in enumerate(records):
+            due = started + (record['ts'] - first_ts) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, index, due)
+    return results, time.perf_counter() - started
+
+
+def summarize(results):
+    """Per-kind and overall latency, error and schedule-lag statistics"""
+    groups = {}
+    for result in results:
+        groups.setdefault(result['kind'], []).append(result)
+    groups['all'] = results
+
+    summary = {}
+    for kind, group in groups.items():
+        latencies = sorted(r['latency'] for r in group)
+        lags = sorted(r['lag'] for r in group)
+        captured = sorted(r['captured_ms'] / 1000 for r in group if r['captured_ms'] is not None)
+        errors = {}
+        for r in group:
+            if r['status'] not in OK_STATUSES:
+                errors[str(r['status'])] = errors.get(str(r['status']), 0) + 1
+        summary[kind] = {
+            'requests': len(group),
+            'errors': errors,
+            'error_rate': round(sum(errors.values()) / len(group), 4),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'captured_p50': percentile(captured, 0.50),
+            'captured_p95': percentile(captured, 0.95),
+            'lag_p95': percentile(lags, 0.95),
+            'lag_max': lags[-1]
+        }
+    return summary
+
+
+def milliseconds(value):
+    return f"{value * 1000:>7.0f}ms" if value is not None else f"{'-':>9}"
+
+
+def print_report(results):
+    print(f"\nreplayed {results['requests']} requests spanning {results['capture_span']:.1f}s "
+          f"at {results['speed']}x in {results['duration']:.1f}s")
+    print(f"{'kind':<10} {'requests':>8} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9} "
+          f"{'rec p50':>9} {'rec p95':>9} {'lag p95':>9}")
+    for kind, r in results['kinds'].items():
+        print(
+            f"{kind:<10} {r['requests']:>8} {sum(r['errors'].values()):>7} {milliseconds(r['p50'])} "
+            f"{milliseconds(r['p95'])} {milliseconds(r['p99'])} {milliseconds(r['captured_p50'])} "
+            f"{milliseconds(r['captured_p95'])} {milliseconds(r['lag_p95'])}"
+        )
+        if r['errors']:
+            print(f"{'':<10} errors by status: {r['errors']}")
+    if results['peak_rss_mb'] is not None:
+        print(f"app peak RSS: {results['peak_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay captured traffic against the chatbot with its original timing')
+    parser.add_argument('capture', help='JSONL file written with TRAFFIC_CAPTURE_PATH')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed-up (2 sends the traffic twice as fast)')
+    parser.add_argument('--limit', type=int, help='replay only the first N requests')
+    parser.add_argument('--url', help='replay against this running instance instead of starting one with stubs')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='cap on concurrent requests from the replayer')
+    parser.add_argument('--timeout', type=float, default=180)
+    parser.add_argument('--keep-rate-limits', action='store_true', help="leave the app's session/upstream limits on")
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help="show the app's log output")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error('--speed must be positive')
+
+    records, skipped = load_capture(args.capture, args.limit)
+    if skipped:
+        print(f"skipped {skipped} unreadable lines", file=sys.stderr)
+    if not records:
+        parser.error(f"no requests in {args.capture}")
+
+    stubs = app_process = workdir = None
+    base_url = args.url.rstrip('/') if args.url else None
+    try:
+        if base_url is None:
+            stubs, gemini_base, hf_base = start_stubs(args)
+            workdir = tempfile.mkdtemp(prefix='chatbot-replay-')
+            app_process, base_url = start_app(
+                args, app_environment(gemini_base, hf_base, args.keep_rate_limits), workdir
+            )
+        print(f"replaying {len(records)} requests at {args.speed}x...", file=sys.stderr)
+        replayed, duration = replay(base_url, records, args.speed, args.max_in_flight, args.timeout)
+        results = {
+            'requests': len(records),
+            'speed': args.speed,
+            'capture_span': records[-1]['ts'] - records[0]['ts'],
+            'duration': round(duration, 3),
+            'kinds': summarize(replayed),
+            'peak_rss_mb': peak_rss_mb(app_process) if app_process else None
+        }
+    finally:
+        for process in (app_process, stubs):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
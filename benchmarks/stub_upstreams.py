@@ -0,0 +1,236 @@
+"""Local stand-ins for the Gemini and Hugging Face inference APIs
+
+Serves ``generateContent`` / ``streamGenerateContent`` (Gemini) and
+``/models/<org>/<name>`` (Hugging Face image models) on two local ports with
+configurable latency, injected 503 "model loading" and 429 responses, and
+image bodies of a configurable size. Point the app at them with
+``GEMINI_API_BASE`` and ``HF_API_BASE``:
+
+    python benchmarks/stub_upstreams.py --gemini-port 8901 --hf-port 8902 \\
+        --gemini-latency lognormal:0.4:0.5 --hf-latency uniform:1:3 --loading-rate 0.1
+    GEMINI_API_BASE=http://127.0.0.1:8901 HF_API_BASE=http://127.0.0.1:8902 python app.py
+
+Latency specs are ``fixed:S``, ``uniform:A:B``, ``lognormal:MEDIAN:SIGMA`` or
+``exp:MEAN`` (seconds). ``GET /stats`` on either port returns request counts.
+Standard library only, so it runs anywhere the app does.
+"""
+import argparse
+import json
+import math
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY_TEXT = (
+    "Here is a **concise** answer with a bit of `code` and *emphasis*.\n\n"
+    "- First point about the question\n"
+    "- Second point with more detail\n\n"
+    "```python\nprint('hello')\n```\n\n"
+    "Non-ASCII text must survive intact: naïve café, Grüße, 日本語 😀\n\n"
+)
+
+
+def reply_text(chars):
+    """The Gemini reply of ``chars`` characters, so clients can check what they received"""
+    text = REPLY_TEXT * (chars // len(REPLY_TEXT) + 1)
+    return text[:chars]
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a function returning a delay in seconds"""
+    kind, _, rest = spec.partition(':')
+    values = [float(v) for v in rest.split(':')] if rest else []
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    if kind == 'exp':
+        return lambda: random.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+
+class PngFactory:
+    """Valid PNGs of roughly ``size_kb`` made of noise, each made unique by a text chunk"""
+
+    def __init__(self, size_kb):
+        side = max(32, int(math.sqrt(size_kb * 1024 / 3)))
+        rows = b''.join(b'\x00' + random.randbytes(side * 3) for _ in range(side))
+        self.head = b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+        self.tail = png_chunk(b'IDAT', zlib.compress(rows, 1)) + png_chunk(b'IEND', b'')
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def make(self):
+        with self.lock:
+            self.counter += 1
+            serial = self.counter
+        # A unique body per response, so the content-addressed image store cannot deduplicate
+        return self.head + png_chunk(b'tEXt', b'Comment\x00' + f"stub-{serial}-{random.random()}".encode()) + self.tail
+
+
+class StubState:
+    def __init__(self, args):
+        self.gemini_latency = parse_latency(args.gemini_latency)
+        self.hf_latency = parse_latency(args.hf_latency)
+        self.loading_rate = args.loading_rate
+        self.throttle_rate = args.throttle_rate
+        self.reply_chars = args.reply_chars
+        self.stream_chunks = args.stream_chunks
+        self.images = PngFactory(args.image_kb)
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reply_text(self):
+        return reply_text(self.reply_chars)
+
+
+def make_handler(state, service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, content_type='application/json', headers=()):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status, data, headers=()):
+            self.send_body(status, json.dumps(data, ensure_ascii=False).encode('utf-8'), headers=headers)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                with state.lock:
+                    self.send_json(200, dict(state.counts))
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            if service == 'gemini':
+                self.handle_gemini()
+            else:
+                self.handle_hf()
+
+        def maybe_throttle(self, key):
+            if random.random() < state.throttle_rate:
+                state.count(f"{key}:429")
+                self.send_json(429, {'error': {'message': 'Resource exhausted'}}, [('Retry-After', '1')])
+                return True
+            return False
+
+        def handle_gemini(self):
+            streaming = ':streamGenerateContent' in self.path
+            key = 'gemini_stream' if streaming else 'gemini'
+            state.count(key)
+            if self.maybe_throttle(key):
+                return
+            delay = state.gemini_latency()
+            if not streaming:
+                time.sleep(delay)
+                self.send_json(200, {'candidates': [{'content': {'parts': [{'text': state.reply_text()}]}}]})
+                return
+
+            # Server-sent events, spreading the latency over the chunks
+            text = state.reply_text()
+            size = max(1, len(text) // state.stream_chunks)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for i in range(0, len(text), size):
+                time.sleep(delay / state.stream_chunks)
+                event = {'candidates': [{'content': {'parts': [{'text': text[i:i + size]}]}}]}
+                # Raw UTF-8 like the real API, with no charset on the content type
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode('utf-8'))
+                self.wfile.flush()
+            self.close_connection = True
+
+        def handle_hf(self):
+            state.count('hf')
+            if self.maybe_throttle('hf'):
+                return
+            if random.random() < state.loading_rate:
+                state.count('hf:503')
+                time.sleep(min(0.05, state.hf_latency()))
+                self.send_json(503, {'error': f"Model {self.path[8:]} is currently loading", 'estimated_time': 20.0})
+                return
+            time.sleep(state.hf_latency())
+            self.send_body(200, state.images.make(), 'image/png')
+
+    return Handler
+
+
+def add_stub_arguments(parser):
+    """Stub options, shared with the benchmark drivers that launch the stubs"""
+    parser.add_argument('--gemini-latency', default='lognormal:0.3:0.4', help='Gemini latency spec (default %(default)s)')
+    parser.add_argument('--hf-latency', default='uniform:0.5:1.5', help='image model latency spec (default %(default)s)')
+    parser.add_argument('--loading-rate', type=float, default=0.05, help='fraction of image calls answered 503 loading')
+    parser.add_argument('--throttle-rate', type=float, default=0.01, help='fraction of calls answered 429')
+    parser.add_argument('--image-kb', type=int, default=512, help='approximate size of image bodies')
+    parser.add_argument('--reply-chars', type=int, default=1200, help='length of Gemini replies')
+    parser.add_argument('--stream-chunks', type=int, default=20, help='SSE events per streamed reply')
+
+
+def stub_argv(args):
+    """Command-line arguments reproducing the stub options in ``args``"""
+    return [
+        '--gemini-latency', args.gemini_latency, '--hf-latency', args.hf_latency,
+        '--loading-rate', str(args.loading_rate), '--throttle-rate', str(args.throttle_rate),
+        '--image-kb', str(args.image_kb), '--reply-chars', str(args.reply_chars),
+        '--stream-chunks', str(args.stream_chunks)
+    ]
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(args):
+    state = StubState(args)
+    servers = [
+        StubServer((args.host, args.gemini_port), make_handler(state, 'gemini')),
+        StubServer((args.host, args.hf_port), make_handler(state, 'hf'))
+    ]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Gemini stub on http://{args.host}:{args.gemini_port}, HF stub on http://{args.host}:{args.hf_port}",
+          file=sys.stderr, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local Gemini and Hugging Face stand-ins for benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--gemini-port', type=int, default=8901)
+    parser.add_argument('--hf-port', type=int, default=8902)
+    add_stub_arguments(parser)
+    serve(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
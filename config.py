@@ -0,0 +1,50 @@
+"""Deployment settings read from the environment
+
+API keys, folders, upstream timeouts and server options live here so that
+a deployment is configured entirely through environment variables. Feature
+tuning knobs (caches, rate limits, image variants, ...) stay next to the
+code they tune in ``app.py`` and the feature modules.
+"""
+import os
+
+# Session signing key. Without one, a random key is generated once and kept
+# in the instance folder, so every worker and restart shares it; set the same
+# SECRET_KEY on all hosts behind a load balancer
+SECRET_KEY = os.environ.get('SECRET_KEY')
+
+# API credentials
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', 'YOUR API KEY')
+HUGGING_FACE_API_KEY = os.environ.get('HUGGING_FACE_API_KEY', 'YOUR API KEY')
+
+# API base URLs; they can be pointed at local stand-ins (see
+# benchmarks/stub_upstreams.py) to run without the real APIs
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com').rstrip('/')
+HF_API_BASE = os.environ.get('HF_API_BASE', 'https://api-inference.huggingface.co').rstrip('/')
+
+# Folders: public upload/image folders under static/, and server-side state
+# (SQLite indexes and stores) outside of it
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'static/uploads')
+GENERATED_IMAGES_FOLDER = os.environ.get('GENERATED_IMAGES_FOLDER', 'static/generated_images')
+INSTANCE_FOLDER = os.environ.get('INSTANCE_FOLDER', 'instance')
+
+# Upstream read timeouts in seconds: chat replies, slash commands and
+# summaries, and image generation
+GEMINI_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT', 60))
+GEMINI_COMMAND_TIMEOUT = float(os.environ.get('GEMINI_COMMAND_TIMEOUT', 30))
+IMAGE_TIMEOUT = float(os.environ.get('IMAGE_TIMEOUT', 120))
+
+# Server: the development server (python app.py, in debug mode unless
+# FLASK_DEBUG=0) and the production
+# launcher (serve.py, WEB_CONCURRENCY pre-forked workers with WEB_THREADS
+# threads each)
+HOST = os.environ.get('HOST', '127.0.0.1')
+PORT = int(os.environ.get('PORT', 5000))
+DEBUG = os.environ.get('FLASK_DEBUG', '1') == '1'
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', (os.cpu_count() or 1) * 2 + 1))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+
+# Warm-up before a worker takes traffic: open the stores and pre-connect
+# WARM_UP_CONNECTIONS pooled connections to each upstream host
+WARM_UP = os.environ.get('WARM_UP', '1') != '0'
+WARM_UP_CONNECTIONS = int(os.environ.get('WARM_UP_CONNECTIONS', 2))
+WARM_UP_TIMEOUT = float(os.environ.get('WARM_UP_TIMEOUT', 2))
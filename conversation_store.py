@@ -0,0 +1,210 @@
+"""Server-side conversation store with bounded context windows
+
+Turns are stored per conversation in SQLite together with an estimated token
+count, so the Gemini ``contents`` for the next message are built by reading
+only the most recent turns that fit in the token budget rather than the whole
+history. Older turns that fall out of the window can optionally be folded
+into a rolling summary, keeping prompt size (and upstream latency) flat as a
+conversation grows.
+
+Conversations belong to the session that created them; reads for another
+owner behave as if the conversation did not exist. Callers without an owner
+(no session) can neither create nor read conversations.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return max(1, len(text) // 4)
+
+
+class ConversationStore:
+    """SQLite-backed conversations and turns"""
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS conversations ('
+            'id TEXT PRIMARY KEY, owner TEXT, name TEXT NOT NULL, '
+            'created REAL NOT NULL, updated REAL NOT NULL, turn_count INTEGER NOT NULL DEFAULT 0, '
+            'summary TEXT, summary_upto INTEGER NOT NULL DEFAULT 0)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS conversations_owner ON conversations (owner, updated)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS turns ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, '
+            'role TEXT NOT NULL, text TEXT NOT NULL, tokens INTEGER NOT NULL, created REAL NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS turns_conversation ON turns (conversation_id, id)')
+        self.db.commit()
+
+    def get(self, conversation_id, owner):
+        """Conversation row as a dict, or None if missing or owned by someone else"""
+        if owner is None:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                'SELECT id, owner, name, created, updated, turn_count, summary, summary_upto '
+                'FROM conversations WHERE id = ?', (conversation_id,)
+            ).fetchone()
+        if row is None or row[1] != owner:
+            return None
+        keys = ('id', 'owner', 'name', 'created', 'updated', 'turn_count', 'summary', 'summary_upto')
+        return dict(zip(keys, row))
+
+    def ensure(self, conversation_id, owner, name='New Conversation'):
+        """Create the conversation if needed; returns False if it belongs to another owner"""
+        if owner is None:
+            return False
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR IGNORE INTO conversations (id, owner, name, created, updated) VALUES (?, ?, ?, ?, ?)',
+                (conversation_id, owner, name, now, now)
+            )
+            self.db.commit()
+            row = self.db.execute('SELECT owner FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
+        return row[0] == owner
+
+    def append_turns(self, conversation_id, turns):
+        """Append ``(role, text)`` turns; the first user turn also names a new conversation"""
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                'INSERT INTO turns (conversation_id, role, text, tokens, created) VALUES (?, ?, ?, ?, ?)',
+                [(conversation_id, role, text, estimate_tokens(text), now) for role, text in turns]
+            )
+            first_user = next((text for role, text in turns if role == 'user'), None)
+            self.db.execute(
+                'UPDATE conversations SET updated = ?, turn_count = turn_count + ?, '
+                'name = CASE WHEN turn_count = 0 AND name = ? AND ? IS NOT NULL THEN ? ELSE name END '
+                'WHERE id = ?',
+                (now, len(turns), 'New Conversation', first_user, (first_user or '')[:50], conversation_id)
+            )
+            self.db.commit()
+
+    def rename(self, conversation_id, owner, name):
+        with self.lock:
+            self.db.execute('UPDATE conversations SET name = ? WHERE id = ? AND owner = ?', (name, conversation_id, owner))
+            self.db.commit()
+
+    def delete(self, conversation_id, owner):
+        with self.lock:
+            deleted = self.db.execute(
+                'DELETE FROM conversations WHERE id = ? AND owner = ?', (conversation_id, owner)
+            ).rowcount
+            if deleted:
+                self.db.execute('DELETE FROM turns WHERE conversation_id = ?', (conversation_id,))
+            self.db.commit()
+        return bool(deleted)
+
+    def delete_all(self, owner):
+        """Delete all of an owner's conversations and return their ids"""
+        with self.lock:
+            ids = [row[0] for row in self.db.execute('SELECT id FROM conversations WHERE owner = ?', (owner,))]
+            self.db.execute(
+                'DELETE FROM turns WHERE conversation_id IN (SELECT id FROM conversations WHERE owner = ?)', (owner,)
+            )
+            self.db.execute('DELETE FROM conversations WHERE owner = ?', (owner,))
+            self.db.commit()
+        return ids
+
+    def context_window(self, conversation_id, budget_tokens):
+        """Most recent turns that fit in ``budget_tokens``, oldest first, plus the rolling summary
+
+        Returns ``(turns, summary, first_turn_id)`` where ``turns`` are
+        ``(id, role, text)`` tuples and ``first_turn_id`` is the id of the
+        oldest turn inside the window (None if the window is empty). Rows are
+        read newest-first in small pages and reading stops at the budget, so
+        the cost does not grow with the length of the conversation.
+        """
+        window = []
+        used = 0
+        last_id = None
+        with self.lock:
+            summary_row = self.db.execute(
+                'SELECT summary, summary_upto FROM conversations WHERE id = ?', (conversation_id,)
+            ).fetchone()
+            summary, summary_upto = summary_row if summary_row else (None, 0)
+
+            while True:
+                query = 'SELECT id, role, text, tokens FROM turns WHERE conversation_id = ? AND id > ?'
+                params = [conversation_id, summary_upto]
+                if last_id is not None:
+                    query += ' AND id < ?'
+                    params.append(last_id)
+                rows = self.db.execute(query + ' ORDER BY id DESC LIMIT 20', params).fetchall()
+                if not rows:
+                    break
+                for turn_id, role, text, tokens in rows:
+                    if used + tokens > budget_tokens:
+                        rows = None
+                        break
+                    window.append((turn_id, role, text))
+                    used += tokens
+                    last_id = turn_id
+                if rows is None:
+                    break
+
+        window.reverse()
+        # Gemini expects the history to start with a user turn
+        while window and window[0][1] != 'user':
+            window.pop(0)
+        return window, summary, (window[0][0] if window else None)
+
+    def turns_before(self, conversation_id, before_id, after_id=0):
+        """Turns with ``after_id < id < before_id``, oldest first (used for summarizing)"""
+        with self.lock:
+            return self.db.execute(
+                'SELECT id, role, text FROM turns WHERE conversation_id = ? AND id > ? AND id < ? ORDER BY id',
+                (conversation_id, after_id, before_id)
+            ).fetchall()
+
+    def summary_state(self, conversation_id):
+        """``(summary, summary_upto)`` for a conversation"""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT summary, summary_upto FROM conversations WHERE id = ?', (conversation_id,)
+            ).fetchone()
+        return row if row else (None, 0)
+
+    def set_summary(self, conversation_id, summary, upto_id):
+        with self.lock:
+            self.db.execute(
+                'UPDATE conversations SET summary = ?, summary_upto = ? WHERE id = ? AND summary_upto < ?',
+                (summary, upto_id, conversation_id, upto_id)
+            )
+            self.db.commit()
+
+    def list_conversations(self, owner, offset=0, limit=20):
+        """Page of an owner's conversations, most recently updated first"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT id, name, created, updated, turn_count FROM conversations '
+                'WHERE owner = ? ORDER BY updated DESC LIMIT ? OFFSET ?',
+                (owner, limit + 1, offset)
+            ).fetchall()
+        conversations = [
+            {'id': r[0], 'name': r[1], 'created': r[2], 'updated': r[3], 'turn_count': r[4]}
+            for r in rows[:limit]
+        ]
+        return conversations, (offset + limit if len(rows) > limit else None)
+
+    def list_turns(self, conversation_id, before_id=None, limit=50):
+        """Page of turns, newest first, optionally starting before a turn id"""
+        query = 'SELECT id, role, text, created FROM turns WHERE conversation_id = ?'
+        params = [conversation_id]
+        if before_id is not None:
+            query += ' AND id < ?'
+            params.append(before_id)
+        with self.lock:
+            rows = self.db.execute(query + ' ORDER BY id DESC LIMIT ?', params + [limit + 1]).fetchall()
+        turns = [{'id': r[0], 'role': r[1], 'text': r[2], 'created': r[3]} for r in rows[:limit]]
+        return turns, (turns[-1]['id'] if len(rows) > limit else None)
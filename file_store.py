@@ -0,0 +1,102 @@
+"""Deduplicated store for uploaded attachments
+
+Uploads are streamed to disk in chunks while being hashed, then renamed to
+their SHA-256 so the same file uploaded twice is kept once. The hash is the
+file ID the client sends with later messages instead of re-posting the
+content as base64; the server resolves IDs back to inline data when it
+builds the Gemini payload.
+"""
+import base64
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+CHUNK_SIZE = 256 * 1024
+FILE_ID_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+class FileTooLarge(Exception):
+    pass
+
+
+class FileStore:
+    """Uploaded files on disk, indexed by content hash in SQLite"""
+
+    def __init__(self, folder, index_path, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(index_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'id TEXT PRIMARY KEY, name TEXT NOT NULL, mime_type TEXT NOT NULL, '
+            'size INTEGER NOT NULL, path TEXT NOT NULL, created REAL NOT NULL)'
+        )
+        self.db.commit()
+
+    def ingest(self, stream, name, mime_type):
+        """Stream an upload to disk while hashing it; returns ``(record, deduplicated)``"""
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(self.folder, f"upload_{uuid.uuid4().hex}.tmp")
+
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise FileTooLarge(f"File is larger than {self.max_bytes // (1024 * 1024)}MB")
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            file_id = digest.hexdigest()
+            existing = self.get(file_id)
+            if existing and os.path.exists(existing['path']):
+                return existing, True
+
+            extension = os.path.splitext(name)[1].lower()
+            path = os.path.join(self.folder, f"{file_id}{extension}")
+            os.replace(temp_path, path)
+            with self.lock:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO files (id, name, mime_type, size, path, created) VALUES (?, ?, ?, ?, ?, ?)',
+                    (file_id, name, mime_type, size, path, time.time())
+                )
+                self.db.commit()
+            return self.get(file_id), False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get(self, file_id):
+        """File record as a dict, or None for unknown or malformed IDs"""
+        if not file_id or not FILE_ID_PATTERN.match(file_id):
+            return None
+        with self.lock:
+            row = self.db.execute(
+                'SELECT id, name, mime_type, size, path FROM files WHERE id = ?', (file_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('id', 'name', 'mime_type', 'size', 'path'), row))
+
+    def read_bytes(self, file_id):
+        record = self.get(file_id)
+        if record is None:
+            return None
+        with open(record['path'], 'rb') as f:
+            return f.read()
+
+    def read_base64(self, file_id):
+        content = self.read_bytes(file_id)
+        return base64.b64encode(content).decode('utf-8') if content is not None else None
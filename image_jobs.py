@@ -0,0 +1,296 @@
+"""Persistent job queue for image generation
+
+Submitting a prompt returns a job ID straight away. A bounded pool of
+``IMAGE_JOB_WORKERS`` threads runs the model fallback chain, so slow
+generations no longer hold a web request open and image concurrency is
+capped separately from chat.
+
+Jobs are stored in SQLite. Jobs that were still queued or running when the
+process stopped are queued again on the next start. Finished jobs are kept
+for ``IMAGE_JOB_TTL`` seconds, so clients can still fetch the result after
+reconnecting. Several worker processes may share the database: a job is
+claimed atomically before it runs, and a running job is only requeued once
+the process running it has exited.
+
+While a job runs, its progress events (which model is being tried, which
+model is loading) are kept in memory. Clients read them by polling
+:meth:`JobQueue.get` or by subscribing to new events. Another worker process
+sees only the job's stored state, which it polls. Jobs belong to the
+session that submitted them; lookups by another owner behave as if the job
+did not exist.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS = int(os.environ.get('IMAGE_JOB_WORKERS', 2))
+MAX_QUEUED = int(os.environ.get('IMAGE_JOB_MAX_QUEUED', 100))
+JOB_TTL = float(os.environ.get('IMAGE_JOB_TTL', 24 * 3600))
+# Events of finished jobs stay in memory this long for late subscribers
+EVENTS_TTL = 300
+# How often the stored state of a job run by another process is checked
+REMOTE_POLL_INTERVAL = 1.0
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+COLUMNS = ('id', 'owner', 'prompt', 'status', 'progress', 'result', 'error', 'retry_after', 'created', 'updated')
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+
+def process_alive(pid):
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobFailed(Exception):
+    """Raised by a job's run function with the message to show the user"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """Image jobs in SQLite, run on a bounded thread pool
+
+    ``run(prompt, progress)`` does the work: it calls ``progress(event)``
+    with dicts describing each step and returns the result dict, or raises
+    :class:`JobFailed`.
+    """
+
+    def __init__(self, db_path, run, workers=WORKERS, max_queued=MAX_QUEUED, ttl=JOB_TTL):
+        self.run = run
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.events = {}  # job ID -> list of progress events
+        self.finished_at = {}  # job ID -> time its events were completed
+        self.subscribers = {}  # job ID -> set of callbacks
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-job')
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, owner TEXT, prompt TEXT NOT NULL, status TEXT NOT NULL, '
+            'progress TEXT, result TEXT, error TEXT, retry_after REAL, '
+            'created REAL NOT NULL, updated REAL NOT NULL, pid INTEGER)'
+        )
+        if 'pid' not in [row[1] for row in self.db.execute('PRAGMA table_info(jobs)')]:
+            self.db.execute('ALTER TABLE jobs ADD COLUMN pid INTEGER')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)')
+        self.db.commit()
+        self.resume()
+
+    def resume(self):
+        """Queue again the jobs a previous process left unfinished"""
+        with self.lock:
+            running = self.db.execute('SELECT id, pid FROM jobs WHERE status = ?', (RUNNING,)).fetchall()
+            orphaned = [(job_id,) for job_id, pid in running if not process_alive(pid)]
+            self.db.executemany('UPDATE jobs SET status = ?, pid = NULL WHERE id = ?', [(QUEUED,) + o for o in orphaned])
+            self.db.commit()
+            job_ids = [row[0] for row in self.db.execute(
+                'SELECT id FROM jobs WHERE status = ? ORDER BY created', (QUEUED,)
+            )]
+        for job_id in job_ids:
+            self.publish(job_id, {'type': QUEUED, 'resumed': True})
+            self.pool.submit(self.execute, job_id)
+        if job_ids:
+            logger.info("Resumed %d queued image jobs", len(job_ids))
+
+    def submit(self, owner, prompt):
+        """Queue a job and return it; raises :class:`QueueFull` when too many are waiting"""
+        self.purge()
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            active = self.db.execute(
+                'SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+            ).fetchone()[0]
+            if active >= self.max_queued:
+                raise QueueFull(f"{active} image jobs are already waiting")
+            self.db.execute(
+                'INSERT INTO jobs (id, owner, prompt, status, created, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, owner, prompt, QUEUED, now, now)
+            )
+            self.db.commit()
+        self.publish(job_id, {'type': QUEUED})
+        self.pool.submit(self.execute, job_id)
+        return self.get(job_id, owner)
+
+    def execute(self, job_id):
+        # Claim the job, unless another worker process got to it first
+        with self.lock:
+            claimed = self.db.execute(
+                'UPDATE jobs SET status = ?, pid = ?, updated = ? WHERE id = ? AND status = ?',
+                (RUNNING, os.getpid(), time.time(), job_id, QUEUED)
+            ).rowcount
+            self.db.commit()
+            row = self.db.execute('SELECT prompt FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not claimed or row is None:
+            return
+        prompt = row[0]
+        self.publish(job_id, {'type': RUNNING})
+
+        def progress(event):
+            self.update(job_id, progress=json.dumps(event))
+            self.publish(job_id, event)
+
+        try:
+            result = self.run(prompt, progress)
+        except JobFailed as e:
+            self.finish(job_id, FAILED, error=str(e), retry_after=e.retry_after)
+        except Exception as e:
+            logger.exception("Image job %s failed: %s", job_id, e)
+            self.finish(job_id, FAILED, error=f"Image generation error: {str(e)}")
+        else:
+            self.finish(job_id, SUCCEEDED, result=json.dumps(result))
+
+    def update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self.db.commit()
+
+    def finish(self, job_id, status, **fields):
+        self.update(job_id, status=status, **fields)
+        job = self.load(job_id)
+        job.pop('owner')
+        self.publish(job_id, {'type': status, 'job': job}, final=True)
+
+    def publish(self, job_id, event, final=False):
+        with self.lock:
+            events = self.events.setdefault(job_id, [])
+            events.append(event)
+            if final:
+                self.finished_at[job_id] = time.time()
+            callbacks = list(self.subscribers.get(job_id, ()))
+        for callback in callbacks:
+            callback()
+
+    def load(self, job_id):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(COLUMNS, row))
+            position = None
+            if job['status'] == QUEUED:
+                position = self.db.execute(
+                    'SELECT COUNT(*) FROM jobs WHERE status = ? AND created < ?', (QUEUED, job['created'])
+                ).fetchone()[0]
+        return {
+            'job_id': job['id'],
+            'owner': job['owner'],
+            'status': job['status'],
+            'prompt': job['prompt'],
+            'position': position,
+            'progress': json.loads(job['progress']) if job['progress'] else None,
+            'result': json.loads(job['result']) if job['result'] else None,
+            'error': job['error'],
+            'retry_after': job['retry_after'],
+            'created': job['created'],
+            'updated': job['updated']
+        }
+
+    def is_local(self, job_id):
+        """Whether this process has the job's progress events (it ran or queued it)"""
+        with self.lock:
+            return job_id in self.events
+
+    def get(self, job_id, owner):
+        """Job as a dict, or None if missing or owned by someone else"""
+        job = self.load(job_id)
+        if job is None or job.pop('owner') != owner:
+            return None
+        return job
+
+    def events_after(self, job_id, index):
+        """``(events, finished)``: progress events from position ``index`` on"""
+        with self.lock:
+            events = self.events.get(job_id)
+            if events is not None:
+                return events[index:], job_id in self.finished_at
+        # Events are no longer in memory (finished long ago, or from before a restart)
+        job = self.load(job_id)
+        if job is None:
+            return [], True
+        if job['status'] in FINISHED:
+            job.pop('owner')
+            return ([{'type': job['status'], 'job': job}] if index == 0 else []), True
+        return [], False
+
+    def subscribe(self, job_id, callback):
+        """Call ``callback()`` (from a worker thread) whenever the job has a new event"""
+        with self.lock:
+            self.subscribers.setdefault(job_id, set()).add(callback)
+
+    def unsubscribe(self, job_id, callback):
+        with self.lock:
+            callbacks = self.subscribers.get(job_id)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self.subscribers[job_id]
+
+    def wait_events(self, job_id, index, timeout):
+        """Blocking :meth:`events_after` that waits up to ``timeout`` seconds for something new"""
+        if not self.is_local(job_id):
+            deadline = time.monotonic() + timeout
+            while True:
+                events, finished = self.events_after(job_id, index)
+                remaining = deadline - time.monotonic()
+                if events or finished or remaining <= 0:
+                    return events, finished
+                time.sleep(min(REMOTE_POLL_INTERVAL, remaining))
+
+        ready = threading.Event()
+        self.subscribe(job_id, ready.set)
+        try:
+            events, finished = self.events_after(job_id, index)
+            if not events and not finished:
+                ready.wait(timeout)
+                events, finished = self.events_after(job_id, index)
+            return events, finished
+        finally:
+            self.unsubscribe(job_id, ready.set)
+
+    def purge(self):
+        """Drop finished jobs older than the TTL and stale in-memory events"""
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND updated < ?', (*FINISHED, now - self.ttl)
+            )
+            self.db.commit()
+            for job_id, finished in list(self.finished_at.items()):
+                if finished < now - EVENTS_TTL:
+                    del self.finished_at[job_id]
+                    self.events.pop(job_id, None)
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, SUCCEEDED, FAILED)}
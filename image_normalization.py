@@ -0,0 +1,189 @@
+"""Normalization of image attachments before they are sent to Gemini
+
+Users attach whatever their device produces: 12MP phone photos, screenshots
+at display resolution, and animated GIFs. Gemini downsamples large images
+anyway, so sending them at full size only adds request bytes and latency.
+Each image is decoded once, rotated upright from its EXIF orientation, and
+reduced to its first frame. It is then scaled so its longer side is at most
+``INLINE_IMAGE_MAX_SIDE`` pixels and re-encoded as JPEG. Images with
+transparency are re-encoded as WebP instead, or as PNG where WebP is not
+available.
+
+Results are cached on disk by the image's SHA-256 (its upload file ID) and
+the normalization settings. An image that is already small enough, in a
+format Gemini accepts, and that would not shrink by re-encoding is sent as
+it is. The cache records that as an empty ``.orig`` marker.
+
+Needs the optional ``Pillow`` package; without it images are sent as they
+were uploaded.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import uuid
+
+MAX_SIDE = int(os.environ.get('INLINE_IMAGE_MAX_SIDE', 1536))
+JPEG_QUALITY = int(os.environ.get('INLINE_IMAGE_QUALITY', 85))
+# Small images in an accepted format are not worth decoding
+SMALL_IMAGE_BYTES = 256 * 1024
+
+# Types Gemini takes as inline data without conversion
+PASSTHROUGH_TYPES = frozenset({'image/png', 'image/jpeg', 'image/webp'})
+EXTENSIONS = {'jpg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+ORIGINAL = 'orig'
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def load_pillow():
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise UnsupportedImage('Image normalization requires the Pillow package')
+    return Image, ImageOps
+
+
+def encode_image(source, mime_type, size, max_side, quality):
+    """``(extension, content)`` of the normalized image, or ``(ORIGINAL, None)`` to send it unchanged
+
+    ``source`` is a path or a binary file object holding ``size`` bytes.
+    """
+    Image, ImageOps = load_pillow()
+    with Image.open(source) as image:
+        animated = getattr(image, 'is_animated', False)
+        resize = max(image.size) > max_side
+        if not animated and not resize and mime_type in PASSTHROUGH_TYPES and size <= SMALL_IMAGE_BYTES:
+            return ORIGINAL, None
+        image.seek(0)
+        # JPEGs can be decoded straight at a fraction of their size
+        image.draft('RGB', (max_side, max_side))
+        image.load()
+
+        frame = ImageOps.exif_transpose(image)
+        transparent = frame.mode in ('RGBA', 'LA', 'PA') or 'transparency' in frame.info
+        frame = frame.convert('RGBA' if transparent else 'RGB')
+        if resize:
+            frame.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        if not transparent:
+            extension = 'jpg'
+            frame.save(buffer, 'JPEG', quality=quality, optimize=True)
+        elif webp_supported():
+            extension = 'webp'
+            frame.save(buffer, 'WEBP', quality=quality)
+        else:
+            extension = 'png'
+            frame.save(buffer, 'PNG', optimize=True)
+
+    content = buffer.getvalue()
+    if not animated and not resize and mime_type in PASSTHROUGH_TYPES and len(content) >= size:
+        return ORIGINAL, None
+    return extension, content
+
+
+def webp_supported():
+    from PIL import features
+    return features.check('webp')
+
+
+class ImageNormalizer:
+    """Normalizes attached images into a cache directory keyed by content hash"""
+
+    def __init__(self, cache_folder, max_side=MAX_SIDE, quality=JPEG_QUALITY):
+        self.cache_folder = cache_folder
+        self.max_side = max_side
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.in_progress = {}
+        self.counters = {'normalized': 0, 'unchanged': 0, 'hits': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0}
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def cache_stem(self, digest):
+        return os.path.join(self.cache_folder, f"{digest}-{self.max_side}-q{self.quality}")
+
+    def cached(self, digest):
+        """``(mime_type, content)`` from the cache, ``(None, None)`` for "send unchanged", or None on a miss"""
+        stem = self.cache_stem(digest)
+        if os.path.exists(f"{stem}.{ORIGINAL}"):
+            return None, None
+        for extension, mime_type in EXTENSIONS.items():
+            try:
+                with open(f"{stem}.{extension}", 'rb') as f:
+                    return mime_type, f.read()
+            except FileNotFoundError:
+                continue
+        return None
+
+    def count(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def normalize(self, digest, source, mime_type, size):
+        """``(mime_type, content)`` of the normalized image, or ``(None, None)`` to send the original
+
+        ``source`` is a path or a binary file object. Concurrent calls for the
+        same image wait for a single encoding. Errors (no Pillow, undecodable
+        images) also mean "send the original" and are not cached.
+        """
+        result = self.cached(digest)
+        if result is not None:
+            self.count(hits=1)
+            return result
+
+        with self.lock:
+            image_lock = self.in_progress.setdefault(digest, threading.Lock())
+        try:
+            with image_lock:
+                result = self.cached(digest)
+                if result is None:
+                    result = self.encode(digest, source, mime_type, size)
+                else:
+                    self.count(hits=1)
+        finally:
+            with self.lock:
+                self.in_progress.pop(digest, None)
+        return result
+
+    def encode(self, digest, source, mime_type, size):
+        try:
+            extension, content = encode_image(source, mime_type, size, self.max_side, self.quality)
+        except UnsupportedImage:
+            return None, None
+        except Exception as e:
+            self.count(failed=1)
+            logger.warning("Could not normalize image %s: %s", digest[:12], e)
+            return None, None
+
+        stem = self.cache_stem(digest)
+        temp_path = f"{stem}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(content or b'')
+            os.replace(temp_path, f"{stem}.{extension}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        if extension == ORIGINAL:
+            self.count(unchanged=1)
+            return None, None
+        self.count(normalized=1, bytes_in=size, bytes_out=len(content))
+        logger.debug("Normalized image %s: %d -> %d bytes", digest[:12], size, len(content))
+        return EXTENSIONS[extension], content
+
+    def normalize_bytes(self, content, mime_type):
+        """:meth:`normalize` for image content that did not come from the file store"""
+        digest = hashlib.sha256(content).hexdigest()
+        return self.normalize(digest, io.BytesIO(content), mime_type, len(content))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, max_side=self.max_side, quality=self.quality)
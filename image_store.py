@@ -0,0 +1,236 @@
+"""Content-addressed, size-bounded store for generated images
+
+Images are written once under ``<sha256>.<ext>`` and tracked in an SQLite
+index kept outside the public image folder, together with the generation
+requests (model, enhanced prompt and parameters) that produced them. A repeated request is answered
+from the index without regenerating or scanning the directory. When the
+store grows past its quota the least recently used images are evicted.
+Resized / transcoded variants (see ``image_variants``) are indexed against
+their original: they count towards the quota and are evicted with it.
+
+Writes go through a temp file, fsync and rename before the index row is
+committed, so a crash can leave at most an orphaned temp file, which is
+cleaned up on the next start.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def image_extension(content):
+    """Guess the file extension of image bytes from their magic number"""
+    if content.startswith(b'\xff\xd8'):
+        return 'jpg'
+    if content.startswith(b'RIFF') and content[8:12] == b'WEBP':
+        return 'webp'
+    if content.startswith(b'GIF8'):
+        return 'gif'
+    return 'png'
+
+
+def write_file_atomic(path, content):
+    """Write bytes to ``path`` via a temp file and rename, so readers never see a partial file"""
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def request_key(model_name, enhanced_prompt, params):
+    """Stable key for an image generation request"""
+    raw = json.dumps([model_name, enhanced_prompt, params], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ImageStore:
+    """Image files on disk plus an SQLite index of blobs and the requests that made them"""
+
+    def __init__(self, folder, index_path, quota_bytes):
+        self.folder = folder
+        self.quota_bytes = quota_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(folder, exist_ok=True)
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(index_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS blobs '
+            '(filename TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS requests '
+            '(key TEXT PRIMARY KEY, filename TEXT NOT NULL, model TEXT NOT NULL, created REAL NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS requests_filename ON requests (filename)')
+        # ``file`` is the variant's own file, or the original when the variant would not be smaller
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS variants '
+            '(name TEXT PRIMARY KEY, source TEXT NOT NULL, file TEXT NOT NULL, size INTEGER NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS variants_source ON variants (source)')
+        self.db.commit()
+        self.recover()
+
+    def recover(self):
+        """Drop temp files from interrupted writes and index rows whose file is gone"""
+        for name in os.listdir(self.folder):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self.folder, name))
+
+        with self.lock:
+            rows = self.db.execute('SELECT filename FROM blobs').fetchall()
+            missing = [(name,) for (name,) in rows if not os.path.exists(os.path.join(self.folder, name))]
+            if missing:
+                self.db.executemany('DELETE FROM requests WHERE filename = ?', missing)
+                self.db.executemany('DELETE FROM blobs WHERE filename = ?', missing)
+                self.db.executemany('DELETE FROM variants WHERE source = ?', missing)
+            rows = self.db.execute('SELECT name, file FROM variants').fetchall()
+            missing_variants = [(name,) for name, file in rows if not os.path.exists(os.path.join(self.folder, file))]
+            self.db.executemany('DELETE FROM variants WHERE name = ?', missing_variants)
+            self.db.commit()
+
+    def lookup(self, key):
+        """Return the file name stored for a request key, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT filename FROM requests WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute('UPDATE blobs SET accessed = ? WHERE filename = ?', (time.time(), row[0]))
+            self.db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, content, key=None, model_name=''):
+        """Store image bytes (deduplicated by content) and return the file name"""
+        filename = f"{hashlib.sha256(content).hexdigest()}.{image_extension(content)}"
+        path = os.path.join(self.folder, filename)
+        now = time.time()
+
+        with self.lock:
+            known = self.db.execute('SELECT 1 FROM blobs WHERE filename = ?', (filename,)).fetchone()
+            if not known or not os.path.exists(path):
+                write_file_atomic(path, content)
+            self.db.execute(
+                'INSERT INTO blobs (filename, size, created, accessed) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(filename) DO UPDATE SET accessed = excluded.accessed',
+                (filename, len(content), now, now)
+            )
+            if key:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO requests (key, filename, model, created) VALUES (?, ?, ?, ?)',
+                    (key, filename, model_name, now)
+                )
+            self.db.commit()
+            self.evict(keep=filename)
+        return filename
+
+    def has_variants(self, source):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM variants WHERE source = ? LIMIT 1', (source,)).fetchone() is not None
+
+    def add_variants(self, source, variants):
+        """Index rendered ``(name, file, size)`` variants of ``source``
+
+        If the original was evicted while they were being rendered, the
+        variant files are deleted instead.
+        """
+        with self.lock:
+            if self.db.execute('SELECT 1 FROM blobs WHERE filename = ?', (source,)).fetchone() is None:
+                for name, file, size in variants:
+                    if file != source:
+                        self.remove_file(file)
+                return
+            self.db.executemany(
+                'INSERT OR REPLACE INTO variants (name, source, file, size) VALUES (?, ?, ?, ?)',
+                [(name, source, file, size) for name, file, size in variants]
+            )
+            self.db.commit()
+            self.evict(keep=source)
+
+    def variant_file(self, name):
+        """The file to serve for variant ``name``, or None if it has not been rendered"""
+        with self.lock:
+            row = self.db.execute('SELECT source, file FROM variants WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE blobs SET accessed = ? WHERE filename = ?', (time.time(), row[0]))
+            self.db.commit()
+            return row[1]
+
+    def original_for(self, stem):
+        """File name of the original whose content hash is ``stem``, or None"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT filename FROM blobs WHERE filename LIKE ? || '.%'", (stem,)
+            ).fetchone()
+            return row[0] if row else None
+
+    def remove_file(self, filename):
+        try:
+            os.remove(os.path.join(self.folder, filename))
+        except FileNotFoundError:
+            pass
+
+    def total_size(self):
+        return self.db.execute(
+            'SELECT (SELECT COALESCE(SUM(size), 0) FROM blobs) + (SELECT COALESCE(SUM(size), 0) FROM variants)'
+        ).fetchone()[0]
+
+    def evict(self, keep=None):
+        """Delete least recently used images until the store fits its quota (lock held)"""
+        total = self.total_size()
+        if total <= self.quota_bytes:
+            return
+
+        rows = self.db.execute('SELECT filename, size FROM blobs ORDER BY accessed ASC').fetchall()
+        for filename, size in rows:
+            if total <= self.quota_bytes:
+                break
+            if filename == keep:
+                continue
+            self.remove_file(filename)
+            for variant, file, variant_size in self.db.execute(
+                'SELECT name, file, size FROM variants WHERE source = ?', (filename,)
+            ).fetchall():
+                if file != filename:
+                    self.remove_file(file)
+                total -= variant_size
+            self.db.execute('DELETE FROM variants WHERE source = ?', (filename,))
+            self.db.execute('DELETE FROM requests WHERE filename = ?', (filename,))
+            self.db.execute('DELETE FROM blobs WHERE filename = ?', (filename,))
+            total -= size
+            self.evictions += 1
+        self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            images, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+            variants, variant_size = self.db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM variants'
+            ).fetchone()
+            return {
+                'images': images,
+                'bytes': size,
+                'variants': variants,
+                'variant_bytes': variant_size,
+                'quota_bytes': self.quota_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
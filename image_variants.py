@@ -0,0 +1,199 @@
+"""Background transcoding of generated images into WebP/AVIF variants
+
+Hugging Face models return full-size PNGs (1024x1024 for FLUX/SDXL) while the
+chat shows them at bubble size. After an image is stored, a process pool
+renders it at each of ``IMAGE_VARIANT_WIDTHS`` (plus a full-size transcode)
+in every modern format Pillow can write: WebP, and AVIF where supported.
+
+Variant names are derived from the original's content hash, width and
+format (``<sha256>-512.webp``, ``<sha256>-full.avif``), so their URLs are
+known as soon as the original is saved and never change content once the
+variant exists. A variant that would not be smaller than the original is not
+written; its name is recorded as an alias of the original instead.
+
+Needs the optional ``Pillow`` package; without it no variants are made and
+only the original is served.
+"""
+import io
+import logging
+import os
+import threading
+
+from image_store import write_file_atomic
+
+VARIANT_WIDTHS = tuple(int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '256,512').split(',') if w.strip())
+QUALITY = {
+    'webp': int(os.environ.get('IMAGE_WEBP_QUALITY', 80)),
+    'avif': int(os.environ.get('IMAGE_AVIF_QUALITY', 55))
+}
+WORKERS = int(os.environ.get('IMAGE_VARIANT_WORKERS', min(2, os.cpu_count() or 1)))
+FULL = 'full'
+
+# Preferred first: browsers take the first <source> type they support
+FORMATS = ('avif', 'webp')
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+
+_formats = None
+
+logger = logging.getLogger(__name__)
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def load_pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise UnsupportedImage('Image variants require the Pillow package')
+    return Image
+
+
+def available_formats():
+    """Variant formats this installation can encode (empty without Pillow)"""
+    global _formats
+    if _formats is None:
+        try:
+            load_pillow()
+            from PIL import features
+            _formats = tuple(fmt for fmt in FORMATS if features.check(fmt))
+        except (UnsupportedImage, ImportError):
+            _formats = ()
+    return _formats
+
+
+def variant_name(source, width, fmt):
+    """File name of the ``width`` (or ``FULL``) variant of ``source`` in ``fmt``"""
+    return f"{source.split('.')[0]}-{width}.{fmt}"
+
+
+def render_variants(folder, source, widths, formats):
+    """Write the variants of ``source``; runs in a worker process
+
+    Returns ``(name, file, size)`` tuples, where ``file`` is the variant's
+    own file or, when encoding did not make it smaller, ``source`` itself
+    (with size 0, as no extra bytes are stored).
+    """
+    Image = load_pillow()
+    source_path = os.path.join(folder, source)
+    source_size = os.path.getsize(source_path)
+    with Image.open(source_path) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        original_width, original_height = image.size
+
+        results = []
+        for width in (FULL,) + tuple(widths):
+            if width == FULL or width >= original_width:
+                resized = image
+            else:
+                height = max(1, round(original_height * width / original_width))
+                resized = image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                name = variant_name(source, width, fmt)
+                buffer = io.BytesIO()
+                resized.save(buffer, fmt.upper(), quality=QUALITY[fmt])
+                content = buffer.getvalue()
+                if len(content) >= source_size:
+                    results.append((name, source, 0))
+                    continue
+                write_file_atomic(os.path.join(folder, name), content)
+                results.append((name, name, len(content)))
+    return results
+
+
+def make_pool(workers):
+    """Executor for rendering: spawned processes, or threads where children are not allowed
+
+    Worker processes are spawned rather than forked, since forking a
+    multithreaded web worker can deadlock the child. Daemonic processes
+    (hypercorn workers, for one) may not have children at all, so they
+    render on threads instead.
+    """
+    # Imported here: multiprocessing is only needed once work arrives,
+    # and keeping it out of the import speeds up worker start
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    if multiprocessing.current_process().daemon:
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class VariantRenderer:
+    """Schedules variant rendering for stored images in a process pool"""
+
+    def __init__(self, store, widths=VARIANT_WIDTHS, workers=WORKERS):
+        self.store = store
+        self.widths = widths
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.rendered = 0
+        self.failed = 0
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = make_pool(self.workers)
+            return self.pool
+
+    def enabled(self):
+        return bool(available_formats())
+
+    def schedule(self, source):
+        """Render ``source``'s variants in the background unless they exist or are in progress
+
+        Best effort: returns False if the render could not be started, in
+        which case only the original should be linked.
+        """
+        if not self.enabled():
+            return False
+        if self.store.has_variants(source):
+            return True
+        with self.lock:
+            if source in self.pending:
+                return True
+            self.pending.add(source)
+        try:
+            future = self.get_pool().submit(render_variants, self.store.folder, source, self.widths, available_formats())
+        except Exception as e:
+            with self.lock:
+                self.pending.discard(source)
+                self.failed += 1
+            logger.warning("Could not schedule variants of %s: %s", source, e)
+            return False
+        future.add_done_callback(lambda f: self.finished(source, f))
+        return True
+
+    def finished(self, source, future):
+        with self.lock:
+            self.pending.discard(source)
+        try:
+            self.store.add_variants(source, future.result())
+            self.rendered += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning("Could not render variants of %s: %s", source, e)
+
+    def sources(self, source, url_for):
+        """``<picture>`` sources for ``source``: ``[{'type', 'srcset'}]``, best format first"""
+        return [
+            {
+                'type': MIME_TYPES[fmt],
+                'srcset': ', '.join(f"{url_for(variant_name(source, width, fmt))} {width}w" for width in self.widths)
+            }
+            for fmt in available_formats()
+        ]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'formats': list(available_formats()),
+                'widths': list(self.widths),
+                'pending': len(self.pending),
+                'rendered': self.rendered,
+                'failed': self.failed
+            }
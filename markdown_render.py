@@ -0,0 +1,221 @@
+"""Single-pass, incremental markdown renderer for chat replies
+
+Handles the subset of markdown Gemini replies use: fenced code blocks,
+headings, bullet and numbered lists, paragraphs, and inline code, bold,
+italics and links. All text is HTML-escaped, so model output cannot inject
+markup.
+
+Input is consumed line by line as it arrives: ``feed`` returns the HTML of
+the blocks that the new text completed and keeps only the open block in
+memory, so a streamed reply is rendered in time linear in its length rather
+than re-rendering the growing prefix on every chunk. Offsets into the input
+are counted in UTF-16 code units, like JavaScript string indices, so the
+browser can slice its copy of the reply with them.
+"""
+import re
+from html import escape
+
+FENCE_PATTERN = re.compile(r'^\s*(`{3,}|~{3,})\s*([\w+#.-]*)')
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+BULLET_PATTERN = re.compile(r'^\s*[-*+•]\s+(.*)$')
+NUMBERED_PATTERN = re.compile(r'^\s*(\d{1,9})[.)]\s+(.*)$')
+INLINE_PATTERN = re.compile(
+    r'(?P<code_ticks>`+)(?P<code>.+?)(?P=code_ticks)'
+    # Link targets may contain balanced parentheses, e.g. wiki/Python_(language)
+    r'|\[(?P<link_text>[^\]\n]+)\]\((?P<link_url>(?:[^()\s]|\([^()\s]*\))+)\)'
+    r'|\*\*(?P<strong>.+?)\*\*'
+    r'|__(?P<strong_u>.+?)__'
+    r'|\*(?=\S)(?P<em>.+?)(?<=\S)\*'
+    r'|(?<!\w)_(?=\S)(?P<em_u>.+?)(?<=\S)_(?!\w)'
+)
+# Text without any of these has no inline markup and is only escaped
+INLINE_MARKER_PATTERN = re.compile(r'[`*_\[]')
+SAFE_URL_PATTERN = re.compile(r'^(https?://|mailto:|/|#)', re.IGNORECASE)
+
+
+def utf16_length(text):
+    """Length of ``text`` in UTF-16 code units (what JavaScript's ``length`` counts)"""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+
+def render_inline(text):
+    """Render inline markdown in one left-to-right scan, escaping everything else
+
+    No inline span crosses a newline, so the lines of a block can be rendered
+    in one call and split afterwards.
+    """
+    return render_escaped_inline(escape(text, quote=False))
+
+
+def render_escaped_inline(text):
+    """:func:`render_inline` of text that is already HTML-escaped
+
+    Escaping first costs one pass over the text instead of one per span.
+    Entities start with ``&`` and end with ``;``, neither a marker nor a word
+    character, so they match no differently from the characters they replace.
+    """
+    if not INLINE_MARKER_PATTERN.search(text):
+        return text
+    out = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        out.append(text[position:match.start()])
+        position = match.end()
+        # The last group of each alternative names the kind of span
+        kind = match.lastgroup
+        if kind == 'code':
+            out.append(f"<code>{match.group('code').strip()}</code>")
+        elif kind == 'link_url':
+            url = match.group('link_url')
+            label = render_escaped_inline(match.group('link_text'))
+            if SAFE_URL_PATTERN.match(url):
+                url = url.replace('"', '&quot;').replace("'", '&#x27;')
+                out.append(f'<a href="{url}" target="_blank" rel="noopener noreferrer">{label}</a>')
+            else:
+                out.append(label)
+        elif kind in ('strong', 'strong_u'):
+            out.append(f"<strong>{render_escaped_inline(match.group(kind))}</strong>")
+        else:
+            out.append(f"<em>{render_escaped_inline(match.group(kind))}</em>")
+    out.append(text[position:])
+    return ''.join(out)
+
+
+class MarkdownRenderer:
+    """Incremental renderer; call ``feed`` with each chunk and ``finish`` at the end"""
+
+    def __init__(self):
+        self.partial = []  # chunks of the unfinished last line
+        self.block = None
+        self.lines = []
+        self.fence = None
+        self.language = ''
+        self.list_start = None
+        self.offset = 0
+        self.block_start = 0
+        self.parts = []
+
+    @property
+    def html(self):
+        """All HTML rendered so far"""
+        return ''.join(self.parts)
+
+    @property
+    def pending_from(self):
+        """Offset in the input (in UTF-16 code units) where the text not yet rendered to HTML begins"""
+        return self.block_start if self.block else self.offset
+
+    def feed(self, chunk):
+        """Consume a chunk of markdown and return the HTML of the blocks it completed"""
+        if '\n' not in chunk:
+            # Joined once the line ends, so a long line is not copied on every chunk
+            self.partial.append(chunk)
+            return ''
+        lines = chunk.split('\n')
+        self.partial.append(lines[0])
+        lines[0] = ''.join(self.partial)
+        self.partial = [lines.pop()]
+        emitted = len(self.parts)
+        # Replies are mostly ASCII, where code points and UTF-16 units agree
+        measure = len if lines[0].isascii() and chunk.isascii() else utf16_length
+        for line in lines:
+            self.process_line(line)
+            self.offset += measure(line) + 1
+        return ''.join(self.parts[emitted:])
+
+    def finish(self):
+        """Flush the last line and any open block; returns their HTML"""
+        emitted = len(self.parts)
+        partial = ''.join(self.partial)
+        self.partial = []
+        if partial:
+            self.process_line(partial)
+            self.offset += utf16_length(partial)
+        self.close_block()
+        return ''.join(self.parts[emitted:])
+
+    def open_block(self, kind):
+        self.close_block()
+        self.block = kind
+        self.block_start = self.offset
+
+    def process_line(self, line):
+        if self.block == 'code':
+            stripped = line.strip()
+            if stripped.startswith(self.fence) and not stripped.strip(self.fence[0]):
+                self.close_block()
+            else:
+                self.lines.append(line)
+            return
+
+        # The first character rules out most block patterns, so only the
+        # one that can match is tried
+        first = line.lstrip()[:1]
+        if not first:
+            self.close_block()
+            return
+
+        fence = FENCE_PATTERN.match(line) if first in '`~' else None
+        if fence:
+            self.open_block('code')
+            self.fence = fence.group(1)
+            self.language = fence.group(2)
+            return
+
+        heading = HEADING_PATTERN.match(line) if first == '#' else None
+        if heading:
+            self.close_block()
+            level = len(heading.group(1))
+            self.parts.append(f"<h{level}>{render_inline(heading.group(2))}</h{level}>")
+            return
+
+        bullet = BULLET_PATTERN.match(line) if first in '-*+•' else None
+        if bullet:
+            if self.block != 'ul':
+                self.open_block('ul')
+            self.lines.append(bullet.group(1))
+            return
+
+        numbered = NUMBERED_PATTERN.match(line) if first.isdigit() else None
+        if numbered:
+            if self.block != 'ol':
+                self.open_block('ol')
+                self.list_start = int(numbered.group(1))
+            self.lines.append(numbered.group(2))
+            return
+
+        if self.block in ('ul', 'ol') and line[:1].isspace():
+            # Indented continuation of the previous list item
+            self.lines[-1] += ' ' + line.strip()
+            return
+
+        if self.block != 'p':
+            self.open_block('p')
+        self.lines.append(line.strip())
+
+    def close_block(self):
+        block, lines = self.block, self.lines
+        self.block = None
+        self.lines = []
+        if block is None:
+            return
+
+        if block == 'code':
+            language = f' class="language-{escape(self.language)}"' if self.language else ''
+            self.parts.append(f"<pre><code{language}>{escape(chr(10).join(lines), quote=False)}</code></pre>")
+        elif block == 'p':
+            self.parts.append(f"<p>{render_inline(chr(10).join(lines)).replace(chr(10), '<br>')}</p>")
+        else:
+            start = f' start="{self.list_start}"' if block == 'ol' and self.list_start != 1 else ''
+            items = '</li><li>'.join(render_inline(chr(10).join(lines)).split(chr(10)))
+            self.parts.append(f"<{block}{start}><li>{items}</li></{block}>")
+
+
+def render_markdown(text):
+    """Render a complete markdown text to HTML"""
+    renderer = MarkdownRenderer()
+    renderer.feed(text)
+    renderer.finish()
+    return renderer.html
@@ -0,0 +1,231 @@
+"""In-process metrics exposed in the Prometheus text format at ``/metrics``
+
+A deliberately small implementation (counters, gauges and histograms with
+fixed label names) so instrumentation costs a dict lookup, a bisect and a
+short critical section per observation, with no extra dependency. Each
+process keeps its own values; scrape every worker, or run a single process,
+when serving with several workers.
+
+Metrics recorded by the app:
+
+* ``chatbot_http_*``: per route request counts by status, latency, request
+  and response body sizes, and requests in flight,
+* ``chatbot_upstream_*``: latency and outcome of every real upstream call per
+  service and target (the Gemini operation such as ``chat`` or ``define``, or
+  the image model name), response sizes, and calls in flight.
+"""
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+import admission
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def track(self, labels=()):
+        """Context manager that counts the enclosed block as in progress"""
+        return InProgress(self, labels)
+
+
+class InProgress:
+    def __init__(self, gauge, labels):
+        self.gauge = gauge
+        self.labels = labels
+
+    def __enter__(self):
+        self.gauge.inc(self.labels)
+
+    def __exit__(self, *exc_info):
+        self.gauge.dec(self.labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                # Per-bucket counts (non-cumulative, plus +Inf), sum, count
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = format_labels(self.labelnames, labels, [('le', format_value(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                label_text = format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_text} {format_value(total)}")
+                lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'chatbot_http_requests_total', 'HTTP requests handled, by route, method and status',
+    ('route', 'method', 'status')
+))
+http_latency = registry.register(Histogram(
+    'chatbot_http_request_duration_seconds', 'Time to handle an HTTP request (streams: until the stream ends)',
+    ('route', 'method')
+))
+http_in_flight = registry.register(Gauge(
+    'chatbot_http_requests_in_flight', 'HTTP requests currently being handled', ('route',)
+))
+http_request_size = registry.register(Histogram(
+    'chatbot_http_request_size_bytes', 'HTTP request body size', ('route',), SIZE_BUCKETS
+))
+http_response_size = registry.register(Histogram(
+    'chatbot_http_response_size_bytes', 'HTTP response body size (when known up front)', ('route',), SIZE_BUCKETS
+))
+upstream_latency = registry.register(Histogram(
+    'chatbot_upstream_request_duration_seconds', 'Latency of upstream calls, by service, target and outcome',
+    ('service', 'target', 'outcome')
+))
+upstream_response_size = registry.register(Histogram(
+    'chatbot_upstream_response_size_bytes', 'Size of successful upstream responses', ('service', 'target'),
+    SIZE_BUCKETS
+))
+upstream_in_flight = registry.register(Gauge(
+    'chatbot_upstream_requests_in_flight', 'Upstream calls currently open', ('service', 'target')
+))
+
+
+def observe_request(route, method, status, seconds, request_size=None, response_size=None):
+    """Record a finished HTTP request"""
+    http_requests.inc((route, method, str(status)))
+    http_latency.observe(seconds, (route, method))
+    if request_size:
+        http_request_size.observe(request_size, (route,))
+    if response_size is not None:
+        http_response_size.observe(response_size, (route,))
+
+
+def classify_error(error):
+    """Outcome label for an exception raised by an upstream call (requests or httpx)"""
+    if isinstance(error, admission.Overloaded):
+        return 'throttled'
+    # asyncio is only loaded in the ASGI mode; without it nothing can be cancelled
+    asyncio = sys.modules.get('asyncio')
+    if asyncio is not None and isinstance(error, asyncio.CancelledError):
+        return 'cancelled'
+    if 'Timeout' in type(error).__name__:
+        return 'timeout'
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'status_code', None):
+        return str(response.status_code)
+    return 'error'
+
+
+class UpstreamCall:
+    """Times one upstream call and records it on exit
+
+    The outcome is ``success`` unless the block raises (then it is derived
+    from the exception) or sets ``outcome`` itself; ``size`` may be set to
+    the response body size. Usable around both blocking and ``await`` code.
+    """
+
+    def __init__(self, service, target):
+        self.labels = (service, target)
+        self.outcome = None
+        self.size = None
+        self.started = None
+
+    def __enter__(self):
+        upstream_in_flight.inc(self.labels)
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        upstream_in_flight.dec(self.labels)
+        outcome = self.outcome or (classify_error(exc) if exc is not None else 'success')
+        upstream_latency.observe(time.monotonic() - self.started, self.labels + (outcome,))
+        if self.size is not None and outcome == 'success':
+            upstream_response_size.observe(self.size, self.labels)
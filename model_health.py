@@ -0,0 +1,215 @@
+"""Process-wide health registry for the image generation models
+
+Every attempt made through ``try_model_generation`` is recorded here with its
+outcome and latency. The registry uses that history to:
+
+* open a circuit for a model after repeated failures, skipping it for a
+  cooldown period before letting a single trial request through again,
+* push models that just reported they are loading behind ready ones,
+* reorder the measured models by expected time-to-image (p50 latency divided
+  by success rate) while unmeasured models keep their configured slot,
+* optionally keep preferred models warm with background probe requests.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+HISTORY_SIZE = int(os.environ.get('MODEL_HEALTH_HISTORY', 50))
+FAILURE_THRESHOLD = int(os.environ.get('MODEL_CIRCUIT_FAILURES', 3))
+CIRCUIT_COOLDOWN = float(os.environ.get('MODEL_CIRCUIT_COOLDOWN', 120))
+LOADING_TTL = float(os.environ.get('MODEL_LOADING_TTL', 60))
+MIN_SAMPLES = int(os.environ.get('MODEL_HEALTH_MIN_SAMPLES', 3))
+
+# Outcomes that count against a model's circuit; "loading" and "cancelled"
+# say nothing about whether the model works
+FAILURE_OUTCOMES = {'error', 'validation_error', 'timeout'}
+
+logger = logging.getLogger(__name__)
+
+
+class ModelHealth:
+    """Rolling statistics for a single model"""
+
+    def __init__(self, name):
+        self.name = name
+        self.outcomes = deque(maxlen=HISTORY_SIZE)
+        self.latencies = deque(maxlen=HISTORY_SIZE)
+        self.consecutive_failures = 0
+        self.circuit_open_until = 0.0
+        self.half_open_trial = False
+        self.loading_since = None
+        self.last_outcome = None
+        self.last_error = None
+        self.last_seen = None
+
+    def success_rate(self):
+        if not self.outcomes:
+            return None
+        return sum(1 for ok in self.outcomes if ok) / len(self.outcomes)
+
+    def p50_latency(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2]
+
+    def circuit_state(self, now):
+        if self.circuit_open_until == 0.0:
+            return 'closed'
+        if now < self.circuit_open_until:
+            return 'open'
+        return 'half_open'
+
+    def is_loading(self, now):
+        return self.loading_since is not None and now - self.loading_since < LOADING_TTL
+
+    def expected_time(self):
+        """p50 latency scaled by how often the model actually delivers"""
+        rate = self.success_rate()
+        p50 = self.p50_latency()
+        if rate is None or p50 is None:
+            return None
+        return p50 / max(rate, 0.05)
+
+
+class ModelHealthRegistry:
+    """Thread-safe map of model name to ``ModelHealth``"""
+
+    def __init__(self):
+        self.models = {}
+        self.lock = threading.Lock()
+        self.warmup_thread = None
+
+    def get(self, name):
+        health = self.models.get(name)
+        if health is None:
+            health = self.models.setdefault(name, ModelHealth(name))
+        return health
+
+    def record(self, name, outcome, latency, message=None):
+        """Record one attempt; ``outcome`` is success/loading/error/validation_error/timeout/cancelled
+
+        ``latency`` may be None for attempts that are not representative of a
+        real generation (warm-up probes), in which case only the outcome counts.
+        """
+        now = time.time()
+        with self.lock:
+            health = self.get(name)
+            health.last_outcome = outcome
+            health.last_seen = now
+
+            if outcome == 'cancelled':
+                health.half_open_trial = False
+                return
+
+            if outcome == 'loading':
+                health.loading_since = health.loading_since or now
+                health.half_open_trial = False
+                return
+
+            health.loading_since = None
+            health.outcomes.append(outcome == 'success')
+
+            if outcome == 'success':
+                if latency is not None:
+                    health.latencies.append(latency)
+                health.consecutive_failures = 0
+                health.circuit_open_until = 0.0
+                health.last_error = None
+            elif outcome in FAILURE_OUTCOMES:
+                health.consecutive_failures += 1
+                health.last_error = message
+                if health.consecutive_failures >= FAILURE_THRESHOLD or health.half_open_trial:
+                    health.circuit_open_until = now + CIRCUIT_COOLDOWN
+            health.half_open_trial = False
+
+    def allow(self, name):
+        """Whether a request to ``name`` may go out now (claims the half-open trial)"""
+        now = time.time()
+        with self.lock:
+            health = self.get(name)
+            state = health.circuit_state(now)
+            if state == 'open':
+                return False
+            if state == 'half_open':
+                if health.half_open_trial:
+                    return False
+                health.half_open_trial = True
+            return True
+
+    def order(self, models):
+        """Return ``models`` reordered by observed health, skipping open circuits
+
+        Measured models are sorted by expected time-to-image into the slots the
+        measured models occupy in the configured order; unmeasured models keep
+        their configured position. Models that are currently loading go after
+        ready ones. If every circuit is open the configured order is returned
+        so requests still have something to try.
+        """
+        now = time.time()
+        with self.lock:
+            usable = [m for m in models if self.get(m['name']).circuit_state(now) != 'open']
+            if not usable:
+                return list(models)
+
+            measured_slots = [
+                i for i, m in enumerate(usable)
+                if len(self.get(m['name']).outcomes) >= MIN_SAMPLES
+            ]
+            measured = sorted(
+                (usable[i] for i in measured_slots),
+                key=lambda m: self.get(m['name']).expected_time() or float('inf')
+            )
+            ordered = list(usable)
+            for slot, model in zip(measured_slots, measured):
+                ordered[slot] = model
+
+            ready = [m for m in ordered if not self.get(m['name']).is_loading(now)]
+            loading = [m for m in ordered if self.get(m['name']).is_loading(now)]
+            return ready + loading
+
+    def snapshot(self, name):
+        """JSON-friendly view of one model's health"""
+        now = time.time()
+        with self.lock:
+            health = self.get(name)
+            rate = health.success_rate()
+            p50 = health.p50_latency()
+            return {
+                'circuit': health.circuit_state(now),
+                'circuit_retry_in': round(max(0.0, health.circuit_open_until - now), 1),
+                'consecutive_failures': health.consecutive_failures,
+                'loading': health.is_loading(now),
+                'samples': len(health.outcomes),
+                'success_rate': round(rate, 3) if rate is not None else None,
+                'p50_latency': round(p50, 3) if p50 is not None else None,
+                'last_outcome': health.last_outcome,
+                'last_error': health.last_error,
+                'last_seen': health.last_seen
+            }
+
+    def start_warmup(self, probe, models, interval, top_n=2):
+        """Periodically call ``probe(model)`` for the ``top_n`` preferred models
+
+        ``probe`` is expected to record its own outcome. Runs in a daemon
+        thread; calling this again while a warm-up thread is alive is a no-op.
+        """
+        if interval <= 0 or (self.warmup_thread and self.warmup_thread.is_alive()):
+            return
+
+        def run():
+            while True:
+                for model in self.order(models)[:top_n]:
+                    try:
+                        probe(model)
+                    except Exception as e:
+                        logger.warning("Warm-up probe for %s failed: %s", model['name'], e, extra={'model': model['name']})
+                time.sleep(interval)
+
+        self.warmup_thread = threading.Thread(target=run, name='model-warmup', daemon=True)
+        self.warmup_thread.start()
+
+
+registry = ModelHealthRegistry()
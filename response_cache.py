@@ -0,0 +1,159 @@
+"""Bounded cache for slash-command responses
+
+The slash commands (/quick, /define, /summary, /bullet) run at low
+temperature with fixed system prompts, so the same prompt gives practically
+the same answer. Their replies are cached by command and normalized prompt in
+an in-memory LRU tier, optionally backed by an SQLite tier that survives
+restarts and is shared by every worker on the host. Both tiers expire entries
+after a TTL. Each process opens its own connection to the SQLite tier, so
+workers forked from a preloaded master never share one.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 24 * 3600))
+CACHE_DB = os.environ.get('RESPONSE_CACHE_DB', '')
+CACHE_DB_SIZE = int(os.environ.get('RESPONSE_CACHE_DB_SIZE', 100000))
+
+
+def normalize_prompt(prompt):
+    """Case- and whitespace-insensitive form of a prompt"""
+    return ' '.join(prompt.lower().split())
+
+
+def make_key(command, spec, prompt):
+    """Cache key for a command run; ``spec`` is included so editing a command invalidates it"""
+    raw = json.dumps([command, spec, normalize_prompt(prompt)], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache with an optional SQLite second tier"""
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, db_path=CACHE_DB, max_db_entries=CACHE_DB_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_db_entries = max_db_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db_writes = 0
+        self.db_path = db_path
+        self.db = None
+        self.db_pid = None
+
+    def connection(self):
+        """This process's connection to the SQLite tier, or None without one (lock held)"""
+        if not self.db_path:
+            return None
+        if self.db_pid != os.getpid():
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db_pid = os.getpid()
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)'
+            )
+            self.db.execute('CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed)')
+            self.db.commit()
+        return self.db
+
+    def warm(self):
+        """Fill the memory tier with the most recently used unexpired entries of the SQLite tier"""
+        with self.lock:
+            db = self.connection()
+            if db is None:
+                return 0
+            rows = db.execute(
+                'SELECT key, value, created FROM response_cache WHERE created >= ? ORDER BY accessed DESC LIMIT ?',
+                (time.time() - self.ttl, self.max_entries)
+            ).fetchall()
+            # Least recently used first, so the LRU order matches the disk tier
+            for key, value, created in reversed(rows):
+                self.put_memory(key, value, created)
+            return len(rows)
+
+    def get(self, key):
+        """Return the cached value for ``key``, or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+
+            db = self.connection()
+            if db is not None:
+                row = db.execute(
+                    'SELECT value, created FROM response_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row and now - row[1] < self.ttl:
+                    db.execute('UPDATE response_cache SET accessed = ? WHERE key = ?', (now, key))
+                    db.commit()
+                    self.put_memory(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        """Store ``value`` in both tiers"""
+        now = time.time()
+        with self.lock:
+            self.put_memory(key, value, now)
+            db = self.connection()
+            if db is not None:
+                db.execute(
+                    'INSERT OR REPLACE INTO response_cache (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                    (key, value, now, now)
+                )
+                self.db_writes += 1
+                # Every so often trim expired rows, then the least recently used beyond the size limit
+                if self.db_writes % 100 == 0:
+                    db.execute('DELETE FROM response_cache WHERE created < ?', (now - self.ttl,))
+                    db.execute(
+                        'DELETE FROM response_cache WHERE key IN ('
+                        'SELECT key FROM response_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                        (self.max_db_entries,)
+                    )
+                db.commit()
+
+    def put_memory(self, key, value, created):
+        """Insert into the memory tier, evicting the least recently used entry (lock held)"""
+        self.entries[key] = (value, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+                'disk_tier': bool(self.db_path)
+            }
+
+
+command_cache = ResponseCache()
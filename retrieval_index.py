@@ -0,0 +1,234 @@
+"""Per-conversation passage retrieval over attached documents
+
+Extracted document text is split into overlapping word-window chunks and
+indexed once per file (by content hash) in SQLite: chunk text and length
+plus a postings table of term frequencies. Conversations only link to the
+files attached in them, so adding a document indexes just that document and
+the same document attached elsewhere is not indexed again.
+
+At query time the chunks of the conversation's files are ranked with BM25
+against the message and the best ones are taken, in score order, until the
+token budget is used up. Everything is pure Python and local.
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from conversation_store import estimate_tokens
+
+CHUNK_WORDS = int(os.environ.get('RETRIEVAL_CHUNK_WORDS', 180))
+CHUNK_OVERLAP = int(os.environ.get('RETRIEVAL_CHUNK_OVERLAP', 30))
+READ_BLOCK_SIZE = 64 * 1024
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have he her his i if in into is it its me my no not of on or '
+    'our she so than that the their them then there these they this to was we were what when where which '
+    'who why will with you your'.split()
+)
+
+
+def tokenize(text):
+    """Lowercased index terms of a text, without stopwords and single characters"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def iter_words(path):
+    """Yield the words of a text file, reading it in blocks"""
+    with open(path, 'r', encoding='utf-8') as f:
+        carry = ''
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            words = (carry + block).split()
+            # The last word may continue in the next block
+            carry = '' if block[-1].isspace() else (words.pop() if words else '')
+            yield from words
+        if carry:
+            yield carry
+
+
+def iter_chunks(path, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Yield overlapping chunks of ``chunk_words`` words from a text file"""
+    window = []
+    step = max(1, chunk_words - overlap)
+    emitted = False
+    for word in iter_words(path):
+        window.append(word)
+        if len(window) == chunk_words:
+            yield ' '.join(window)
+            emitted = True
+            window = window[step:]
+    # Flush the tail unless it is only the overlap of the previous chunk
+    if window and (not emitted or len(window) > overlap):
+        yield ' '.join(window)
+
+
+class RetrievalIndex:
+    """BM25 index of document chunks, shared by all conversations"""
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'file_id TEXT PRIMARY KEY, name TEXT NOT NULL, chunk_count INTEGER NOT NULL, '
+            'total_length INTEGER NOT NULL, created REAL NOT NULL)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, file_id TEXT NOT NULL, seq INTEGER NOT NULL, '
+            'text TEXT NOT NULL, length INTEGER NOT NULL, tokens INTEGER NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS chunks_file ON chunks (file_id, seq)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS postings ('
+            'term TEXT NOT NULL, file_id TEXT NOT NULL, chunk_id INTEGER NOT NULL, tf INTEGER NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS postings_term ON postings (term, file_id)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS conversation_files ('
+            'conversation_id TEXT NOT NULL, file_id TEXT NOT NULL, added REAL NOT NULL, '
+            'PRIMARY KEY (conversation_id, file_id))'
+        )
+        self.db.commit()
+
+    def is_indexed(self, file_id):
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM files WHERE file_id = ?', (file_id,)).fetchone() is not None
+
+    def index_file(self, file_id, name, text_path):
+        """Chunk and index a file's extracted text (no-op if it is already indexed)"""
+        if self.is_indexed(file_id):
+            return
+
+        # Build the rows outside the lock, then insert them in one transaction
+        chunk_rows = []
+        postings = []
+        total_length = 0
+        for seq, chunk in enumerate(iter_chunks(text_path)):
+            terms = Counter(tokenize(chunk))
+            length = sum(terms.values())
+            total_length += length
+            chunk_rows.append((seq, chunk, length, estimate_tokens(chunk), terms))
+
+        with self.lock:
+            if self.db.execute('SELECT 1 FROM files WHERE file_id = ?', (file_id,)).fetchone():
+                return
+            for seq, chunk, length, tokens, terms in chunk_rows:
+                chunk_id = self.db.execute(
+                    'INSERT INTO chunks (file_id, seq, text, length, tokens) VALUES (?, ?, ?, ?, ?)',
+                    (file_id, seq, chunk, length, tokens)
+                ).lastrowid
+                postings.extend((term, file_id, chunk_id, tf) for term, tf in terms.items())
+            self.db.executemany('INSERT INTO postings (term, file_id, chunk_id, tf) VALUES (?, ?, ?, ?)', postings)
+            self.db.execute(
+                'INSERT INTO files (file_id, name, chunk_count, total_length, created) VALUES (?, ?, ?, ?, ?)',
+                (file_id, name, len(chunk_rows), total_length, time.time())
+            )
+            self.db.commit()
+
+    def add_to_conversation(self, conversation_id, file_id):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR IGNORE INTO conversation_files (conversation_id, file_id, added) VALUES (?, ?, ?)',
+                (conversation_id, file_id, time.time())
+            )
+            self.db.commit()
+
+    def conversation_files(self, conversation_id):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT file_id FROM conversation_files WHERE conversation_id = ? ORDER BY added', (conversation_id,)
+            ).fetchall()
+        return [file_id for (file_id,) in rows]
+
+    def remove_conversation(self, conversation_id):
+        with self.lock:
+            self.db.execute('DELETE FROM conversation_files WHERE conversation_id = ?', (conversation_id,))
+            self.db.commit()
+
+    def search(self, query, file_ids, budget_tokens, top_k=8):
+        """Best chunks of ``file_ids`` for ``query`` that fit in ``budget_tokens``
+
+        Returns dicts with ``name``, ``seq``, ``text`` and ``score``, ordered by
+        file and position so passages read in document order.
+        """
+        terms = set(tokenize(query))
+        if not terms or not file_ids:
+            return []
+
+        placeholders = ','.join('?' * len(file_ids))
+        scores = Counter()
+        with self.lock:
+            chunk_count, total_length = self.db.execute(
+                f'SELECT COALESCE(SUM(chunk_count), 0), COALESCE(SUM(total_length), 0) '
+                f'FROM files WHERE file_id IN ({placeholders})', file_ids
+            ).fetchone()
+            if not chunk_count:
+                return []
+            average_length = total_length / chunk_count or 1
+
+            postings = {}
+            for term in terms:
+                postings[term] = self.db.execute(
+                    f'SELECT p.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id '
+                    f'WHERE p.term = ? AND p.file_id IN ({placeholders})', [term] + list(file_ids)
+                ).fetchall()
+
+            for term, rows in postings.items():
+                if not rows:
+                    continue
+                idf = math.log(1 + (chunk_count - len(rows) + 0.5) / (len(rows) + 0.5))
+                for chunk_id, tf, length in rows:
+                    scores[chunk_id] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+            selected = []
+            used = 0
+            for chunk_id, score in scores.most_common():
+                if len(selected) >= top_k:
+                    break
+                row = self.db.execute(
+                    'SELECT c.file_id, f.name, c.seq, c.text, c.tokens FROM chunks c '
+                    'JOIN files f ON f.file_id = c.file_id WHERE c.id = ?', (chunk_id,)
+                ).fetchone()
+                if used + row[4] > budget_tokens:
+                    continue
+                used += row[4]
+                selected.append({'file_id': row[0], 'name': row[1], 'seq': row[2], 'text': row[3], 'score': score})
+
+        order = {file_id: i for i, file_id in enumerate(file_ids)}
+        selected.sort(key=lambda passage: (order[passage['file_id']], passage['seq']))
+        return selected
+
+    def leading(self, file_ids, budget_tokens, top_k=8):
+        """The opening chunks of ``file_ids`` that fit in ``budget_tokens``
+
+        Used when the message has no searchable terms (e.g. "summarize this"),
+        so a new document is still represented by its beginning.
+        """
+        selected = []
+        used = 0
+        with self.lock:
+            for file_id in file_ids:
+                rows = self.db.execute(
+                    'SELECT f.name, c.seq, c.text, c.tokens FROM chunks c JOIN files f ON f.file_id = c.file_id '
+                    'WHERE c.file_id = ? ORDER BY c.seq LIMIT ?', (file_id, top_k)
+                ).fetchall()
+                for name, seq, text, tokens in rows:
+                    if len(selected) >= top_k or used + tokens > budget_tokens:
+                        return selected
+                    used += tokens
+                    selected.append({'file_id': file_id, 'name': name, 'seq': seq, 'text': text, 'score': None})
+        return selected
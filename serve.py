@@ -0,0 +1,70 @@
+"""Production launcher: pre-forked gunicorn workers sharing a preloaded app
+
+    python serve.py
+    python serve.py --bind 0.0.0.0:8000 --workers 8 --threads 16
+
+The app is imported and built once in the master process, and workers are
+forked from it. A worker (re)start therefore costs a fork plus ``warm_up()``
+(opening the SQLite stores and pre-connecting to the upstream APIs), not a
+fresh interpreter and import. Each worker runs ``--threads`` threads, since
+requests mostly wait on upstream calls and streams.
+
+``kill -HUP <master pid>`` replaces the workers gracefully. Note that a HUP
+does not re-import the app; restart the master to deploy new code. Defaults
+come from ``WEB_CONCURRENCY``, ``WEB_THREADS``, ``HOST`` and ``PORT`` (see
+config.py). Needs ``gunicorn`` (``pip install gunicorn``, Unix only).
+"""
+import argparse
+
+from gunicorn.app.base import BaseApplication
+
+import config
+
+
+def post_fork(server, worker):
+    """Warm each worker before it starts accepting connections"""
+    import app as chatbot
+    if config.WARM_UP:
+        chatbot.warm_up()
+    chatbot.start_model_warmup()
+
+
+class ChatbotApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import app as chatbot
+        return chatbot.app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the chatbot with pre-forked gunicorn workers')
+    parser.add_argument('--bind', default=f"{config.HOST}:{config.PORT}")
+    parser.add_argument('--workers', type=int, default=config.WEB_CONCURRENCY)
+    parser.add_argument('--threads', type=int, default=config.WEB_THREADS)
+    parser.add_argument('--max-requests', type=int, default=0, help='recycle a worker after this many requests (0: never)')
+    parser.add_argument('--graceful-timeout', type=float, default=30)
+    args = parser.parse_args(argv)
+
+    ChatbotApplication({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'post_fork': post_fork,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': 5
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""Server-side sessions shared by every worker process
+
+Flask keeps sessions in a cookie signed with ``app.secret_key``. That only
+works across workers and hosts when they all sign with the same key, and every
+change rewrites the cookie. Here the cookie holds just a signed session ID.
+The session data lives in a :class:`SessionBackend`:
+
+- :class:`SQLiteSessionBackend` stores it in an SQLite file, shared by the
+  workers on one host;
+- a networked store (Redis, memcached, a database) can be plugged in for
+  several hosts by implementing the same four methods and pointing
+  ``SESSION_BACKEND`` at a factory (``package.module:callable``).
+
+:class:`SessionStore` puts a bounded in-process LRU cache in front of the
+backend. Hot sessions are then read without a round trip. A cached copy is
+trusted for ``SESSION_CACHE_TTL`` seconds, so a change made by another worker
+shows up here after at most that long. Writes always go through to the
+backend.
+
+Sessions expire ``PERMANENT_SESSION_LIFETIME`` after they were last saved.
+Active sessions are saved again once half of that has passed, so they do not
+expire while in use.
+"""
+import importlib
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 10000))
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', 30))
+# How often expired sessions are deleted from the backend
+PURGE_INTERVAL = 3600
+
+serializer = TaggedJSONSerializer()
+
+
+def persistent_secret_key(path):
+    """Signing key stored at ``path``, created on first use
+
+    Every process started from the same instance folder (workers, restarts)
+    gets the same key. The file is created atomically, so processes starting
+    together agree on one key.
+    """
+    try:
+        with open(path) as f:
+            key = f.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        # Fails if another process created the key first; theirs wins
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(temp_path)
+    with open(path) as f:
+        return f.read().strip()
+
+
+class SessionBackend:
+    """Where session data is kept
+
+    Values are serialized session dicts (``str``); ``expires`` is a Unix
+    timestamp after which a session must no longer be returned. Methods may
+    be called from many threads at once.
+    """
+
+    def load(self, sid):
+        """``(value, expires)`` of an unexpired session, or None"""
+        raise NotImplementedError
+
+    def save(self, sid, value, expires):
+        raise NotImplementedError
+
+    def delete(self, sid):
+        raise NotImplementedError
+
+    def purge(self):
+        """Delete expired sessions (networked stores with their own expiry can do nothing)"""
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in an SQLite file; each process opens its own connection"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.db = None
+        self.db_pid = None
+
+    def connection(self):
+        """This process's connection (lock held)"""
+        if self.db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.db_pid = os.getpid()
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+            self.db.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)')
+            self.db.commit()
+        return self.db
+
+    def load(self, sid):
+        with self.lock:
+            return self.connection().execute(
+                'SELECT value, expires FROM sessions WHERE sid = ? AND expires > ?', (sid, time.time())
+            ).fetchone()
+
+    def save(self, sid, value, expires):
+        with self.lock:
+            db = self.connection()
+            db.execute('INSERT OR REPLACE INTO sessions (sid, value, expires) VALUES (?, ?, ?)', (sid, value, expires))
+            db.commit()
+
+    def delete(self, sid):
+        with self.lock:
+            db = self.connection()
+            db.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+            db.commit()
+
+    def purge(self):
+        with self.lock:
+            db = self.connection()
+            db.execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),))
+            db.commit()
+
+
+def load_backend(spec, db_path):
+    """Backend named by ``SESSION_BACKEND``: ``sqlite`` or ``package.module:callable``"""
+    if spec == 'sqlite':
+        return SQLiteSessionBackend(db_path)
+    module_name, _, attribute = spec.partition(':')
+    if not attribute:
+        raise ValueError(f"SESSION_BACKEND must be 'sqlite', 'cookie' or 'module:callable', not {spec!r}")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+class SessionStore:
+    """A backend with a bounded LRU cache of recently used sessions in front"""
+
+    def __init__(self, backend, max_entries=SESSION_CACHE_SIZE, cache_ttl=SESSION_CACHE_TTL):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.cache_ttl = cache_ttl
+        self.entries = OrderedDict()  # sid -> (data, expires, cached at)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.last_purge = time.monotonic()
+
+    def load(self, sid):
+        """``(data, expires)`` of a live session, or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is not None and entry[1] > now and entry[2] > time.monotonic() - self.cache_ttl:
+                self.entries.move_to_end(sid)
+                self.hits += 1
+                return dict(entry[0]), entry[1]
+            self.misses += 1
+        row = self.backend.load(sid)
+        if row is None:
+            self.forget(sid)
+            return None
+        data, expires = serializer.loads(row[0]), row[1]
+        self.remember(sid, data, expires)
+        return dict(data), expires
+
+    def save(self, sid, data, expires):
+        self.backend.save(sid, serializer.dumps(data), expires)
+        self.remember(sid, dict(data), expires)
+        with self.lock:
+            self.writes += 1
+            purge = time.monotonic() - self.last_purge > PURGE_INTERVAL
+            if purge:
+                self.last_purge = time.monotonic()
+        if purge:
+            self.backend.purge()
+
+    def delete(self, sid):
+        self.backend.delete(sid)
+        self.forget(sid)
+
+    def remember(self, sid, data, expires):
+        with self.lock:
+            self.entries[sid] = (data, expires, time.monotonic())
+            self.entries.move_to_end(sid)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def forget(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'cached': len(self.entries),
+                'max_entries': self.max_entries,
+                'cache_ttl': self.cache_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'writes': self.writes
+            }
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict that tracks changes, identified by ``sid``"""
+
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface keeping sessions in a :class:`SessionStore`
+
+    :meth:`load_session` and :meth:`store_session` hold the logic, so the
+    ASGI mode can wrap them in Quart's async interface.
+    """
+
+    session_class = ServerSideSession
+    salt = 'chatbot-session'
+
+    def __init__(self, store):
+        self.store = store
+
+    def signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt)
+
+    def load_session(self, app, cookie_value):
+        """The session named by a cookie, or a new empty one (None without a secret key)"""
+        signer = self.signer(app)
+        if signer is None:
+            return None
+        if cookie_value:
+            try:
+                sid = signer.unsign(cookie_value).decode('ascii')
+            except (BadSignature, UnicodeDecodeError):
+                sid = None
+            loaded = self.store.load(sid) if sid else None
+            if loaded is not None:
+                data, expires = loaded
+                return self.session_class(data, sid=sid, expires=expires)
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def store_session(self, app, session, response):
+        """Save a changed session and set or delete its cookie on ``response``"""
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        refresh = session.expires is None or session.expires - now < lifetime / 2
+        if session.modified or refresh:
+            session.expires = now + lifetime
+            self.store.save(session.sid, dict(session), session.expires)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                self.signer(app).sign(session.sid).decode('ascii'),
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite
+            )
+            response.vary.add('Cookie')
+
+    def open_session(self, app, request):
+        return self.load_session(app, request.cookies.get(self.get_cookie_name(app)))
+
+    def save_session(self, app, session, response):
+        self.store_session(app, session, response)
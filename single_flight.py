@@ -0,0 +1,164 @@
+"""Single-flight coalescing of identical in-flight upstream requests
+
+When several requests need exactly the same upstream call at the same time
+(the same ``/define`` prompt, the same image prompt for the same model), the
+first one makes the call and the others wait for it and receive its result.
+Keys are derived from the full upstream payload, so only calls that would
+have been byte-for-byte identical are shared. This is not a cache: a key is
+forgotten as soon as its call finishes, so it only covers the window before
+a result exists.
+
+Semantics shared by both variants:
+
+* an exception raised by the call is re-raised in every waiter, and nothing
+  is remembered, so the next request makes a fresh call,
+* the shared call is only cancelled once every waiter has given up on it; a
+  request arriving after that starts a new call instead of joining one that
+  is being torn down.
+
+``SingleFlight`` is for the threaded (Flask) mode and ``AsyncSingleFlight``
+for the asyncio (ASGI) mode.
+"""
+import hashlib
+import json
+import threading
+
+
+def payload_key(*parts):
+    """Coalescing key for an upstream call, e.g. ``payload_key(url, payload)``"""
+    raw = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class Flight:
+    """One in-flight call and the cancel events of the requests waiting on it"""
+
+    def __init__(self, cancel_event):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancel_events = [cancel_event]
+
+    def is_set(self):
+        """True once every waiter has cancelled (``threading.Event``-compatible)
+
+        Waiters without a cancel event can never cancel, so they keep the call
+        alive until it finishes.
+        """
+        return all(event is not None and event.is_set() for event in self.cancel_events)
+
+
+class SingleFlight:
+    """Thread-based single-flight group"""
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, cancel_event=None):
+        """Return ``fn(cancel)``, sharing the call with concurrent callers of the same ``key``
+
+        ``cancel`` is an event-like object that is set once every caller's
+        ``cancel_event`` is set, or None when the first caller passed no
+        ``cancel_event`` (the call then cannot be cancelled).
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None and not flight.is_set():
+                flight.cancel_events.append(cancel_event)
+                self.shared += 1
+                leader = False
+            else:
+                flight = self.flights[key] = Flight(cancel_event)
+                self.calls += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(flight if cancel_event is not None else None)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self.lock:
+            total = self.calls + self.shared
+            return {
+                'in_flight': len(self.flights),
+                'calls': self.calls,
+                'shared': self.shared,
+                'shared_rate': round(self.shared / total, 3) if total else None
+            }
+
+
+class AsyncFlight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """Asyncio single-flight group; the shared call runs as its own task
+
+    A waiter that is cancelled only stops waiting; the task itself is
+    cancelled when its last waiter goes away.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, coro_fn):
+        """Return ``await coro_fn()``, sharing the call with concurrent callers of the same ``key``"""
+        import asyncio
+
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = AsyncFlight(asyncio.ensure_future(coro_fn()))
+            flight.task.add_done_callback(lambda task: self.finished(key, flight))
+            self.calls += 1
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every waiter was cancelled: abort the call and let new requests start afresh
+                self.forget(key, flight)
+                flight.task.cancel()
+
+    def finished(self, key, flight):
+        self.forget(key, flight)
+        if not flight.task.cancelled():
+            # Mark the exception as retrieved even if every waiter left
+            flight.task.exception()
+
+    def forget(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    def stats(self):
+        total = self.calls + self.shared
+        return {
+            'in_flight': len(self.flights),
+            'calls': self.calls,
+            'shared': self.shared,
+            'shared_rate': round(self.shared / total, 3) if total else None
+        }
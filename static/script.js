@@ -32,6 +32,7 @@ document.addEventListener('DOMContentLoaded', function() {
   let currentConversationId = generateId();
   let isProcessing = false;
   let attachedFiles = [];
+  const uploadedFiles = new Map(); // file key -> promise of the server file ID
   let currentSettings = {
     theme: 'dark',
     temperature: 0.7,
@@ -39,6 +40,27 @@ document.addEventListener('DOMContentLoaded', function() {
     conversationName: 'New Conversation'
   };
 
+  // Chat history lives in IndexedDB: conversation summaries (with a
+  // multi-entry index of search terms) in one store, and one record per
+  // exchange in another, so saving a message never rewrites the whole history
+  // and the sidebar only reads summaries. Generated images are kept as their
+  // URL, or as a Blob when the server sent them inline.
+  const HISTORY_DB_NAME = 'chatbot-history';
+  const HISTORY_DB_VERSION = 1;
+  const HISTORY_PAGE_SIZE = 50;
+  const HISTORY_ROW_HEIGHT = 56; // px, .history-item height plus the gap below it
+  const HISTORY_OVERSCAN = 6;
+  const MAX_SEARCH_TERMS = 200;
+  const historySection = historyList.parentElement;
+  let historyDbPromise = null;
+  let historyRows = [];
+  let historyCursorKey = null; // 'updated' of the last loaded row; null before the first page
+  let historyExhausted = false;
+  let historyLoading = null;
+  let historySearchTimer = null;
+  let historyRenderQueued = false;
+  let conversationObjectUrls = [];
+
   // Initialize
   initializeApp();
   
@@ -89,6 +111,8 @@ document.addEventListener('DOMContentLoaded', function() {
     // History management
     clearAllBtn.addEventListener('click', clearAllHistory);
     searchInput.addEventListener('input', filterHistory);
+    historySection.addEventListener('scroll', scheduleHistoryRender, { passive: true });
+    window.addEventListener('resize', scheduleHistoryRender);
     
     // Auto-resize textarea
     promptInput.addEventListener('input', autoResizeTextarea);
@@ -165,30 +189,16 @@ document.addEventListener('DOMContentLoaded', function() {
     sendButton.disabled = true;
     
     try {
-      // Prepare files for API
+      // Files are uploaded once when attached; messages only reference them by ID
       const fileData = await Promise.all(
-        attachedFiles.map(async (file) => {
-          if (file.type.startsWith('image/')) {
-            const base64 = await fileToBase64(file);
-            return {
-              type: file.type,
-              data: base64.split(',')[1],
-              name: file.name
-            };
-          } else {
-            // For non-image files, we'll send the filename as reference
-            const textContent = await readFileAsText(file);
-            return {
-              type: file.type,
-              data: null,
-              name: file.name,
-              content: textContent
-            };
-          }
-        })
+        attachedFiles.map(async (file) => ({
+          file_id: await uploadAttachment(file),
+          type: file.type,
+          name: file.name
+        }))
       );
       
-      const response = await fetch('/send_message', {
+      const response = await fetch('/stream_message', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -196,16 +206,19 @@ document.addEventListener('DOMContentLoaded', function() {
         body: JSON.stringify({
           message: message,
           files: fileData,
+          conversation_id: currentConversationId,
           system_prompt: currentSettings.systemPrompt,
           temperature: parseFloat(currentSettings.temperature)
         })
       });
       
       if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
+        // Errors (including 429 rate limits) come back as JSON with a readable message
+        const error = await response.json().catch(() => null);
+        throw new Error((error && error.response) || `HTTP error! status: ${response.status}`);
       }
       
-      const data = await response.json();
+      const data = await readMessageStream(response);
       
       if (data.status === 'success') {
         addMessage(data.response, 'bot');
@@ -225,14 +238,88 @@ document.addEventListener('DOMContentLoaded', function() {
     }
   }
   
-  // Helper function to read file as text
-  function readFileAsText(file) {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.onload = e => resolve(e.target.result);
-      reader.onerror = error => reject(error);
-      reader.readAsText(file);
-    });
+  // Read the Server-Sent Events reply from /stream_message, rendering text as it arrives
+  async function readMessageStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let streamedText = '';
+    let streamingDiv = null;
+    let renderedDiv = null;
+    let pendingDiv = null;
+    let result = null;
+    
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+      
+      for (const event of events) {
+        if (!event.startsWith('data:')) continue;
+        const payload = JSON.parse(event.slice(5));
+        
+        if (payload.type === 'delta') {
+          streamedText += payload.text;
+          if (!streamingDiv) {
+            hideTypingIndicator();
+            streamingDiv = addMessage('', 'bot');
+            const bubble = streamingDiv.querySelector('.message-bubble');
+            bubble.innerHTML = '<div class="stream-rendered"></div><div class="stream-pending"></div>';
+            renderedDiv = bubble.querySelector('.stream-rendered');
+            pendingDiv = bubble.querySelector('.stream-pending');
+          }
+          // Completed blocks arrive already rendered; only the open block is rendered here
+          if (payload.html) {
+            renderedDiv.insertAdjacentHTML('beforeend', payload.html);
+          }
+          pendingDiv.innerHTML = marked.parse(streamedText.slice(payload.pending_from || 0));
+          scrollToBottom();
+        } else if (payload.type === 'done') {
+          result = payload;
+        }
+      }
+    }
+    
+    // The final message is re-rendered from the formatted response so that
+    // copy/regenerate and history behave exactly like a non-streamed reply
+    if (streamingDiv) {
+      streamingDiv.remove();
+    }
+    
+    if (!result) {
+      throw new Error('Stream ended unexpectedly');
+    }
+    return result;
+  }
+  
+  function attachmentKey(file) {
+    return `${file.name}:${file.size}:${file.lastModified}`;
+  }
+  
+  // Upload a file to the server (once per file) and resolve to its file ID
+  function uploadAttachment(file) {
+    const key = attachmentKey(file);
+    if (!uploadedFiles.has(key)) {
+      const formData = new FormData();
+      formData.append('file', file);
+      const upload = fetch('/upload_file', { method: 'POST', body: formData })
+        .then(response => response.json())
+        .then(data => {
+          if (data.status !== 'success') {
+            throw new Error(data.message || 'Upload failed');
+          }
+          return data.file_id;
+        })
+        .catch(error => {
+          uploadedFiles.delete(key);
+          throw error;
+        });
+      uploadedFiles.set(key, upload);
+    }
+    return uploadedFiles.get(key);
   }
   
   async function generateImage(prompt) {
@@ -250,7 +337,8 @@ document.addEventListener('DOMContentLoaded', function() {
     sendButton.disabled = true;
     
     try {
-      const response = await fetch('/generate_image', {
+      // Generation runs as a server-side job; follow its progress until it finishes
+      const response = await fetch('/image_jobs', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -260,12 +348,23 @@ document.addEventListener('DOMContentLoaded', function() {
         })
       });
       
-      const data = await response.json();
+      const submitted = await response.json();
+      if (!response.ok) {
+        throw new Error(submitted.message || `HTTP error! status: ${response.status}`);
+      }
+      
+      const job = await followImageJob(submitted);
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Image generation failed');
+      }
+      const data = job.result;
       
       if (data.status === 'success') {
-        // Add image message
-        addImageMessage(data.image_base64, prompt, data.timestamp);
-        saveToHistory(`Generate image: "${prompt}"`, `![Generated Image](${data.image_base64})`);
+        // Images are referenced by their cacheable URL; image_base64 is only
+        // present when the server runs in inline mode
+        const imageSrc = data.image_url || data.image_base64;
+        addImageMessage(imageSrc, prompt, data.timestamp, data);
+        saveToHistory(`Generate image: "${prompt}"`, null, imageRecord(prompt, imageSrc, data));
         showToast('Image generated successfully!');
       } else if (data.status === 'loading') {
         addMessage(`The image generation model is currently loading. This usually takes 20-30 seconds. Please try again in a moment.`, 'bot');
@@ -283,12 +382,80 @@ document.addEventListener('DOMContentLoaded', function() {
       showToast('Image generation failed');
     } finally {
       hideTypingIndicator();
+      setTypingStatus(null);
       isProcessing = false;
       sendButton.disabled = false;
     }
   }
   
-  function addImageMessage(imageData, prompt, timestamp) {
+  // Resolve to an image job's final state, showing its progress on the way.
+  // Progress arrives over Server-Sent Events, with polling as the fallback.
+  function followImageJob(job) {
+    showImageJobProgress(job.progress || { type: job.status, position: job.position });
+    return new Promise((resolve, reject) => {
+      const source = new EventSource(job.events_url);
+      
+      source.onmessage = (message) => {
+        const event = JSON.parse(message.data);
+        if (event.job) {
+          source.close();
+          resolve(event.job);
+        } else {
+          showImageJobProgress(event);
+        }
+      };
+      
+      source.onerror = () => {
+        source.close();
+        pollImageJob(job.status_url).then(resolve, reject);
+      };
+    });
+  }
+  
+  async function pollImageJob(statusUrl) {
+    while (true) {
+      const response = await fetch(statusUrl);
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.message || `HTTP error! status: ${response.status}`);
+      }
+      if (job.status === 'succeeded' || job.status === 'failed') {
+        return job;
+      }
+      showImageJobProgress(job.progress || { type: job.status, position: job.position });
+      await new Promise(resolve => setTimeout(resolve, 2000));
+    }
+  }
+  
+  function showImageJobProgress(event) {
+    if (event.type === 'queued') {
+      setTypingStatus(event.position ? `Waiting for ${event.position} image(s) ahead...` : 'Queued...');
+    } else if (event.type === 'trying') {
+      setTypingStatus(`Generating with ${event.model}...`);
+    } else if (event.type === 'model_status' && event.status === 'loading') {
+      setTypingStatus(`${event.model} is loading, trying another model...`);
+    } else if (event.type === 'model_status') {
+      setTypingStatus(`${event.model} failed, trying another model...`);
+    }
+  }
+  
+  // Replace the typing indicator's text; null restores the default
+  function setTypingStatus(text) {
+    const label = typingIndicator.querySelector('.typing-content span');
+    if (!label.dataset.defaultText) {
+      label.dataset.defaultText = label.textContent;
+    }
+    label.textContent = text || label.dataset.defaultText;
+  }
+  
+  function addImageMessage(imageData, prompt, timestamp, urls = {}) {
+    // imageData is the display-size image; the modal shows the full-size
+    // variant and downloads get the original
+    const fullUrl = urls.full_url || urls.original_url || imageData;
+    const originalUrl = urls.original_url || imageData;
+    const sources = (urls.image_sources || [])
+      .map(source => `<source type="${source.type}" srcset="${source.srcset}" sizes="(max-width: 600px) 80vw, 512px">`)
+      .join('');
     const messageDiv = document.createElement('div');
     messageDiv.className = 'message bot-message';
     
@@ -306,10 +473,10 @@ document.addEventListener('DOMContentLoaded', function() {
             <h4>🎨 Generated Image</h4>
             <p><strong>Prompt:</strong> "${prompt}"</p>
             <div class="image-result">
-              <img src="${imageData}" alt="Generated image: ${prompt}" class="generated-image" onclick="showImageModal('${imageData}')">
+              <picture>${sources}<img src="${imageData}" alt="Generated image: ${prompt}" class="generated-image" loading="lazy" onclick="showImageModal('${fullUrl}')"></picture>
             </div>
             <div class="image-actions">
-              <button class="image-action download-btn" data-image="${imageData}" data-filename="generated_image_${Date.now()}.png">
+              <button class="image-action download-btn" data-image="${originalUrl}" data-filename="generated_image_${Date.now()}.png">
                 <i class="fas fa-download"></i> Download
               </button>
               <button class="image-action regenerate-image-btn" data-prompt="${prompt.replace(/"/g, '&quot;')}">
@@ -347,7 +514,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const enhanceBtn = messageDiv.querySelector('.enhance-prompt-btn');
     const copyBtn = messageDiv.querySelector('.copy-btn');
     
-    downloadBtn.addEventListener('click', () => downloadImage(imageData, downloadBtn.dataset.filename));
+    downloadBtn.addEventListener('click', () => downloadImage(originalUrl, downloadBtn.dataset.filename));
     regenerateBtn.addEventListener('click', () => generateImage(prompt));
     enhanceBtn.addEventListener('click', () => enhanceAndRegenerate(prompt));
     copyBtn.addEventListener('click', () => copyToClipboard(prompt));
@@ -365,6 +532,7 @@ document.addEventListener('DOMContentLoaded', function() {
         },
         body: JSON.stringify({
           message: `Improve this image generation prompt for better results, make it more descriptive and detailed but keep the core idea: "${originalPrompt}". Return only the improved prompt without any explanations.`,
+          history: false,
           system_prompt: "You are a prompt engineering expert. Improve image generation prompts by making them more descriptive, detailed, and specific while maintaining the original intent. Return only the improved prompt without any additional text.",
           temperature: 0.7
         })
@@ -397,15 +565,6 @@ document.addEventListener('DOMContentLoaded', function() {
     showToast('Image downloaded successfully!');
   }
   
-  function fileToBase64(file) {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.readAsDataURL(file);
-      reader.onload = () => resolve(reader.result);
-      reader.onerror = error => reject(error);
-    });
-  }
-  
   function addMessage(content, sender, files = []) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${sender}-message`;
@@ -477,6 +636,8 @@ document.addEventListener('DOMContentLoaded', function() {
         });
       }, 0);
     }
+    
+    return messageDiv;
   }
   
   function createFileAttachments(files) {
@@ -695,6 +856,12 @@ document.addEventListener('DOMContentLoaded', function() {
     currentSettings.conversationName = conversationName.value || 'New Conversation';
     conversationTitle.textContent = currentSettings.conversationName;
     saveSettings();
+    
+    fetch('/update_conversation_name', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ name: currentSettings.conversationName, conversation_id: currentConversationId })
+    }).catch(error => console.warn('Could not rename conversation on the server:', error));
   }
   
   function handleFileUpload(event) {
@@ -708,6 +875,11 @@ document.addEventListener('DOMContentLoaded', function() {
       
       attachedFiles.push(file);
       displayFilePreview(file);
+      
+      // Start uploading right away so sending the message does not wait on it
+      uploadAttachment(file).catch(error => {
+        showToast(`Could not upload ${file.name}: ${error.message}`);
+      });
     });
     
     // Reset file input
@@ -797,43 +969,244 @@ document.addEventListener('DOMContentLoaded', function() {
     updateTemperatureValue();
   }
   
-  function saveToHistory(userMessage, botResponse) {
-    const history = JSON.parse(localStorage.getItem('chatHistory') || '[]');
-    
-    // Update current conversation or create new one
-    let conversation = history.find(conv => conv.id === currentConversationId);
-    
-    if (!conversation) {
-      conversation = {
-        id: currentConversationId,
-        title: userMessage.substring(0, 50) + (userMessage.length > 50 ? '...' : ''),
-        timestamp: new Date().toISOString(),
-        messages: []
-      };
-      history.unshift(conversation);
+  function openHistoryDb() {
+    if (!historyDbPromise) {
+      historyDbPromise = new Promise((resolve, reject) => {
+        const request = indexedDB.open(HISTORY_DB_NAME, HISTORY_DB_VERSION);
+        request.onupgradeneeded = () => {
+          const db = request.result;
+          const conversations = db.createObjectStore('conversations', { keyPath: 'id' });
+          conversations.createIndex('updated', 'updated');
+          conversations.createIndex('terms', 'terms', { multiEntry: true });
+          const messages = db.createObjectStore('messages', { keyPath: 'id', autoIncrement: true });
+          messages.createIndex('conversationId', 'conversationId');
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+      }).then(migrateLocalStorageHistory);
     }
-    
-    conversation.messages.push({
-      user: userMessage,
-      bot: botResponse,
-      timestamp: new Date().toISOString()
+    return historyDbPromise;
+  }
+  
+  function requestResult(request) {
+    return new Promise((resolve, reject) => {
+      request.onsuccess = () => resolve(request.result);
+      request.onerror = () => reject(request.error);
     });
+  }
+  
+  function transactionDone(tx) {
+    return new Promise((resolve, reject) => {
+      tx.oncomplete = () => resolve();
+      tx.onerror = () => reject(tx.error);
+      tx.onabort = () => reject(tx.error);
+    });
+  }
+  
+  function searchTerms(text) {
+    return (text || '').toLowerCase().split(/[^\p{L}\p{N}]+/u).filter(Boolean);
+  }
+  
+  function addSearchTerms(conversation, text) {
+    const terms = new Set(conversation.terms);
+    for (const term of searchTerms(text)) {
+      if (terms.size >= MAX_SEARCH_TERMS) break;
+      terms.add(term);
+    }
+    conversation.terms = [...terms];
+  }
+  
+  function conversationTitleFor(userMessage) {
+    return userMessage.substring(0, 50) + (userMessage.length > 50 ? '...' : '');
+  }
+  
+  function dataUrlToBlob(dataUrl) {
+    const [header, data] = dataUrl.split(',');
+    const type = (header.match(/^data:([^;]+)/) || [])[1] || 'application/octet-stream';
+    const binary = atob(data);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+      bytes[i] = binary.charCodeAt(i);
+    }
+    return new Blob([bytes], { type });
+  }
+  
+  // Image messages keep URLs as they are; inline base64 images become Blobs
+  function imageRecord(prompt, src, urls = {}) {
+    if (src.startsWith('data:')) {
+      return { prompt, blob: dataUrlToBlob(src) };
+    }
+    return {
+      prompt,
+      url: src,
+      full_url: urls.full_url,
+      original_url: urls.original_url,
+      image_sources: urls.image_sources
+    };
+  }
+  
+  // One-time import of the old localStorage 'chatHistory' blob
+  async function migrateLocalStorageHistory(db) {
+    const legacy = localStorage.getItem('chatHistory');
+    if (!legacy) return db;
     
-    // Update title if it's the first message
-    if (conversation.messages.length === 1) {
-      conversation.title = userMessage.substring(0, 50) + (userMessage.length > 50 ? '...' : '');
+    let history = [];
+    try {
+      history = JSON.parse(legacy);
+    } catch (error) {
+      console.warn('Discarding unreadable chat history:', error);
     }
     
-    localStorage.setItem('chatHistory', JSON.stringify(history));
-    loadConversationHistory();
+    const tx = db.transaction(['conversations', 'messages'], 'readwrite');
+    const conversations = tx.objectStore('conversations');
+    const messages = tx.objectStore('messages');
+    // Oldest first, so auto-increment keys keep the original message order
+    history.slice().reverse().forEach(legacyConversation => {
+      const conversation = {
+        id: legacyConversation.id,
+        title: legacyConversation.title,
+        created: legacyConversation.timestamp,
+        updated: legacyConversation.timestamp,
+        messageCount: 0,
+        terms: []
+      };
+      addSearchTerms(conversation, legacyConversation.title);
+      
+      (legacyConversation.messages || []).forEach(msg => {
+        const record = { conversationId: conversation.id, user: msg.user, bot: msg.bot, timestamp: msg.timestamp };
+        const imageMatch = msg.user.startsWith('Generate image:') && msg.bot.match(/!\[Generated Image\]\((\S+?)(?: "(.*?)")?\)/);
+        if (imageMatch) {
+          const prompt = msg.user.replace('Generate image: "', '').replace(/"$/, '');
+          record.image = imageRecord(prompt, imageMatch[1], { original_url: imageMatch[2] });
+          record.bot = null;
+        }
+        messages.add(record);
+        addSearchTerms(conversation, msg.user);
+        conversation.messageCount++;
+        conversation.updated = msg.timestamp || conversation.updated;
+      });
+      conversations.put(conversation);
+    });
+    await transactionDone(tx);
+    localStorage.removeItem('chatHistory');
+    return db;
   }
   
-  function loadConversationHistory() {
-    const history = JSON.parse(localStorage.getItem('chatHistory') || '[]');
-    historyList.innerHTML = '';
-    
-    if (history.length === 0) {
-      historyList.innerHTML = `
+  // Append one exchange to the current conversation
+  async function saveToHistory(userMessage, botResponse, image = null) {
+    const conversationId = currentConversationId;
+    const timestamp = new Date().toISOString();
+    try {
+      const db = await openHistoryDb();
+      const tx = db.transaction(['conversations', 'messages'], 'readwrite');
+      const conversations = tx.objectStore('conversations');
+      
+      let conversation = await requestResult(conversations.get(conversationId));
+      if (!conversation) {
+        conversation = {
+          id: conversationId,
+          title: conversationTitleFor(userMessage),
+          created: timestamp,
+          messageCount: 0,
+          terms: []
+        };
+        addSearchTerms(conversation, conversation.title);
+      }
+      conversation.updated = timestamp;
+      conversation.messageCount++;
+      addSearchTerms(conversation, image ? image.prompt : userMessage);
+      
+      conversations.put(conversation);
+      tx.objectStore('messages').add({ conversationId, user: userMessage, bot: botResponse, image, timestamp });
+      await transactionDone(tx);
+      
+      // The conversation moves to the top of the list
+      historyRows = [conversation, ...historyRows.filter(row => row.id !== conversationId)];
+      if (searchInput.value.trim()) {
+        filterHistory();
+      } else {
+        renderHistoryRows();
+      }
+    } catch (error) {
+      console.warn('Could not save chat history:', error);
+    }
+  }
+  
+  // Fetch the next page of conversations, most recently updated first
+  function loadHistoryPage() {
+    if (historyExhausted || historyLoading) return historyLoading;
+    historyLoading = (async () => {
+      const db = await openHistoryDb();
+      const index = db.transaction('conversations').objectStore('conversations').index('updated');
+      // Inclusive bound: rows sharing the last timestamp may not have been read yet
+      const range = historyCursorKey === null ? null : IDBKeyRange.upperBound(historyCursorKey);
+      // Includes conversations saved since the last page, which are already at the top
+      const known = new Set(historyRows.map(row => row.id));
+      const page = [];
+      await new Promise((resolve, reject) => {
+        const request = index.openCursor(range, 'prev');
+        request.onsuccess = () => {
+          const cursor = request.result;
+          if (!cursor || page.length >= HISTORY_PAGE_SIZE) {
+            historyExhausted = !cursor;
+            resolve();
+            return;
+          }
+          if (!known.has(cursor.value.id)) {
+            page.push(cursor.value);
+          }
+          cursor.continue();
+        };
+        request.onerror = () => reject(request.error);
+      });
+      
+      historyRows = historyRows.concat(page);
+      if (page.length) {
+        historyCursorKey = page[page.length - 1].updated;
+      }
+    })().catch(error => {
+      console.warn('Could not load chat history:', error);
+      historyExhausted = true;
+    }).finally(() => {
+      historyLoading = null;
+      renderHistoryRows();
+    });
+    return historyLoading;
+  }
+  
+  async function loadConversationHistory() {
+    // Let a page that is still loading land before starting over
+    await historyLoading;
+    historyRows = [];
+    historyCursorKey = null;
+    historyExhausted = false;
+    await loadHistoryPage();
+  }
+  
+  function scheduleHistoryRender() {
+    if (historyRenderQueued) return;
+    historyRenderQueued = true;
+    requestAnimationFrame(() => {
+      historyRenderQueued = false;
+      renderHistoryRows();
+      // Fetch the next page before the user reaches the end of the list
+      const visibleBottom = historySection.scrollTop + historySection.clientHeight - historyList.offsetTop;
+      if (!searchInput.value.trim() && visibleBottom > (historyRows.length - HISTORY_OVERSCAN) * HISTORY_ROW_HEIGHT) {
+        loadHistoryPage();
+      }
+    });
+  }
+  
+  // Only the rows in (or near) the visible part of the sidebar are in the DOM
+  function renderHistoryRows() {
+    if (historyRows.length === 0) {
+      historyList.style.height = '';
+      historyList.innerHTML = searchInput.value.trim() ? `
+        <div class="empty-history">
+          <i class="fas fa-search"></i>
+          <div>No matching conversations</div>
+        </div>
+      ` : `
         <div class="empty-history">
           <i class="fas fa-comments"></i>
           <div>No conversations yet</div>
@@ -843,42 +1216,67 @@ document.addEventListener('DOMContentLoaded', function() {
       return;
     }
     
-    history.forEach(conversation => {
-      const item = document.createElement('div');
-      item.className = 'history-item';
-      if (conversation.id === currentConversationId) {
-        item.classList.add('active');
+    const scrollTop = Math.max(0, historySection.scrollTop - historyList.offsetTop);
+    const first = Math.max(0, Math.floor(scrollTop / HISTORY_ROW_HEIGHT) - HISTORY_OVERSCAN);
+    const last = Math.min(
+      historyRows.length,
+      Math.ceil((scrollTop + historySection.clientHeight) / HISTORY_ROW_HEIGHT) + HISTORY_OVERSCAN
+    );
+    
+    historyList.style.height = `${historyRows.length * HISTORY_ROW_HEIGHT}px`;
+    historyList.innerHTML = '';
+    for (let i = first; i < last; i++) {
+      historyList.appendChild(createHistoryItem(historyRows[i], i));
+    }
+  }
+  
+  function createHistoryItem(conversation, index) {
+    const item = document.createElement('div');
+    item.className = 'history-item';
+    item.style.top = `${index * HISTORY_ROW_HEIGHT}px`;
+    if (conversation.id === currentConversationId) {
+      item.classList.add('active');
+    }
+    
+    item.innerHTML = `
+      <div class="history-content">
+        <div class="history-title"></div>
+        <div class="history-time">${new Date(conversation.updated).toLocaleDateString()}</div>
+      </div>
+      <button class="delete-history" data-id="${conversation.id}">
+        <i class="fas fa-trash"></i>
+      </button>
+    `;
+    item.querySelector('.history-title').textContent = conversation.title;
+    
+    item.addEventListener('click', (e) => {
+      if (!e.target.closest('.delete-history')) {
+        loadConversation(conversation.id);
       }
-      
-      item.innerHTML = `
-        <div class="history-content">
-          <div class="history-title">${conversation.title}</div>
-          <div class="history-time">${new Date(conversation.timestamp).toLocaleDateString()}</div>
-        </div>
-        <button class="delete-history" data-id="${conversation.id}">
-          <i class="fas fa-trash"></i>
-        </button>
-      `;
-      
-      item.addEventListener('click', (e) => {
-        if (!e.target.closest('.delete-history')) {
-          loadConversation(conversation.id);
-        }
-      });
-      
-      const deleteBtn = item.querySelector('.delete-history');
-      deleteBtn.addEventListener('click', (e) => {
-        e.stopPropagation();
-        deleteConversation(conversation.id);
-      });
-      
-      historyList.appendChild(item);
     });
+    
+    const deleteBtn = item.querySelector('.delete-history');
+    deleteBtn.addEventListener('click', (e) => {
+      e.stopPropagation();
+      deleteConversation(conversation.id);
+    });
+    
+    return item;
   }
   
-  function loadConversation(conversationId) {
-    const history = JSON.parse(localStorage.getItem('chatHistory') || '[]');
-    const conversation = history.find(conv => conv.id === conversationId);
+  async function loadConversation(conversationId) {
+    let conversation, messages;
+    try {
+      const db = await openHistoryDb();
+      const tx = db.transaction(['conversations', 'messages']);
+      [conversation, messages] = await Promise.all([
+        requestResult(tx.objectStore('conversations').get(conversationId)),
+        requestResult(tx.objectStore('messages').index('conversationId').getAll(conversationId))
+      ]);
+    } catch (error) {
+      console.warn('Could not load conversation:', error);
+      return;
+    }
     
     if (conversation) {
       currentConversationId = conversationId;
@@ -888,15 +1286,17 @@ document.addEventListener('DOMContentLoaded', function() {
       
       // Clear and rebuild chat
       chatContainer.innerHTML = '';
+      conversationObjectUrls.forEach(url => URL.revokeObjectURL(url));
+      conversationObjectUrls = [];
       
-      conversation.messages.forEach(msg => {
-        if (msg.user.startsWith('Generate image:')) {
-          // Handle image messages
-          const prompt = msg.user.replace('Generate image: "', '').replace('"', '');
-          const imageMatch = msg.bot.match(/!\[Generated Image\]\((.*?)\)/);
-          if (imageMatch && imageMatch[1]) {
-            addImageMessage(imageMatch[1], prompt, new Date().toISOString());
+      messages.forEach(msg => {
+        if (msg.image) {
+          let src = msg.image.url;
+          if (msg.image.blob) {
+            src = URL.createObjectURL(msg.image.blob);
+            conversationObjectUrls.push(src);
           }
+          addImageMessage(src, msg.image.prompt, msg.timestamp, msg.image);
         } else {
           addMessage(msg.user, 'user');
           addMessage(msg.bot, 'bot');
@@ -904,46 +1304,93 @@ document.addEventListener('DOMContentLoaded', function() {
       });
       
       closeAllPanels();
-      loadConversationHistory();
+      renderHistoryRows();
       saveSettings();
     }
   }
   
-  function deleteConversation(conversationId) {
-    let history = JSON.parse(localStorage.getItem('chatHistory') || '[]');
-    history = history.filter(conv => conv.id !== conversationId);
-    
-    localStorage.setItem('chatHistory', JSON.stringify(history));
+  async function deleteConversation(conversationId) {
+    try {
+      const db = await openHistoryDb();
+      const tx = db.transaction(['conversations', 'messages'], 'readwrite');
+      tx.objectStore('conversations').delete(conversationId);
+      const messages = tx.objectStore('messages');
+      const keys = await requestResult(messages.index('conversationId').getAllKeys(conversationId));
+      keys.forEach(key => messages.delete(key));
+      await transactionDone(tx);
+    } catch (error) {
+      console.warn('Could not delete conversation from history:', error);
+    }
+    fetch(`/conversations/${encodeURIComponent(conversationId)}`, { method: 'DELETE' })
+      .catch(error => console.warn('Could not delete conversation on the server:', error));
     
     if (conversationId === currentConversationId) {
       startNewChat();
     }
     
-    loadConversationHistory();
+    historyRows = historyRows.filter(row => row.id !== conversationId);
+    renderHistoryRows();
     showToast('Conversation deleted');
   }
   
-  function clearAllHistory() {
+  async function clearAllHistory() {
     if (confirm('Are you sure you want to clear all conversation history?')) {
-      localStorage.removeItem('chatHistory');
+      try {
+        const db = await openHistoryDb();
+        const tx = db.transaction(['conversations', 'messages'], 'readwrite');
+        tx.objectStore('conversations').clear();
+        tx.objectStore('messages').clear();
+        await transactionDone(tx);
+      } catch (error) {
+        console.warn('Could not clear chat history:', error);
+      }
+      fetch('/conversations', { method: 'DELETE' })
+        .catch(error => console.warn('Could not clear conversations on the server:', error));
       startNewChat();
       loadConversationHistory();
       showToast('All history cleared!');
     }
   }
   
-  function filterHistory() {
-    const searchTerm = searchInput.value.toLowerCase();
-    const items = historyList.querySelectorAll('.history-item');
-    
-    items.forEach(item => {
-      const title = item.querySelector('.history-title').textContent.toLowerCase();
-      if (title.includes(searchTerm)) {
-        item.style.display = 'flex';
-      } else {
-        item.style.display = 'none';
+  // Conversations whose title or prompts contain words starting with every
+  // search word, found through the 'terms' index rather than the rendered list
+  async function searchHistory(query) {
+    const words = [...new Set(searchTerms(query))];
+    const db = await openHistoryDb();
+    const index = db.transaction('conversations').objectStore('conversations').index('terms');
+    // Look up the longest word (the most selective) and check the rest in memory
+    const lookup = words.reduce((a, b) => (b.length > a.length ? b : a));
+    const candidates = await requestResult(index.getAll(IDBKeyRange.bound(lookup, lookup + '\uffff')));
+    
+    const matches = new Map();
+    candidates.forEach(conversation => {
+      if (words.every(word => conversation.terms.some(term => term.startsWith(word)))) {
+        matches.set(conversation.id, conversation);
       }
     });
+    return [...matches.values()].sort((a, b) => (a.updated < b.updated ? 1 : -1));
+  }
+  
+  function filterHistory() {
+    clearTimeout(historySearchTimer);
+    historySearchTimer = setTimeout(async () => {
+      const query = searchInput.value;
+      if (!searchTerms(query).length) {
+        historySection.scrollTop = 0;
+        loadConversationHistory();
+        return;
+      }
+      try {
+        const results = await searchHistory(query);
+        // Ignore results for a query the user has already changed
+        if (query !== searchInput.value) return;
+        historyRows = results;
+        historySection.scrollTop = 0;
+        renderHistoryRows();
+      } catch (error) {
+        console.warn('Could not search chat history:', error);
+      }
+    }, 150);
   }
   
   function showToast(message) {
@@ -0,0 +1,190 @@
+"""Streaming text extraction for PDF, DOCX and TXT attachments
+
+Documents are read page by page (PDF), paragraph by paragraph (DOCX) or in
+fixed-size blocks (TXT) and the text is written straight to a cache file, so
+memory use stays bounded however large the document is. PDFs with many
+pages are split into page ranges that are extracted in a process pool.
+
+Extracted text is cached on disk by the file's SHA-256 (its upload file ID),
+so attaching the same document again does not extract it a second time.
+
+PDF support needs the optional ``pypdf`` package; without it PDFs fall back
+to the ``[Attached file: name]`` placeholder. DOCX and TXT need only the
+standard library.
+"""
+import os
+import threading
+import uuid
+from collections import deque
+from itertools import islice
+
+PARALLEL_MIN_PAGES = int(os.environ.get('EXTRACTION_PARALLEL_MIN_PAGES', 40))
+PAGES_PER_TASK = int(os.environ.get('EXTRACTION_PAGES_PER_TASK', 20))
+WORKERS = int(os.environ.get('EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+TEXT_BLOCK_SIZE = 64 * 1024
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class UnsupportedDocument(Exception):
+    pass
+
+
+def document_kind(name, mime_type=''):
+    """'pdf', 'docx', 'txt' or None for a file name / MIME type"""
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.pdf' or mime_type == 'application/pdf':
+        return 'pdf'
+    if extension == '.docx' or mime_type.endswith('wordprocessingml.document'):
+        return 'docx'
+    if extension == '.txt' or mime_type.startswith('text/'):
+        return 'txt'
+    return None
+
+
+def iter_text_blocks(path):
+    """Yield a text file in fixed-size decoded blocks"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            block = f.read(TEXT_BLOCK_SIZE)
+            if not block:
+                break
+            yield block
+
+
+def iter_docx_paragraphs(path):
+    """Yield the paragraphs of a DOCX file without loading the whole document XML"""
+    import zipfile
+    from xml.etree.ElementTree import iterparse
+
+    with zipfile.ZipFile(path) as archive:
+        with archive.open('word/document.xml') as document:
+            texts = []
+            for event, element in iterparse(document, events=('end',)):
+                if element.tag == WORD_NS + 't':
+                    texts.append(element.text or '')
+                elif element.tag == WORD_NS + 'tab':
+                    texts.append('\t')
+                elif element.tag == WORD_NS + 'p':
+                    yield ''.join(texts) + '\n'
+                    texts = []
+                    element.clear()
+
+
+def load_pdf_reader(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedDocument('PDF extraction requires the pypdf package')
+    return PdfReader(path)
+
+
+def extract_pdf_pages(path, start, stop):
+    """Text of pages ``start``..``stop - 1``; runs in a worker process for large PDFs"""
+    reader = load_pdf_reader(path)
+    return [(reader.pages[i].extract_text() or '') + '\n' for i in range(start, stop)]
+
+
+class TextExtractor:
+    """Extracts attachment text into a cache directory keyed by content hash"""
+
+    def __init__(self, cache_folder, workers=WORKERS):
+        self.cache_folder = cache_folder
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.in_progress = {}
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def cache_path(self, file_id):
+        return os.path.join(self.cache_folder, f"{file_id}.txt")
+
+    def get_pool(self):
+        """Executor for page ranges, created on first use
+
+        Processes are spawned rather than forked: web workers are
+        multithreaded, and a forked child can inherit a lock held by another
+        thread and deadlock. Daemonic workers (hypercorn's) may not have
+        children, so they extract on threads.
+        """
+        # Imported here: multiprocessing is only needed once work arrives,
+        # and keeping it out of the import speeds up worker start
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        with self.lock:
+            if self.pool is None:
+                if multiprocessing.current_process().daemon:
+                    self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='text-extraction')
+                else:
+                    self.pool = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+            return self.pool
+
+    def iter_pdf_pages(self, path):
+        reader = load_pdf_reader(path)
+        page_count = len(reader.pages)
+        if page_count < PARALLEL_MIN_PAGES or self.workers < 2:
+            for page in reader.pages:
+                yield (page.extract_text() or '') + '\n'
+            return
+
+        # Each task reopens the file and extracts its own page range; results
+        # come back in order and are written out as soon as they arrive. Only
+        # a window of ranges is in flight, so finished ranges cannot pile up
+        # ahead of a slow consumer and memory stays bounded for any page count
+        del reader
+        ranges = ((start, min(start + PAGES_PER_TASK, page_count)) for start in range(0, page_count, PAGES_PER_TASK))
+        pool = self.get_pool()
+        futures = deque(pool.submit(extract_pdf_pages, path, *pages) for pages in islice(ranges, self.workers * 2))
+        try:
+            while futures:
+                texts = futures.popleft().result()
+                pages = next(ranges, None)
+                if pages is not None:
+                    futures.append(pool.submit(extract_pdf_pages, path, *pages))
+                yield from texts
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def iter_pages(self, path, kind):
+        if kind == 'pdf':
+            return self.iter_pdf_pages(path)
+        if kind == 'docx':
+            return iter_docx_paragraphs(path)
+        if kind == 'txt':
+            return iter_text_blocks(path)
+        raise UnsupportedDocument(f"No text extractor for {kind or 'this file type'}")
+
+    def extract(self, file_id, path, kind):
+        """Path of the cached text for a file, extracting it first if needed
+
+        Concurrent calls for the same file wait for a single extraction.
+        """
+        cached = self.cache_path(file_id)
+        if os.path.exists(cached):
+            return cached
+
+        with self.lock:
+            file_lock = self.in_progress.setdefault(file_id, threading.Lock())
+        with file_lock:
+            if not os.path.exists(cached):
+                temp_path = f"{cached}.{uuid.uuid4().hex}.tmp"
+                try:
+                    with open(temp_path, 'w', encoding='utf-8') as out:
+                        for page in self.iter_pages(path, kind):
+                            out.write(page)
+                    os.replace(temp_path, cached)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+        with self.lock:
+            self.in_progress.pop(file_id, None)
+        return cached
+
+    def read(self, file_id, path, kind, max_chars):
+        """Up to ``max_chars`` of a file's text and whether it was truncated"""
+        with open(self.extract(file_id, path, kind), 'r', encoding='utf-8') as f:
+            text = f.read(max_chars + 1)
+        return text[:max_chars], len(text) > max_chars
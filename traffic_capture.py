@@ -0,0 +1,131 @@
+"""Opt-in capture of request shapes for capacity planning and replay
+
+With ``TRAFFIC_CAPTURE_PATH`` set, each chat, slash-command and image
+request is appended to that file as one JSON line. The line records when the
+request arrived, how long it took, its status, payload sizes and attachment
+types. It never contains message text, prompts, system prompts, file names,
+headers (so no API keys or cookies) or client addresses. Sessions are
+recorded as a keyed hash, so a session's requests can be grouped without
+revealing who sent them. ``benchmarks/replay_traffic.py`` re-issues a capture
+against a local instance.
+
+Every worker appends to the same file. Each record is written in a single
+append, so lines from different processes do not interleave.
+``TRAFFIC_CAPTURE_SAMPLE_RATE`` keeps that fraction of sessions, whole.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+CAPTURE_PATH = os.environ.get('TRAFFIC_CAPTURE_PATH', '')
+SAMPLE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', 1))
+
+# Captured POST routes and the kind of request each one is
+ROUTES = {
+    '/send_message': 'chat',
+    '/stream_message': 'stream',
+    '/generate_image': 'image',
+    '/image_jobs': 'image_job'
+}
+
+logger = logging.getLogger(__name__)
+
+
+def number_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TrafficRecorder:
+    """Appends sanitized request records to a JSONL file
+
+    ``key`` keys the session hashes; pass the app's secret key so every
+    worker hashes a session the same way.
+    """
+
+    def __init__(self, path, key, sample_rate=SAMPLE_RATE):
+        self.path = path
+        self.key = key if isinstance(key, bytes) else str(key).encode('utf-8')
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.fd = None
+        self.fd_pid = None
+        self.records = 0
+        self.failures = 0
+
+    def pseudonym(self, value):
+        return hmac.new(self.key, str(value).encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+    def sampled(self, session_id):
+        """Whether requests of this session are captured (sampling keeps or drops whole sessions)"""
+        if self.sample_rate >= 1:
+            return True
+        return int(self.pseudonym(session_id), 16) / 16 ** 16 < self.sample_rate
+
+    def describe(self, route, body, session_id, request_bytes, command=None, attachment_size=None):
+        """Sanitized record of a request, to be completed by :meth:`finish`
+
+        ``command`` is the slash command a message starts with (e.g.
+        ``/quick``; ``message_chars`` includes it), and
+        ``attachment_size(file)`` returns an attachment's size in bytes when
+        it is known.
+        """
+        kind = ROUTES[route]
+        record = {
+            'ts': round(time.time(), 3),
+            'route': route,
+            'kind': 'command' if command else kind,
+            'session': self.pseudonym(session_id) if session_id else None,
+            'request_bytes': request_bytes
+        }
+        if kind in ('image', 'image_job'):
+            record['prompt_chars'] = len(str(body.get('prompt') or ''))
+            return record
+
+        message = str(body.get('message') or '')
+        record.update({
+            'message_chars': len(message),
+            'system_prompt_chars': len(str(body.get('system_prompt') or '')),
+            'temperature': number_or_none(body.get('temperature')),
+            'history': body.get('history', True) is not False,
+            'attachments': [
+                {'type': str(f.get('type') or ''), 'bytes': attachment_size(f) if attachment_size else None}
+                for f in body.get('files') or () if isinstance(f, dict)
+            ]
+        })
+        if command:
+            record['command'] = command
+        return record
+
+    def finish(self, record, status, seconds, response_bytes):
+        record.update({
+            'status': status,
+            'duration_ms': round(seconds * 1000, 1),
+            'response_bytes': response_bytes
+        })
+        self.write(record)
+
+    def write(self, record):
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        try:
+            with self.lock:
+                if self.fd_pid != os.getpid():
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                    self.fd_pid = os.getpid()
+                os.write(self.fd, line)
+                self.records += 1
+        except OSError as e:
+            with self.lock:
+                self.failures += 1
+            logger.warning("Could not write traffic capture record: %s", e)
+
+    def stats(self):
+        with self.lock:
+            return {'path': self.path, 'sample_rate': self.sample_rate, 'records': self.records, 'failures': self.failures}
@@ -0,0 +1,229 @@
+"""Shared HTTP client for upstream API calls (Gemini and Hugging Face)
+
+Every upstream request goes through ``post`` (or ``async_post`` in the ASGI
+serving mode) so that connections are kept alive and pooled per host, and
+transient failures (429/5xx) are retried with jittered exponential backoff.
+Each attempt is first admitted by the host's token bucket in ``admission``,
+and 429 responses feed their Retry-After back into it.
+"""
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import admission
+
+# Pool and retry configuration (overridable through the environment)
+POOL_CONNECTIONS = int(os.environ.get('UPSTREAM_POOL_CONNECTIONS', 4))
+POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 32))
+CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+MAX_RETRIES = int(os.environ.get('UPSTREAM_MAX_RETRIES', 2))
+BACKOFF_BASE = float(os.environ.get('UPSTREAM_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.environ.get('UPSTREAM_BACKOFF_MAX', 8))
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('UPSTREAM_ASYNC_MAX_CONNECTIONS', 500))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_async_client = None
+
+
+def get_session(url):
+    """Return the pooled session for the host of ``url``, creating it on first use"""
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    pool_block=False
+                )
+                session.mount(host, adapter)
+                _sessions[host] = session
+    return session
+
+
+def warm(urls, connections=1, timeout=CONNECT_TIMEOUT):
+    """Open ``connections`` pooled keep-alive connections to each host in ``urls``
+
+    Sends concurrent HEAD requests to each host's root so the TCP and TLS
+    handshakes are done before the first real call; the connections stay in
+    the host's session pool. These are not API calls, so they bypass
+    admission. Failures are ignored. Returns the number of connections opened.
+    """
+    hosts = {f"{parts.scheme}://{parts.netloc}" for parts in map(urlsplit, urls)}
+    opened = []
+
+    def connect(host):
+        try:
+            get_session(host).head(host + '/', timeout=timeout, allow_redirects=False).close()
+            opened.append(host)
+        except requests.exceptions.RequestException:
+            pass
+
+    threads = [threading.Thread(target=connect, args=(host,)) for host in hosts for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(opened)
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX))
+    return delay
+
+
+def note_rate_limit(url, response):
+    """Return the response's Retry-After, pausing the host's admission bucket on a 429"""
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+    if response.status_code == 429:
+        admission.penalize(url, retry_after if retry_after is not None else BACKOFF_BASE)
+    return retry_after
+
+
+def post(url, json=None, headers=None, timeout=60, stream=False,
+         retry_statuses=RETRY_STATUSES, max_retries=MAX_RETRIES):
+    """POST through the pooled session for ``url``'s host, retrying transient failures
+
+    ``timeout`` is the read timeout; the connect timeout is ``CONNECT_TIMEOUT``.
+    Responses with a status in ``retry_statuses`` are retried up to
+    ``max_retries`` times and the last response is returned as-is, so callers
+    keep using ``raise_for_status`` and status checks exactly as before.
+    Connection errors are retried too; read timeouts are not, since the
+    upstream already spent the full budget on the request.
+
+    Raises ``admission.Overloaded`` if the host's rate limit cannot admit the
+    request within the wait allowed for the current priority.
+    """
+    session = get_session(url)
+    attempt = 0
+    pause = 0.0
+
+    while True:
+        # Admission comes first so a saturated upstream fails fast instead of after the backoff
+        delay = max(admission.reserve(url), pause)
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            response = session.post(
+                url,
+                json=json,
+                headers=headers,
+                timeout=(CONNECT_TIMEOUT, timeout),
+                stream=stream
+            )
+        except requests.exceptions.ConnectionError:
+            if attempt >= max_retries:
+                raise
+            pause = backoff_delay(attempt)
+            attempt += 1
+            continue
+
+        retry_after = note_rate_limit(url, response)
+        if response.status_code in retry_statuses and attempt < max_retries:
+            response.close()
+            pause = backoff_delay(attempt, retry_after)
+            attempt += 1
+            continue
+
+        return response
+
+
+def get_async_client():
+    """Return the shared httpx.AsyncClient, creating it on first use
+
+    httpx is only needed for the ASGI serving mode, so it is imported lazily.
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=POOL_MAXSIZE
+            ),
+            timeout=httpx.Timeout(60, connect=CONNECT_TIMEOUT)
+        )
+    return _async_client
+
+
+async def close_async_client():
+    """Close the shared async client (called on ASGI shutdown)"""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def async_post(url, json=None, headers=None, timeout=60, stream=False,
+                     retry_statuses=RETRY_STATUSES, max_retries=MAX_RETRIES):
+    """Async counterpart of ``post`` built on the shared httpx client
+
+    With ``stream=True`` the body is not read and the caller must
+    ``await response.aclose()`` when done.
+    """
+    import asyncio
+    import httpx
+
+    client = get_async_client()
+    attempt = 0
+    pause = 0.0
+
+    while True:
+        delay = max(admission.reserve(url), pause)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request = client.build_request(
+            'POST',
+            url,
+            json=json,
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT)
+        )
+        try:
+            response = await client.send(request, stream=stream)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt >= max_retries:
+                raise
+            pause = backoff_delay(attempt)
+            attempt += 1
+            continue
+
+        retry_after = note_rate_limit(url, response)
+        if response.status_code in retry_statuses and attempt < max_retries:
+            await response.aclose()
+            pause = backoff_delay(attempt, retry_after)
+            attempt += 1
+            continue
+
+        return response